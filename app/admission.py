@@ -0,0 +1,99 @@
+import threading
+import time
+from typing import Dict, Optional
+
+
+class AdmissionController:
+    """Caps concurrent model generations, with a bounded, time-limited wait queue.
+
+    Up to ``max_in_flight`` slots are held at once. A caller usually takes
+    one, but may take several when its work costs more, e.g. a turn that
+    runs its own ``generate`` call where others share a batched one.
+    Callers that don't fit wait in a queue of at most ``max_queue`` for up
+    to ``queue_timeout`` seconds; when the queue is full or the wait times
+    out, ``acquire`` returns False and the caller should answer without
+    the model instead.
+    """
+
+    def __init__(self, max_in_flight: int = 2, max_queue: int = 16, queue_timeout: Optional[float] = 5.0):
+        """Initialize the controller.
+
+        Args:
+            max_in_flight: Most slots held at once
+            max_queue: Most callers waiting for a slot (0 sheds as soon as all slots are busy)
+            queue_timeout: Longest a caller waits for a slot, in seconds (None waits indefinitely)
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def acquire(self, timeout: Optional[float] = None, weight: int = 1) -> bool:
+        """Take generation slots, waiting in the queue if too few are free.
+
+        Args:
+            timeout: Longest to wait in seconds; capped at ``queue_timeout``
+            weight: Slots to take (capped at ``max_in_flight``)
+
+        Returns:
+            True if the slots were taken (give them back with ``release``),
+            False if the request should be shed
+        """
+        if self.queue_timeout is not None:
+            timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        weight = min(max(1, weight), self.max_in_flight)
+        with self._condition:
+            if self.in_flight + weight <= self.max_in_flight and self.queued == 0:
+                self.in_flight += weight
+                self.admitted += 1
+                return True
+            if self.queued >= self.max_queue:
+                self.rejected_queue_full += 1
+                return False
+
+            self.queued += 1
+            try:
+                deadline = None if timeout is None else time.monotonic() + max(0.0, timeout)
+                while self.in_flight + weight > self.max_in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.rejected_timeout += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.in_flight += weight
+            self.admitted += 1
+            return True
+
+    def release(self, weight: int = 1) -> None:
+        """Give back slots taken with ``acquire`` (pass the same weight).
+
+        Raises:
+            ValueError: If more slots are released than are held
+        """
+        weight = min(max(1, weight), self.max_in_flight)
+        with self._condition:
+            if weight > self.in_flight:
+                raise ValueError(f"Releasing {weight} slots with only {self.in_flight} held")
+            self.in_flight -= weight
+            # Waiters may need different numbers of slots, so let each one check
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the current load and the admission counters."""
+        with self._condition:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout
+            }
@@ -0,0 +1,167 @@
+import ctypes
+import gc
+import logging
+import warnings
+from typing import Any, Callable, Dict
+
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+
+def _eager(model: nn.Module) -> nn.Module:
+    """Plain fp32 PyTorch, as loaded by ``from_pretrained``."""
+    return model.eval()
+
+
+def _linearize_conv1d(model: nn.Module) -> nn.Module:
+    """Swap GPT-2's ``Conv1D`` projections for equivalent ``nn.Linear`` layers.
+
+    ``Conv1D`` is a linear layer with transposed weights; dynamic quantization
+    only recognises ``nn.Linear``, so without this only the LM head would be
+    quantized.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features, device="meta")
+                # A transposed view: quantization copies the weights anyway
+                linear.weight = nn.Parameter(child.weight.detach().t())
+                linear.bias = nn.Parameter(child.bias.detach())
+                setattr(parent, name, linear)
+    return model
+
+
+def _release_freed_memory() -> None:
+    """Hand memory freed by the allocator back to the OS (glibc only; a no-op elsewhere)."""
+    # Replaced modules can sit in reference cycles until the next collection
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _int8(model: nn.Module) -> nn.Module:
+    """Dynamically quantized int8 linear layers (weights int8, activations quantized per call)."""
+    model = _linearize_conv1d(model.eval())
+    # In place, so the fp32 weights are released as each layer is quantized instead of copying the model
+    model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    # Otherwise the freed fp32 weights stay resident in the heap
+    _release_freed_memory()
+    return model
+
+
+class _Prefill(nn.Module):
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                          use_cache=True, return_dict=False)
+
+
+class _Decode(nn.Module):
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids, past_key_values):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                          past_key_values=past_key_values, use_cache=True, return_dict=False)
+
+
+class TracedForward:
+    """Replacement ``forward`` that runs TorchScript graphs traced from the model.
+
+    ``generate`` calls the model twice over: once on the whole prompt without
+    a cache (prefill) and then once per new token with a cache (decode). Each
+    call shape gets its own traced graph; calls asking for anything else
+    (attentions, hidden states, labels, embeddings) use the eager forward.
+    """
+
+    def __init__(self, model: nn.Module, example_length: int = 8):
+        """Trace the prefill and decode graphs.
+
+        Args:
+            model: A causal LM returning ``(logits, past_key_values)`` with ``return_dict=False``
+            example_length: Prompt length used for the example trace inputs
+        """
+        self.eager_forward = model.forward
+        input_ids = torch.ones(1, example_length, dtype=torch.long)
+        attention_mask = torch.ones(1, example_length, dtype=torch.long)
+        position_ids = torch.arange(example_length).unsqueeze(0)
+
+        with torch.no_grad(), warnings.catch_warnings():
+            # Traced shapes are recomputed from the inputs; the tracer can't tell and warns
+            warnings.simplefilter("ignore", torch.jit.TracerWarning)
+            self.prefill = torch.jit.trace(_Prefill(model), (input_ids, attention_mask, position_ids),
+                                           check_trace=False)
+            _, past_key_values = self.prefill(input_ids, attention_mask, position_ids)
+            self.decode = torch.jit.trace(
+                _Decode(model),
+                (input_ids[:, :1], torch.ones(1, example_length + 1, dtype=torch.long),
+                 torch.tensor([[example_length]]), past_key_values),
+                check_trace=False
+            )
+
+    def __call__(self, input_ids=None, past_key_values=None, attention_mask=None, position_ids=None, **kwargs):
+        from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
+
+        unsupported = (
+            input_ids is None
+            or kwargs.get("use_cache") is False
+            or any(kwargs.get(name) is not None for name in ("inputs_embeds", "labels", "head_mask"))
+            or kwargs.get("output_attentions") or kwargs.get("output_hidden_states")
+        )
+        if unsupported:
+            return self.eager_forward(input_ids=input_ids, past_key_values=past_key_values,
+                                      attention_mask=attention_mask, position_ids=position_ids, **kwargs)
+
+        past_length = past_key_values[0][0].shape[-2] if past_key_values else 0
+        if attention_mask is None:
+            attention_mask = input_ids.new_ones(input_ids.shape[0], past_length + input_ids.shape[1])
+        if position_ids is None:
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1]:]
+
+        if past_key_values is None:
+            logits, presents = self.prefill(input_ids, attention_mask, position_ids)
+        else:
+            logits, presents = self.decode(input_ids, attention_mask, position_ids, past_key_values)
+        return CausalLMOutputWithCrossAttentions(logits=logits, past_key_values=presents)
+
+
+def _jit(model: nn.Module) -> nn.Module:
+    """TorchScript graphs traced from the eager model, driven by the usual ``generate`` loop."""
+    model = model.eval()
+    model.forward = TracedForward(model)
+    return model
+
+
+# Inference backends by name; each takes the loaded model and returns the model to serve
+BACKENDS: Dict[str, Callable[[nn.Module], Any]] = {
+    "eager": _eager,
+    "int8": _int8,
+    "jit": _jit
+}
+
+
+def prepare_model(model: nn.Module, backend: str = "eager") -> nn.Module:
+    """Adapt a loaded model to an inference backend.
+
+    Args:
+        model: The model returned by ``from_pretrained``
+        backend: One of ``BACKENDS``
+
+    Returns:
+        The model to serve; it still exposes ``generate``
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (choose from {', '.join(BACKENDS)})")
+    logger.info(f"Preparing inference backend: {backend}")
+    return BACKENDS[backend](model)
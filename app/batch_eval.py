@@ -0,0 +1,416 @@
+# Offline batch evaluation: replay logged user turns through the chatbot.
+#
+# Reads JSONL logs (one turn per line with session_id and user_message,
+# e.g. logs/session_*.jsonl) and legacy logs/session_*.json files, replays
+# each conversation in order so the bot rebuilds its history, and writes one
+# JSON line per turn with the safety classification, the path that answered
+# it and the reply. Many conversations are replayed side by side: the safety
+# checks for a wave of turns run in one pass and their model calls share one
+# batched generate. Sessions are hash-sharded across worker processes, and
+# results are checkpointed per conversation so an interrupted run can resume.
+#
+# Usage:
+#     python -m app.batch_eval logs --output eval.jsonl [--workers 4] [--batch-size 16] [--resume]
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+# The replay builds its own chatbot; don't let the import-time default instance load a model too
+os.environ.setdefault("CHATBOT_LOAD_MODE", "lazy")
+
+from app.chatbot import MentalHealthChatbot
+from app.sessions import SessionStore
+
+logger = logging.getLogger(__name__)
+
+
+class Conversation(NamedTuple):
+    """A run of consecutive turns from one session in one input file."""
+    key: str
+    session_id: str
+    turns: List[Dict[str, Any]]
+
+
+def shard_of(session_id: str, shards: int) -> int:
+    """Stable shard for a session, the same in every process and run."""
+    return zlib.crc32(session_id.encode("utf-8")) % shards
+
+
+def input_files(paths: Sequence[str]) -> List[str]:
+    """Expand directories to the session logs inside them, in a stable order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "session_*.jsonl")) +
+                                glob.glob(os.path.join(path, "session_*.json"))))
+        else:
+            files.append(path)
+    return files
+
+
+def session_file_groups(paths: Sequence[str]) -> List[List[str]]:
+    """Group the input files so each session's logs are replayed together.
+
+    An unmigrated session may have both a legacy JSON log and a JSONL log;
+    they are grouped with the JSON first, the order ``get_session_history``
+    reads them in. Files not named after a session form groups of their own.
+    """
+    groups: Dict[Any, List[str]] = {}
+    for path in input_files(paths):
+        session_id = _session_id_from_name(path)
+        groups.setdefault(session_id if session_id is not None else (path,), []).append(path)
+    for files in groups.values():
+        files.sort(key=lambda path: not path.endswith(".json"))
+    return list(groups.values())
+
+
+def _session_id_from_name(path: str) -> Optional[str]:
+    name = os.path.basename(path)
+    for suffix in (".jsonl", ".json"):
+        if name.startswith("session_") and name.endswith(suffix):
+            return name[len("session_"):-len(suffix)]
+    return None
+
+
+def _read_turns(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yield ``(line_number, record)`` for each turn in a JSONL or legacy JSON log."""
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            session_logs = json.load(f)
+        session_id = session_logs.get("session_id") or _session_id_from_name(path)
+        for number, entry in enumerate(session_logs.get("conversations", []), 1):
+            yield number, dict(entry, session_id=session_id)
+        return
+
+    fallback_session_id = _session_id_from_name(path)
+    with open(path, "r") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.error(f"Skipping corrupt line {number} in {path}")
+                continue
+            record.setdefault("session_id", fallback_session_id)
+            yield number, record
+
+
+def _read_group(files: Sequence[str]) -> Iterator[Tuple[str, int, Dict[str, Any]]]:
+    """Yield ``(path, line_number, record)`` for each turn in a group of logs, file by file."""
+    for path in files:
+        for number, record in _read_turns(path):
+            yield path, number, record
+
+
+def iter_conversations(paths: Sequence[str], shard: int = 0, shards: int = 1) -> Iterator[Conversation]:
+    """Stream the conversations in the input files that belong to one shard.
+
+    Consecutive turns with the same session_id form one conversation and
+    only one is held in memory at a time. A session's legacy JSON and JSONL
+    logs are read back to back as one conversation. A session whose turns
+    are not contiguous in a file is replayed as separate conversations,
+    each with its own history.
+
+    Args:
+        paths: Log files or directories of session logs
+        shard: Which shard to yield
+        shards: Total number of shards
+    """
+    for files in session_file_groups(paths):
+        # Per-session logs are sharded by file name without being opened
+        file_session_id = _session_id_from_name(files[0])
+        if file_session_id is not None and shard_of(file_session_id, shards) != shard:
+            continue
+        current: Optional[Conversation] = None
+        for path, number, record in _read_group(files):
+            session_id = record.get("session_id")
+            user_message = record.get("user_message", record.get("message"))
+            if not session_id or not isinstance(user_message, str):
+                continue
+            if current is not None and current.session_id != session_id:
+                yield current
+                current = None
+            if current is None:
+                if shard_of(session_id, shards) != shard:
+                    continue
+                current = Conversation(f"{path}:{number}", session_id, [])
+            current.turns.append({
+                "user_message": user_message,
+                "timestamp": record.get("timestamp"),
+                "logged_response": record.get("bot_response")
+            })
+        if current is not None:
+            yield current
+
+
+class _Replay:
+    __slots__ = ("conversation", "position", "records")
+
+    def __init__(self, conversation: Conversation):
+        self.conversation = conversation
+        self.position = 0
+        self.records: List[Dict[str, Any]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self.conversation.turns)
+
+
+def _load_checkpoint(path: str) -> Tuple[Set[str], int, int]:
+    """Read the finished conversations, the output size they account for, and
+    the length of the checkpoint's complete lines."""
+    done: Set[str] = set()
+    offset = 0
+    complete = 0
+    if not os.path.exists(path):
+        return done, offset, complete
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                entry = json.loads(line) if line.endswith(b"\n") else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                # A torn last line; the conversation it named is replayed again
+                break
+            done.add(entry["key"])
+            offset = max(offset, entry["offset"])
+            complete += len(line)
+    return done, offset, complete
+
+
+def evaluate_shard(bot: MentalHealthChatbot, paths: Sequence[str], output: str, batch_size: int = 16,
+                   shard: int = 0, shards: int = 1, resume: bool = False,
+                   budget_ms: Optional[float] = None) -> Dict[str, Any]:
+    """Replay one shard's conversations through a chatbot and stream the results to a file.
+
+    Up to ``batch_size`` conversations are replayed side by side; each wave
+    takes the next turn of each of them, so their model calls are batched
+    together. A conversation's results are written once it has finished,
+    followed by a checkpoint line in ``<output>.checkpoint``. With
+    ``resume``, conversations in the checkpoint are skipped and output from
+    any unfinished one is discarded.
+
+    Args:
+        bot: The chatbot to replay through (its batcher sets how model calls are grouped)
+        paths: Log files or directories of session logs
+        output: JSONL file for the results
+        batch_size: Conversations replayed side by side
+        shard: Which shard of the sessions to replay
+        shards: Total number of shards
+        resume: Continue from the checkpoint instead of starting over
+        budget_ms: Latency budget per wave of model calls (None for the bot's default)
+
+    Returns:
+        Counts of conversations and turns replayed, and of turns per response path
+    """
+    checkpoint_path = f"{output}.checkpoint"
+    done, offset, complete = _load_checkpoint(checkpoint_path) if resume else (set(), 0, 0)
+    summary: Dict[str, Any] = {"conversations": 0, "turns": 0, "skipped": len(done), "paths": Counter()}
+
+    conversations = (conversation for conversation in iter_conversations(paths, shard, shards)
+                     if conversation.key not in done)
+    active: List[_Replay] = []
+    with open(output, "ab" if resume else "wb") as out, open(checkpoint_path, "a" if resume else "w") as checkpoint:
+        if resume:
+            # Drop output from unfinished conversations and any torn checkpoint line, so appends start clean
+            out.truncate(offset)
+            checkpoint.truncate(complete)
+        while True:
+            while len(active) < batch_size:
+                conversation = next(conversations, None)
+                if conversation is None:
+                    break
+                active.append(_Replay(conversation))
+            if not active:
+                break
+
+            turns = [replay.conversation.turns[replay.position] for replay in active]
+            messages = [turn["user_message"] for turn in turns]
+            classifications = bot.matcher.classify_many(messages)
+            replies = bot.get_responses([(message, replay.conversation.key)
+                                         for message, replay in zip(messages, active)],
+                                        classifications, budget_ms=budget_ms)
+
+            for replay, turn, classification, (response, path) in zip(active, turns, classifications, replies):
+                replay.records.append({
+                    "session_id": replay.conversation.session_id,
+                    "source": replay.conversation.key,
+                    "turn": replay.position,
+                    "timestamp": turn["timestamp"],
+                    "user_message": turn["user_message"],
+                    "offensive": classification.offensive,
+                    "crisis": classification.crisis,
+                    "topic": classification.topic,
+                    "response_path": path,
+                    "response": response,
+                    "logged_response": turn["logged_response"]
+                })
+                replay.position += 1
+                summary["paths"][path] += 1
+            summary["turns"] += len(turns)
+
+            for replay in active:
+                if not replay.finished:
+                    continue
+                out.write("".join(json.dumps(record) + "\n" for record in replay.records).encode("utf-8"))
+                out.flush()
+                checkpoint.write(json.dumps({"key": replay.conversation.key, "offset": out.tell()}) + "\n")
+                checkpoint.flush()
+                bot.sessions.pop(replay.conversation.key)
+                summary["conversations"] += 1
+            active = [replay for replay in active if not replay.finished]
+
+    summary["paths"] = dict(summary["paths"])
+    return summary
+
+
+def _part_path(output: str, shard: int, shards: int) -> str:
+    return f"{output}.part{shard}of{shards}"
+
+
+def _configure_logging() -> None:
+    # Progress from this module only; the chatbot's per-turn info logs would drown it
+    # (app.chatbot already configured the root logger on import, so set its level directly)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+
+def _run_shard(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a chatbot in this process and replay one shard (worker entry point)."""
+    import torch
+
+    _configure_logging()
+    shard, shards = options["shard"], options["shards"]
+    if options.get("torch_threads"):
+        torch.set_num_threads(options["torch_threads"])
+    random.seed(options["seed"] + shard)
+    torch.manual_seed(options["seed"] + shard)
+
+    bot = MentalHealthChatbot(
+        model_name=options["model"],
+        batch_max_size=options["batch_size"],
+        batch_max_wait_ms=1.0,
+        max_new_tokens=options["max_new_tokens"],
+        load_mode="eager",
+        backend=options["backend"],
+        generation_budget_ms=options["budget_ms"] or None,
+        # Finished conversations are popped, so only the active ones are ever held
+        session_store=SessionStore(max_entries=None, idle_ttl=None)
+    )
+    if not bot.model_loaded:
+        # Otherwise every turn would quietly come back as a rule_fallback reply
+        raise RuntimeError(f"Model failed to load: {options['model']}")
+    started = time.perf_counter()
+    summary = evaluate_shard(bot, options["paths"], _part_path(options["output"], shard, shards),
+                             batch_size=options["batch_size"], shard=shard, shards=shards,
+                             resume=options["resume"])
+    summary["seconds"] = time.perf_counter() - started
+    if bot.batcher is not None:
+        bot.batcher.close()
+    logger.info(f"Shard {shard + 1}/{shards}: {summary['turns']} turns from "
+                f"{summary['conversations']} conversations in {summary['seconds']:.1f}s")
+    return summary
+
+
+def evaluate(paths: Sequence[str], output: str, workers: int = 1, batch_size: int = 16,
+             resume: bool = False, model: str = "microsoft/DialoGPT-small", backend: str = "eager",
+             max_new_tokens: int = 64, budget_ms: Optional[float] = None, seed: int = 0) -> Dict[str, Any]:
+    """Replay logged conversations through fresh chatbots in parallel worker processes.
+
+    Each worker loads its own model, replays the sessions that hash to its
+    shard into ``<output>.part<i>of<n>``, and the parts are joined into
+    ``output`` (grouped by shard, then in the order conversations finished)
+    once every worker is done. Resuming needs the same ``workers`` count as
+    the interrupted run.
+
+    Args:
+        paths: Log files or directories of session logs
+        output: JSONL file for the results
+        workers: Worker processes, one shard each
+        batch_size: Conversations replayed side by side in each worker
+        resume: Continue each shard from its checkpoint
+        model: Model name or local path
+        backend: Inference backend (see ``app.backends``)
+        max_new_tokens: Most tokens generated per reply
+        budget_ms: Latency budget per wave of model calls (None for no budget)
+        seed: Base random seed; worker ``i`` uses ``seed + i``
+
+    Returns:
+        Totals across workers plus the per-shard summaries
+    """
+    workers = max(1, workers)
+    base = {
+        "paths": list(paths), "output": output, "shards": workers, "batch_size": batch_size,
+        "resume": resume, "model": model, "backend": backend, "max_new_tokens": max_new_tokens,
+        "budget_ms": budget_ms, "seed": seed,
+        # Split the cores between workers so they don't oversubscribe them
+        "torch_threads": max(1, multiprocessing.cpu_count() // workers) if workers > 1 else None
+    }
+    shard_options = [dict(base, shard=shard) for shard in range(workers)]
+    if workers == 1:
+        summaries = [_run_shard(shard_options[0])]
+    else:
+        # Fresh interpreters rather than forks: torch's thread pools don't survive fork
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            summaries = pool.map(_run_shard, shard_options)
+
+    with open(output, "wb") as out:
+        for shard in range(workers):
+            with open(_part_path(output, shard, workers), "rb") as part:
+                shutil.copyfileobj(part, out)
+    for shard in range(workers):
+        part = _part_path(output, shard, workers)
+        os.remove(part)
+        os.remove(f"{part}.checkpoint")
+
+    paths_total: Counter = Counter()
+    for summary in summaries:
+        paths_total.update(summary["paths"])
+    return {
+        "conversations": sum(summary["conversations"] for summary in summaries),
+        "turns": sum(summary["turns"] for summary in summaries),
+        "skipped": sum(summary["skipped"] for summary in summaries),
+        "paths": dict(paths_total),
+        "shards": summaries
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay logged conversations through the chatbot in batches.")
+    parser.add_argument("paths", nargs="+", help="JSONL/JSON session logs, or directories of session_* logs")
+    parser.add_argument("--output", required=True, help="JSONL file for one result per replayed turn")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (sessions are hash-sharded)")
+    parser.add_argument("--batch-size", type=int, default=16, help="Conversations replayed side by side per worker")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its checkpoints")
+    parser.add_argument("--model", default=os.environ.get("CHATBOT_MODEL", "microsoft/DialoGPT-small"))
+    parser.add_argument("--backend", default=os.environ.get("CHATBOT_BACKEND", "eager"))
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--budget-ms", type=float, default=0, help="Latency budget per wave (0 for none)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    _configure_logging()
+    started = time.perf_counter()
+    summary = evaluate(args.paths, args.output, workers=args.workers, batch_size=args.batch_size,
+                       resume=args.resume, model=args.model, backend=args.backend,
+                       max_new_tokens=args.max_new_tokens, budget_ms=args.budget_ms or None, seed=args.seed)
+    print(f"Replayed {summary['turns']} turns from {summary['conversations']} conversations "
+          f"({summary['skipped']} already done) in {time.perf_counter() - started:.1f}s")
+    for path, count in sorted(summary["paths"].items()):
+        print(f"  {path}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingGeneration:
+    """A single model-bound turn waiting to be batched."""
+
+    __slots__ = ("input_ids", "deadline", "future")
+
+    def __init__(self, input_ids: "torch.Tensor", deadline: Optional[float] = None):
+        self.input_ids = input_ids
+        self.deadline = deadline
+        self.future: Future = Future()
+
+
+class GenerationBatcher:
+    """Collects concurrent generate calls and runs them as one batched forward pass.
+
+    Callers submit a single prompt and receive a future. A background worker
+    waits up to ``max_wait_ms`` (or until ``max_batch_size`` prompts are
+    pending), left-pads the prompts, runs one ``model.generate`` call and
+    resolves each future with that caller's own sequence. Each prompt may
+    carry its own deadline; a row whose deadline passes stops generating
+    while the rest of the batch carries on.
+    """
+
+    def __init__(self, model, pad_token_id: int, eos_token_id: Optional[int] = None,
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 generate_kwargs: Optional[Dict[str, Any]] = None):
+        """Initialize the batcher.
+
+        Args:
+            model: A causal language model exposing ``generate``
+            pad_token_id: Token used to left-pad prompts in a batch
+            eos_token_id: End-of-turn token; defaults to ``pad_token_id``
+            max_batch_size: Maximum number of prompts per ``generate`` call
+            max_wait_ms: How long to wait for more prompts once one is pending
+            generate_kwargs: Sampling parameters shared by every batched call
+        """
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.eos_token_id = pad_token_id if eos_token_id is None else eos_token_id
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.generate_kwargs = dict(generate_kwargs or {})
+
+        self._queue: "queue.Queue[Optional[_PendingGeneration]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+
+        # Simple counters for tuning the batch knobs
+        self.batches_run = 0
+        self.requests_served = 0
+
+    def _ensure_started(self) -> None:
+        """Start the worker thread on first use (and again after a fork)."""
+        with self._lock:
+            if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Threads don't survive fork; start from a clean queue in the child
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name="generation-batcher", daemon=True)
+            self._worker.start()
+
+    def submit(self, input_ids: "torch.Tensor", deadline: Optional[float] = None) -> Future:
+        """Queue a single prompt for generation.
+
+        Args:
+            input_ids: Prompt token ids with shape ``(1, seq_len)``
+            deadline: ``time.monotonic()`` time after which generation for this
+                prompt is cut off (None for no deadline)
+
+        Returns:
+            A future resolving to the prompt followed by its generated tokens,
+            shape ``(1, seq_len + new_tokens)``, like a single ``generate`` call
+            (a reply that was cut off gets a closing EOS), and whether the
+            deadline cut the reply short
+        """
+        if self._closed:
+            raise RuntimeError("GenerationBatcher is closed")
+        self._ensure_started()
+        pending = _PendingGeneration(input_ids, deadline)
+        self._queue.put(pending)
+        return pending.future
+
+    def generate(self, input_ids: "torch.Tensor", timeout: Optional[float] = None,
+                 deadline: Optional[float] = None) -> Tuple["torch.Tensor", bool]:
+        """Submit a prompt and block until its sequence is ready."""
+        return self.submit(input_ids, deadline).result(timeout=timeout)
+
+    def close(self) -> None:
+        """Stop the worker after the prompts already queued are served."""
+        self._closed = True
+        if self._worker is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._worker.join()
+
+    def _collect(self, first: _PendingGeneration) -> List[_PendingGeneration]:
+        """Gather prompts until the batch is full or the wait window closes."""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the shutdown marker so the run loop sees it
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self._generate_batch([item.input_ids for item in batch],
+                                               [item.deadline for item in batch])
+            except Exception as e:
+                logger.error(f"Batched generation failed: {e}")
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            for item, output in zip(batch, outputs):
+                item.future.set_result(output)
+            self.batches_run += 1
+            self.requests_served += len(batch)
+
+    def _generate_batch(self, prompts: List["torch.Tensor"],
+                        deadlines: Optional[List[Optional[float]]] = None) -> List[Tuple["torch.Tensor", bool]]:
+        """Left-pad the prompts, run one generate call and split the result."""
+        import torch
+        from transformers import StoppingCriteriaList
+        from app.deadlines import DeadlineCriteria
+        
+        lengths = [prompt.shape[-1] for prompt in prompts]
+        padded_length = max(lengths)
+
+        input_ids = torch.full((len(prompts), padded_length), self.pad_token_id, dtype=prompts[0].dtype)
+        attention_mask = torch.zeros((len(prompts), padded_length), dtype=torch.long)
+        for row, (prompt, length) in enumerate(zip(prompts, lengths)):
+            input_ids[row, padded_length - length:] = prompt[0]
+            attention_mask[row, padded_length - length:] = 1
+
+        deadline_criteria = None
+        stopping_criteria = StoppingCriteriaList()
+        if deadlines and any(deadline is not None for deadline in deadlines):
+            deadline_criteria = DeadlineCriteria(deadlines, padded_length, self.eos_token_id)
+            stopping_criteria.append(deadline_criteria)
+
+        sequences = self.model.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            pad_token_id=self.pad_token_id,
+            stopping_criteria=stopping_criteria,
+            **self.generate_kwargs
+        )
+
+        results = []
+        for row, (prompt, length) in enumerate(zip(prompts, lengths)):
+            generated = sequences[row, padded_length:]
+            # Finished rows are padded out to the longest reply; keep up to the first EOS
+            eos_positions = (generated == self.eos_token_id).nonzero()
+            if len(eos_positions):
+                generated = generated[:eos_positions[0].item() + 1]
+            else:
+                # Cut off by max_new_tokens or the deadline; close the turn so the history keeps its boundaries
+                generated = torch.cat([generated, generated.new_full((1,), self.eos_token_id)])
+            deadline_hit = deadline_criteria is not None and deadline_criteria.expired[row]
+            results.append((torch.cat([prompt[0], generated]).unsqueeze(0), deadline_hit))
+        return results
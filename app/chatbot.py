@@ -1,11 +1,25 @@
 # Import necessary libraries
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
+# (torch and transformers are imported when the model loads, keeping app import fast; the
+# session, batching, persistence and reply cache modules only import torch for type hints)
 import logging
-from typing import Dict, Optional, Tuple
-import re
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
 import random
 import os
+import re
+import threading
+import time
+from app import metrics
+from app.admission import AdmissionController
+from app.batching import GenerationBatcher
+from app.env import env_flag, env_float, env_int
+from app.matcher import MessageClassification, SafetyMatcher
+from app.persistence import session_store_from_env
+from app.reply_cache import ReplyCache, ReplyKey
+from app.sessions import HistoryWindow, PastKeyValues, SessionState, SessionStore
+
+if TYPE_CHECKING:
+    import torch
+    from transformers import TextIteratorStreamer
 
 # Set environment variable to avoid warnings
 os.environ['TOKENIZERS_PARALLELISM'] = 'false'
@@ -14,15 +28,98 @@ os.environ['TOKENIZERS_PARALLELISM'] = 'false'
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class _ModelTurn:
+    """A model-bound turn holding a generation slot, between admission and generation."""
+    
+    __slots__ = ("session_id", "state", "bot_input_ids", "past_key_values", "cache_key", "weight")
+    
+    def __init__(self, session_id: str, state: Optional[SessionState], bot_input_ids: "torch.Tensor",
+                 past_key_values: Optional[PastKeyValues], cache_key: Optional[ReplyKey], weight: int):
+        self.session_id = session_id
+        self.state = state
+        self.bot_input_ids = bot_input_ids
+        self.past_key_values = past_key_values
+        self.cache_key = cache_key
+        self.weight = weight
+    
+    @property
+    def prompt_length(self) -> int:
+        return self.bot_input_ids.shape[-1]
+
 class MentalHealthChatbot:
-    def __init__(self, model_name: str = "microsoft/DialoGPT-small"):
+    # How the model is loaded: "eager" blocks in __init__, "background" starts
+    # loading on a thread right away, "lazy" starts that thread on first use
+    LOAD_MODES = ("eager", "background", "lazy")
+    
+    def __init__(self, model_name: str = "microsoft/DialoGPT-small",
+                 batch_max_size: int = 1, batch_max_wait_ms: float = 5.0,
+                 max_history_turns: Optional[int] = 8, max_history_tokens: Optional[int] = 512,
+                 max_new_tokens: int = 64, session_store: Optional[SessionStore] = None,
+                 load_mode: str = "eager", backend: str = "eager",
+                 generation_budget_ms: Optional[float] = None,
+                 admission: Optional[AdmissionController] = None,
+                 reply_cache: Optional[ReplyCache] = None):
         """Initialize the mental health chatbot with a specified model.
         
         Args:
             model_name: The pre-trained model to use (using smaller model for faster loading)
+            batch_max_size: Most concurrent turns to run in one batched generate call
+                (1 disables micro-batching)
+            batch_max_wait_ms: How long a pending turn waits for others to join its batch
+            max_history_turns: Most previous exchanges kept as model context (None for no limit)
+            max_history_tokens: Token budget for history plus the new message (None for no limit)
+            max_new_tokens: Most tokens generated for a single reply
+            session_store: Where per-session history is kept (defaults to a bounded
+                in-memory SessionStore; ``app.persistence`` has one that survives restarts)
+            load_mode: "eager", "background" or "lazy"; until a non-eager load
+                finishes, replies come from the rule-based path
+            backend: Inference backend for the model ("eager", "int8" or "jit",
+                see ``app.backends``); falls back to eager if it can't be prepared
+            generation_budget_ms: Default latency budget for a model reply, counted
+                from when the message arrives; generation is cut off once it is
+                spent (None or 0 for no budget)
+            admission: Caps concurrent generations and sheds overflow to the
+                rule-based path (None admits every model turn)
+            reply_cache: Reuses sampled replies for repeated turns instead of
+                generating again (None always generates)
         """
+        if load_mode not in self.LOAD_MODES:
+            raise ValueError(f"Unknown load mode: {load_mode}")
+        self.model_name = model_name
+        self.load_mode = load_mode
+        self.backend = backend
+        self.load_state = "not_loaded"
+        self._load_lock = threading.Lock()
+        self._load_thread: Optional[threading.Thread] = None
+        self._batch_max_size = batch_max_size
+        self._batch_max_wait_ms = batch_max_wait_ms
+        
         self.model_loaded = False
-        self.sessions: Dict[str, torch.Tensor] = {}
+        self.sessions = session_store if session_store is not None else SessionStore()
+        self.batcher: Optional[GenerationBatcher] = None
+        self.max_history_turns = max_history_turns
+        self.max_history_tokens = max_history_tokens
+        self.history: Optional[HistoryWindow] = None
+        self.generation_budget_ms = generation_budget_ms
+        self.deadline_hits = 0
+        self.admission = admission
+        if admission is not None and batch_max_size > 1 and admission.max_in_flight < batch_max_size:
+            # Admitted callers hold their slot while waiting on the batcher, so this caps every batch
+            logger.warning(f"Admission allows {admission.max_in_flight} model turns in flight, fewer than "
+                           f"the batch size of {batch_max_size}; batches will never fill")
+        self.reply_cache = reply_cache
+        # Path of the latest reply per thread, so callers can log it with the turn
+        self._reply_path = threading.local()
+        
+        # Sampling parameters for model-based responses
+        self.generation_kwargs = {
+            "max_new_tokens": max_new_tokens,
+            "no_repeat_ngram_size": 3,
+            "do_sample": True,
+            "temperature": 0.7,
+            "top_p": 0.92,
+            "top_k": 50
+        }
         
         # Mental health specific responses
         self.crisis_keywords = ["suicide", "kill myself", "want to die", "end my life", "harm myself", "no reason to live"]
@@ -35,6 +132,18 @@ class MentalHealthChatbot:
         ]
         self.offensive_response = "I notice the conversation has taken a turn. 🌱 I'm here to provide support in a respectful environment where we can both feel comfortable. I'd really like to understand what you're going through - perhaps we could try expressing that in different words? How can I best support your mental health needs today?"
         
+        # Keywords for each mental health topic, checked in this priority order
+        self.topic_keywords = {
+            "anxiety": ["anxious", "anxiety", "nervous", "worry", "panic"],
+            "depression": ["depress", "sad", "hopeless", "unmotivated", "empty"],
+            "stress": ["stress", "overwhelm", "pressure", "burnout"],
+            "loneliness": ["alone", "lonely", "no friends", "isolated", "no one"],
+            "grief": ["grief", "loss", "died", "passed away", "missing someone"]
+        }
+        
+        # Single-pass matcher for the offensive, crisis and topic checks
+        self.matcher = SafetyMatcher(self.offensive_patterns, self.crisis_keywords, self.topic_keywords)
+        
         # Empathetic responses for common mental health concerns
         self.empathetic_responses = {
             "anxiety": [
@@ -118,17 +227,99 @@ class MentalHealthChatbot:
             "warmth": ["I'm here with you", "You're not alone in this journey", "I'm sending you good thoughts"]
         }
         
+        if load_mode == "eager":
+            self._load_model()
+        elif load_mode == "background":
+            self.start_loading()
+
+    def _load_model(self) -> None:
+        """Load the tokenizer and model, falling back to rule-based replies on failure."""
+        self.load_state = "loading"
         # Try to load the model, but continue even if it fails
         try:
-            logger.info(f"Loading model: {model_name}")
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(model_name)
-            self.model_loaded = True
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+            
+            logger.info(f"Loading model: {self.model_name}")
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForCausalLM.from_pretrained(self.model_name)
+            self.attach_model(tokenizer, model)
             logger.info("Model loaded successfully")
         except Exception as e:
+            self.load_state = "failed"
             logger.error(f"Error loading model: {e}")
             logger.info("Continuing with rule-based responses only")
 
+    def attach_model(self, tokenizer: Any, model: Any) -> None:
+        """Serve a tokenizer and model that are already in memory.
+        
+        ``_load_model`` uses this after loading ``model_name``; it can also be
+        called directly on a bot created with ``load_mode="lazy"``, e.g. to run
+        a small, randomly initialized model offline.
+        
+        Args:
+            tokenizer: Tokenizer with an ``eos_token``
+            model: Causal language model exposing ``generate``
+        """
+        model = self._prepare_backend(model)
+        
+        self.tokenizer = tokenizer
+        self.model = model
+        self.history = HistoryWindow(tokenizer.eos_token_id, self.max_history_turns, self.max_history_tokens)
+        if self._batch_max_size > 1:
+            self.batcher = GenerationBatcher(
+                model,
+                pad_token_id=tokenizer.eos_token_id,
+                max_batch_size=self._batch_max_size,
+                max_wait_ms=self._batch_max_wait_ms,
+                generate_kwargs=self.generation_kwargs
+            )
+            logger.info(f"Micro-batching enabled (max batch {self._batch_max_size}, max wait {self._batch_max_wait_ms}ms)")
+        
+        # Only flip the flag once everything the model path needs is in place
+        self.model_loaded = True
+        self.load_state = "ready"
+
+    def _prepare_backend(self, model: Any) -> Any:
+        """Adapt the loaded model to the configured inference backend.
+        
+        Args:
+            model: The fp32 model returned by ``from_pretrained``
+            
+        Returns:
+            The model to serve (the eager model if the backend fails)
+        """
+        from app.backends import prepare_model
+        
+        try:
+            return prepare_model(model, self.backend)
+        except Exception as e:
+            logger.error(f"Error preparing {self.backend} backend: {e}")
+            logger.info("Continuing with the eager backend")
+            self.backend = "eager"
+            return model.eval()
+
+    def start_loading(self) -> None:
+        """Start loading the model on a background thread, if not already started."""
+        with self._load_lock:
+            if self._load_thread is not None or self.load_state != "not_loaded":
+                return
+            self.load_state = "loading"
+            self._load_thread = threading.Thread(target=self._load_model, name="model-loader", daemon=True)
+            self._load_thread.start()
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        """Block until a background load finishes.
+        
+        Args:
+            timeout: Longest to wait in seconds (None waits indefinitely)
+            
+        Returns:
+            True if the model is loaded and ready
+        """
+        if self._load_thread is not None:
+            self._load_thread.join(timeout)
+        return self.model_loaded
+
     def detect_mental_health_topic(self, text: str) -> Optional[str]:
         """Detect mental health topics in user input.
         
@@ -138,18 +329,7 @@ class MentalHealthChatbot:
         Returns:
             The detected topic if found, None otherwise
         """
-        text = text.lower()
-        if any(word in text for word in ["anxious", "anxiety", "nervous", "worry", "panic"]):
-            return "anxiety"
-        elif any(word in text for word in ["depress", "sad", "hopeless", "unmotivated", "empty"]):
-            return "depression"
-        elif any(word in text for word in ["stress", "overwhelm", "pressure", "burnout"]):
-            return "stress"
-        elif any(word in text for word in ["alone", "lonely", "no friends", "isolated", "no one"]):
-            return "loneliness"
-        elif any(word in text for word in ["grief", "loss", "died", "passed away", "missing someone"]):
-            return "grief"
-        return None
+        return self.matcher.classify(text).topic
 
     def is_offensive(self, text: str) -> bool:
         """Check if the input contains offensive language.
@@ -160,136 +340,593 @@ class MentalHealthChatbot:
         Returns:
             True if offensive language is detected, False otherwise
         """
-        for pattern in self.offensive_patterns:
-            if re.search(pattern, text.lower()):
-                return True
-        return False
+        return self.matcher.classify(text).offensive
 
-    def get_response(self, user_input: str, session_id: str = "default") -> str:
-        """Generate a response to the user input.
+    def classify(self, text: str) -> MessageClassification:
+        """Run the offensive, crisis and topic checks in a single pass.
+        
+        Args:
+            text: The user's message
+            
+        Returns:
+            The offensive/crisis flags and detected topic
+        """
+        return self.matcher.classify(text)
+
+    def _generate(self, bot_input_ids: "torch.Tensor",
+                  past_key_values: Optional[PastKeyValues] = None,
+                  streamer: Optional["TextIteratorStreamer"] = None,
+                  deadline: Optional[float] = None) -> Tuple["torch.Tensor", Optional[PastKeyValues], bool]:
+        """Run the model on a prompt, through the micro-batcher when enabled.
+        
+        Args:
+            bot_input_ids: Chat history plus the new user turn
+            past_key_values: KV cache covering a prefix of ``bot_input_ids``, so
+                only the remaining tokens need to be prefilled
+            streamer: Receives tokens as they are generated (bypasses the batcher)
+            deadline: ``time.monotonic()`` time at which generation is cut off
+            
+        Returns:
+            The prompt followed by the generated reply tokens (always closed
+            with EOS), the KV cache for a prefix of that sequence (None when
+            no cache is available), and whether the deadline cut the reply short
+        """
+        metrics.tokens_in.inc(bot_input_ids.shape[-1])
+        with metrics.stage("generate"):
+            if self.batcher is not None and streamer is None:
+                # Batched prompts are left-padded together, so per-session caches don't apply
+                sequences, deadline_hit = self.batcher.generate(bot_input_ids, deadline=deadline)
+                return sequences, None, deadline_hit
+            
+            from transformers import StoppingCriteriaList
+            from app.deadlines import DeadlineCriteria
+            stopping_criteria = StoppingCriteriaList()
+            deadline_criteria = None
+            if deadline is not None:
+                deadline_criteria = DeadlineCriteria([deadline], bot_input_ids.shape[-1], self.tokenizer.eos_token_id)
+                stopping_criteria.append(deadline_criteria)
+            
+            output = self.model.generate(
+                bot_input_ids,
+                attention_mask=bot_input_ids.new_ones(bot_input_ids.shape),
+                past_key_values=past_key_values,
+                pad_token_id=self.tokenizer.eos_token_id,
+                return_dict_in_generate=True,
+                streamer=streamer,
+                stopping_criteria=stopping_criteria,
+                **self.generation_kwargs
+            )
+            deadline_hit = deadline_criteria is not None and deadline_criteria.expired[0]
+            sequences = output.sequences
+            if sequences[0, -1].item() != self.tokenizer.eos_token_id:
+                # Close a reply cut off by max_new_tokens or the deadline so the history keeps its turn boundaries
+                import torch
+                eos = sequences.new_full((1, 1), self.tokenizer.eos_token_id)
+                sequences = torch.cat([sequences, eos], dim=-1)
+            return sequences, getattr(output, "past_key_values", None), deadline_hit
+
+    def _deadline(self, started: float, budget_ms: Optional[float]) -> Optional[float]:
+        """Turn a latency budget into a deadline, falling back to the default budget."""
+        if budget_ms is None:
+            budget_ms = self.generation_budget_ms
+        if not budget_ms:
+            return None
+        return started + budget_ms / 1000.0
+
+    def _admission_weight(self, streamed: bool = False) -> int:
+        """Admission slots a model turn takes.
+        
+        The default controller has one slot per turn a batched ``generate``
+        call can serve. A turn that runs its own call instead (every streamed
+        turn, since streaming bypasses the batcher) takes a whole batch's worth.
+        """
+        if self.batcher is not None and not streamed:
+            return 1
+        return max(1, self._batch_max_size)
+
+    def _admit(self, deadline: Optional[float], weight: int = 1) -> bool:
+        """Wait for a generation slot, giving up at the deadline or the queue timeout.
+        
+        Args:
+            deadline: ``time.monotonic()`` time by which the reply is due
+            weight: Slots the turn takes (see ``_admission_weight``)
+            
+        Returns:
+            True if the model path may run (call ``_release`` with the same weight afterwards)
+        """
+        if self.admission is None:
+            return True
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        with metrics.stage("admission_wait"):
+            return self.admission.acquire(timeout, weight)
+
+    def _count_response(self, path: str) -> None:
+        """Count a reply served by one of ``metrics.RESPONSE_PATHS`` and remember its path."""
+        metrics.count_response(path)
+        self._reply_path.value = path
+
+    def last_response_path(self) -> Optional[str]:
+        """Return the path that produced the latest reply on the calling thread.
+        
+        Returns:
+            One of ``metrics.RESPONSE_PATHS``, or None if this thread hasn't replied yet
+        """
+        return getattr(self._reply_path, "value", None)
+
+    def _reply_cache_key(self, user_input: str, state: Optional[SessionState],
+                         classification: MessageClassification) -> Optional[ReplyKey]:
+        """Cache key for a model-bound turn, or None if the turn must not be cached."""
+        if self.reply_cache is None:
+            return None
+        # Crisis messages are answered before the model path, but never let one near the cache
+        if classification.crisis:
+            return None
+        return self.reply_cache.key(user_input, state.token_ids if state is not None else None)
+
+    def _cached_reply(self, cache_key: Optional[ReplyKey], bot_input_ids: "torch.Tensor") -> Optional["torch.Tensor"]:
+        """Return the prompt followed by a cached reply, or None on a miss."""
+        if cache_key is None:
+            return None
+        reply_ids = self.reply_cache.get(cache_key)
+        if reply_ids is None:
+            return None
+        import torch
+        return torch.cat([bot_input_ids, reply_ids.unsqueeze(0)], dim=-1)
+
+    def _remember_reply(self, cache_key: Optional[ReplyKey], chat_history_ids: "torch.Tensor",
+                        prompt_length: int, deadline_hit: bool) -> None:
+        """Offer a freshly generated reply to the reply cache."""
+        if cache_key is None or deadline_hit:
+            # A reply cut off by the deadline is not a fair sample to replay
+            return
+        reply_ids = chat_history_ids[0, prompt_length:]
+        if reply_ids.numel():
+            self.reply_cache.add(cache_key, reply_ids)
+
+    def _release(self, weight: int = 1) -> None:
+        if self.admission is not None:
+            self.admission.release(weight)
+
+    def _shed_response(self, classification: MessageClassification) -> str:
+        """Answer from the rule-based path when the model path is saturated.
+        
+        Args:
+            classification: The message's safety/topic classification
+            
+        Returns:
+            An empathetic reply for the message's topic, or a supportive one
+        """
+        self._count_response("shed")
+        topic = classification.topic
+        if topic:
+            return random.choice(self.empathetic_responses[topic])
+        return random.choice(self.supportive_responses)
+
+    def _partial_reply(self, text: str) -> Optional[str]:
+        """Make a reply cut off by the deadline presentable, or None if too little is usable.
+        
+        Args:
+            text: The decoded partial reply
+            
+        Returns:
+            The partial reply ending at its last complete sentence (or with an
+            ellipsis if it has none), or None if it has fewer than three words
+        """
+        text = text.strip()
+        sentences = re.match(r"^(.*[.!?])", text, re.DOTALL)
+        if sentences and len(sentences.group(1).split()) >= 3:
+            return sentences.group(1)
+        if len(text.split()) < 3:
+            return None
+        return f"{text}..."
+
+    def _rule_based_response(self, user_input: str,
+                             classification: Optional[MessageClassification] = None) -> Optional[str]:
+        """Pick a reply without the model, or None if the model should answer.
         
         Args:
             user_input: The user's message
-            session_id: Unique identifier for the conversation session
+            classification: The message's safety/topic classification, if already computed
             
         Returns:
-            The chatbot's response
+            The safety, empathetic, grounding or fallback reply, if one applies
         """
-        try:
-            # Check for offensive language
-            if self.is_offensive(user_input):
-                return self.offensive_response
-                
-            # Check for crisis keywords
-            if any(keyword in user_input.lower() for keyword in self.crisis_keywords):
-                return self.crisis_response
-            
-            # Helper function to add emotional expressions
-            def add_emotion(response, emotion_type=None):
-                if emotion_type is None:
-                    # Randomly select an emotion type
-                    emotion_type = random.choice(list(self.emotional_expressions.keys()))
-                
-                # 60% chance to add an emotional expression
-                if random.random() < 0.6:
-                    emotion = random.choice(self.emotional_expressions[emotion_type])
-                    return f"{emotion}. {response}"
-                return response
+        if self.load_mode == "lazy" and self.load_state == "not_loaded":
+            # The first request kicks off loading without waiting for it
+            self.start_loading()
+        
+        if classification is None:
+            classification = self._classify_turn(user_input)
+        
+        # Check for offensive language
+        if classification.offensive:
+            self._count_response("offensive")
+            return self.offensive_response
             
-            # Helper function to add follow-up questions
-            def add_follow_up(response):
-                # 50% chance to add a follow-up question
-                if random.random() < 0.5 and not response.endswith("?"):
-                    follow_up = random.choice(self.follow_up_questions)
-                    return f"{response} {follow_up}"
-                return response
-                
-            # Check for mental health topics
-            topic = self.detect_mental_health_topic(user_input)
-            if topic and random.random() < 0.8:  # Increased chance to use empathetic responses
-                response = random.choice(self.empathetic_responses[topic])
-                return response  # These already have emotional content and follow-ups
-                
-            # Special case for anxiety with grounding techniques
-            if topic == "anxiety" and ("help" in user_input.lower() or "anxious" in user_input.lower()) and random.random() < 0.6:
-                return random.choice(self.grounding_techniques)
-            
-            # If model is not loaded, use rule-based responses
-            if not self.model_loaded:
-                response = random.choice(self.supportive_responses)
-                # These already have emotional content, but we might add a follow-up
-                if not "?" in response:
-                    return add_follow_up(response)
-                return response
+        # Check for crisis keywords
+        if classification.crisis:
+            self._count_response("crisis")
+            return self.crisis_response
+        
+        # Helper function to add emotional expressions
+        def add_emotion(response, emotion_type=None):
+            if emotion_type is None:
+                # Randomly select an emotion type
+                emotion_type = random.choice(list(self.emotional_expressions.keys()))
             
-            # Model-based response generation (only if model is loaded)
+            # 60% chance to add an emotional expression
+            if random.random() < 0.6:
+                emotion = random.choice(self.emotional_expressions[emotion_type])
+                return f"{emotion}. {response}"
+            return response
+        
+        # Helper function to add follow-up questions
+        def add_follow_up(response):
+            # 50% chance to add a follow-up question
+            if random.random() < 0.5 and not response.endswith("?"):
+                follow_up = random.choice(self.follow_up_questions)
+                return f"{response} {follow_up}"
+            return response
+            
+        # Check for mental health topics
+        topic = classification.topic
+        if topic and random.random() < 0.8:  # Increased chance to use empathetic responses
+            response = random.choice(self.empathetic_responses[topic])
+            self._count_response("empathetic")
+            return response  # These already have emotional content and follow-ups
+            
+        # Special case for anxiety with grounding techniques
+        lowered = user_input.lower()
+        if topic == "anxiety" and ("help" in lowered or "anxious" in lowered) and random.random() < 0.6:
+            self._count_response("grounding")
+            return random.choice(self.grounding_techniques)
+        
+        # If model is not loaded, use rule-based responses
+        if not self.model_loaded:
+            self._count_response("rule_fallback")
+            response = random.choice(self.supportive_responses)
+            # These already have emotional content, but we might add a follow-up
+            if not "?" in response:
+                return add_follow_up(response)
+            return response
+        
+        return None
+
+    def _prepare_prompt(self, user_input: str, session_id: str) -> Tuple[Optional[SessionState], "torch.Tensor", Optional[PastKeyValues]]:
+        """Encode the user's message and prepend the session's (trimmed) history.
+        
+        Args:
+            user_input: The user's message
+            session_id: Unique identifier for the conversation session
+            
+        Returns:
+            The session state (None for a new session), the prompt ids, and
+            the KV cache covering a prefix of the prompt
+        """
+        with metrics.stage("tokenize"):
             # Encode user input
             new_input_ids = self.tokenizer.encode(user_input + self.tokenizer.eos_token, 
                                                return_tensors='pt')
+            new_input_ids = self.history.fit_input(new_input_ids)
             
-            # Get or create chat history
-            chat_history_ids = self.sessions.get(session_id)
+            # Get or create chat history, trimmed to the most recent turns that fit the budget
+            state = self.sessions.get(session_id)
+            if state is not None and self.history.trim(state, new_input_ids.shape[-1]):
+                logger.info(f"Trimmed chat history for session {session_id} to {len(state)} tokens")
             
-            if chat_history_ids is not None:
-                bot_input_ids = torch.cat([chat_history_ids, new_input_ids], dim=-1)
+            if state is not None:
+                bot_input_ids, past_key_values = state.prompt_with(new_input_ids), state.past_key_values
             else:
-                bot_input_ids = new_input_ids
-            
-            # Generate response with better parameters for mental health conversations
-            chat_history_ids = self.model.generate(
-                bot_input_ids,
-                max_length=1000,
-                pad_token_id=self.tokenizer.eos_token_id,
-                no_repeat_ngram_size=3,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.92,
-                top_k=50
-            )
-            
-            # Save the chat history
-            self.sessions[session_id] = chat_history_ids
+                bot_input_ids, past_key_values = new_input_ids, None
+        return state, bot_input_ids, past_key_values
+
+    def _finish_model_response(self, session_id: str, state: Optional[SessionState], prompt_length: int,
+                               chat_history_ids: "torch.Tensor", past_key_values: Optional[PastKeyValues],
+                               deadline_hit: bool = False, cached: bool = False) -> str:
+        """Save the new history and turn the generated tokens into the final reply.
+        
+        Args:
+            session_id: Unique identifier for the conversation session
+            state: The session state the prompt was built from (None for a new session)
+            prompt_length: Number of prompt tokens before the generated reply
+            chat_history_ids: The prompt followed by the generated reply tokens
+            past_key_values: The KV cache returned with ``chat_history_ids``
+            deadline_hit: Whether generation was cut off by the latency budget
+            cached: Whether the reply came from the reply cache instead of the model
             
-            # Decode and return
+        Returns:
+            The chatbot's response
+        """
+        if deadline_hit:
+            self.deadline_hits += 1
+            metrics.deadline_hits.inc()
+        
+        # Save the chat history along with the cache so the next turn only prefills new tokens
+        if state is not None:
+            state.update(chat_history_ids, past_key_values)
+        else:
+            state = SessionState(chat_history_ids, past_key_values)
+        self.sessions.put(session_id, state)
+        
+        # Decode and return
+        if not cached:
+            metrics.tokens_out.inc(chat_history_ids.shape[-1] - prompt_length)
+        with metrics.stage("decode"):
             response = self.tokenizer.decode(
-                chat_history_ids[:, bot_input_ids.shape[-1]:][0], 
+                chat_history_ids[:, prompt_length:][0], 
                 skip_special_tokens=True
             )
-            
-            # If empty or too short, give a supportive response
-            if not response.strip() or len(response.split()) < 3:
-                short_responses = [
-                    "I'm here to listen and support you. Could you share more about what you're experiencing? 💭",
-                    "I'd really like to understand better. Can you tell me a bit more about what's on your mind?",
-                    "Sometimes it helps to put feelings into words. Would you like to try explaining a bit more?",
-                    "I want to be here for you in the best way possible. Could you share a little more detail?"
-                ]
-                return random.choice(short_responses)
-            
-            # Enhance model response with emotional expressions and follow-ups
-            # 40% chance to enhance model response
-            if random.random() < 0.4:
-                # Add emotional expression
-                if random.random() < 0.5:
-                    emotion_type = random.choice(list(self.emotional_expressions.keys()))
-                    emotion = random.choice(self.emotional_expressions[emotion_type])
-                    response = f"{emotion}. {response}"
-                
-                # Add follow-up question if response doesn't already end with one
-                if not response.strip().endswith("?") and random.random() < 0.4:
-                    follow_up = random.choice(self.follow_up_questions)
-                    response = f"{response} {follow_up}"
-            
-            # 20% chance to add an emoji to make it more human-like
-            if random.random() < 0.2:
-                emojis = ["💭", "💙", "🌱", "✨", "🌈", "🧡", "🤔", "💪", "🌿"]
-                response = f"{response} {random.choice(emojis)}"
-                
+        
+        if deadline_hit:
+            response = self._partial_reply(response)
+            if response is None:
+                # Out of time with nothing usable: answer the way the rule-based path would
+                self._count_response("deadline_fallback")
+                return random.choice(self.supportive_responses)
+            self._count_response("deadline_partial")
             return response
+        
+        # If empty or too short, give a supportive response
+        if not response.strip() or len(response.split()) < 3:
+            self._count_response("short_fallback")
+            short_responses = [
+                "I'm here to listen and support you. Could you share more about what you're experiencing? 💭",
+                "I'd really like to understand better. Can you tell me a bit more about what's on your mind?",
+                "Sometimes it helps to put feelings into words. Would you like to try explaining a bit more?",
+                "I want to be here for you in the best way possible. Could you share a little more detail?"
+            ]
+            return random.choice(short_responses)
+        
+        self._count_response("cached" if cached else "model")
+        
+        # Enhance model response with emotional expressions and follow-ups
+        # 40% chance to enhance model response
+        if random.random() < 0.4:
+            # Add emotional expression
+            if random.random() < 0.5:
+                emotion_type = random.choice(list(self.emotional_expressions.keys()))
+                emotion = random.choice(self.emotional_expressions[emotion_type])
+                response = f"{emotion}. {response}"
+            
+            # Add follow-up question if response doesn't already end with one
+            if not response.strip().endswith("?") and random.random() < 0.4:
+                follow_up = random.choice(self.follow_up_questions)
+                response = f"{response} {follow_up}"
+        
+        # 20% chance to add an emoji to make it more human-like
+        if random.random() < 0.2:
+            emojis = ["💭", "💙", "🌱", "✨", "🌈", "🧡", "🤔", "💪", "🌿"]
+            response = f"{response} {random.choice(emojis)}"
+            
+        return response
+
+    def _classify_turn(self, user_input: str) -> MessageClassification:
+        # Offensive, crisis and topic checks in one pass, shared by every later step of the turn
+        with metrics.stage("safety"):
+            return self.matcher.classify(user_input)
+
+    def _begin_model_turn(self, user_input: str, session_id: str, classification: MessageClassification,
+                          deadline: Optional[float], streamed: bool = False) -> Tuple[Optional[str], Optional[_ModelTurn]]:
+        """Build the prompt for a model-bound turn and take a generation slot for it.
+        
+        A repeated turn is answered from the reply cache without a slot, and
+        a turn that can't get one is shed to a rule-based reply.
+        
+        Args:
+            user_input: The user's message
+            session_id: Unique identifier for the conversation session
+            classification: The message's safety/topic classification
+            deadline: ``time.monotonic()`` time by which the reply is due
+            streamed: Whether the turn will stream (and so bypass the batcher)
+            
+        Returns:
+            The reply and None if no generation is needed, otherwise None and
+            the admitted turn (pass it to ``_end_model_turn`` after
+            generating, and release its slots with ``_release(turn.weight)``)
+        """
+        state, bot_input_ids, past_key_values = self._prepare_prompt(user_input, session_id)
+        
+        cache_key = self._reply_cache_key(user_input, state, classification)
+        cached_ids = self._cached_reply(cache_key, bot_input_ids)
+        if cached_ids is not None:
+            return self._finish_model_response(session_id, state, bot_input_ids.shape[-1],
+                                               cached_ids, past_key_values, cached=True), None
+        
+        # Safety replies are settled before this, so only model-bound turns ever wait for a slot
+        weight = self._admission_weight(streamed)
+        if not self._admit(deadline, weight):
+            return self._shed_response(classification), None
+        return None, _ModelTurn(session_id, state, bot_input_ids, past_key_values, cache_key, weight)
+
+    def _end_model_turn(self, turn: _ModelTurn,
+                        output: Tuple["torch.Tensor", Optional[PastKeyValues], bool]) -> str:
+        """Offer a generated reply to the reply cache, save the history and build the final reply.
+        
+        Args:
+            turn: The turn returned by ``_begin_model_turn``
+            output: What ``_generate`` returned for it
+            
+        Returns:
+            The chatbot's response
+        """
+        chat_history_ids, past_key_values, deadline_hit = output
+        self._remember_reply(turn.cache_key, chat_history_ids, turn.prompt_length, deadline_hit)
+        return self._finish_model_response(turn.session_id, turn.state, turn.prompt_length,
+                                           chat_history_ids, past_key_values, deadline_hit)
+
+    def get_response(self, user_input: str, session_id: str = "default",
+                     budget_ms: Optional[float] = None) -> str:
+        """Generate a response to the user input.
+        
+        Args:
+            user_input: The user's message
+            session_id: Unique identifier for the conversation session
+            budget_ms: Latency budget for this reply (defaults to ``generation_budget_ms``)
+            
+        Returns:
+            The chatbot's response
+        """
+        deadline = self._deadline(time.monotonic(), budget_ms)
+        self._reply_path.value = None
+        try:
+            classification = self._classify_turn(user_input)
+            response = self._rule_based_response(user_input, classification)
+            if response is not None:
+                return response
+            
+            # Model-based response generation (only if model is loaded)
+            response, turn = self._begin_model_turn(user_input, session_id, classification, deadline)
+            if turn is None:
+                return response
+            try:
+                # Generate response with better parameters for mental health conversations
+                output = self._generate(turn.bot_input_ids, turn.past_key_values, deadline=deadline)
+            finally:
+                self._release(turn.weight)
+            return self._end_model_turn(turn, output)
         except Exception as e:
             logger.error(f"Error generating response: {e}")
+            self._count_response("exception")
             # Fall back to rule-based responses on error
             return random.choice(self.supportive_responses)
+
+    def get_response_stream(self, user_input: str, session_id: str = "default",
+                            budget_ms: Optional[float] = None) -> Iterator[Tuple[str, str]]:
+        """Generate a response to the user input, yielding text as it is produced.
+        
+        Model replies are yielded as ``("token", text)`` chunks while tokens are
+        generated, followed by ``("done", response)`` with the final reply (which
+        may differ from the streamed text once emotional expressions or the
+        short-reply fallback are applied). Rule-based replies are yielded as a
+        single ``("done", response)``.
+        
+        Args:
+            user_input: The user's message
+            session_id: Unique identifier for the conversation session
+            budget_ms: Latency budget for this reply (defaults to ``generation_budget_ms``)
+            
+        Yields:
+            ``(event, text)`` pairs
+        """
+        deadline = self._deadline(time.monotonic(), budget_ms)
+        self._reply_path.value = None
+        try:
+            classification = self._classify_turn(user_input)
+            response = self._rule_based_response(user_input, classification)
+            if response is not None:
+                yield "done", response
+                return
+            
+            # A streamed turn runs its own generate call, so it takes a whole batch's worth of slots
+            response, turn = self._begin_model_turn(user_input, session_id, classification, deadline,
+                                                    streamed=True)
+            if turn is None:
+                yield "done", response
+                return
+            
+            # Generate on a worker thread and relay decoded text as the streamer receives tokens;
+            # the generation slot is held until the thread finishes, even if the client goes away
+            result: Dict[str, Any] = {}
+            try:
+                from transformers import TextIteratorStreamer
+                streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            except Exception:
+                self._release(turn.weight)
+                raise
+            
+            def run_generation():
+                try:
+                    result["output"] = self._generate(turn.bot_input_ids, turn.past_key_values,
+                                                      streamer=streamer, deadline=deadline)
+                except Exception as e:
+                    result["error"] = e
+                    streamer.end()
+                finally:
+                    self._release(turn.weight)
+            
+            thread = threading.Thread(target=run_generation, name="stream-generation", daemon=True)
+            thread.start()
+            for text in streamer:
+                if text:
+                    yield "token", text
+            thread.join()
+            
+            if "error" in result:
+                raise result["error"]
+            yield "done", self._end_model_turn(turn, result["output"])
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            self._count_response("exception")
+            # Fall back to rule-based responses on error
+            yield "done", random.choice(self.supportive_responses)
+    
+    def get_responses(self, turns: Sequence[Tuple[str, str]],
+                      classifications: Optional[Sequence[MessageClassification]] = None,
+                      budget_ms: Optional[float] = None) -> List[Tuple[str, Optional[str]]]:
+        """Answer one turn from each of several sessions, batching the work across them.
+        
+        The safety checks run over all the messages in one pass, and the
+        model-bound turns go through the micro-batcher together (or one at a
+        time when there is none). Session history is read and saved as in
+        ``get_response``. Meant for offline replays; the reply cache and
+        admission control are not used.
+        
+        Args:
+            turns: ``(user_input, session_id)`` pairs, at most one per session
+            classifications: ``classify_many`` results for the messages, if already computed
+            budget_ms: Latency budget for the batch (defaults to ``generation_budget_ms``)
+            
+        Returns:
+            The response and the path that produced it, for each turn in order
+        """
+        if len({session_id for _, session_id in turns}) != len(turns):
+            raise ValueError("get_responses takes at most one turn per session")
+        if classifications is None:
+            with metrics.stage("safety"):
+                classifications = self.matcher.classify_many([user_input for user_input, _ in turns])
+        deadline = self._deadline(time.monotonic(), budget_ms)
+        
+        results: List[Optional[Tuple[str, Optional[str]]]] = [None] * len(turns)
+        prepared = []
+        for position, ((user_input, session_id), classification) in enumerate(zip(turns, classifications)):
+            self._reply_path.value = None
+            try:
+                response = self._rule_based_response(user_input, classification)
+                if response is not None:
+                    results[position] = (response, self.last_response_path())
+                    continue
+                prepared.append((position, session_id) + self._prepare_prompt(user_input, session_id))
+            except Exception as e:
+                results[position] = self._failed_response(e)
+        
+        # Queue every prompt before waiting on any, so the batcher can group them
+        futures = {}
+        if self.batcher is not None:
+            for position, _, _, bot_input_ids, _ in prepared:
+                metrics.tokens_in.inc(bot_input_ids.shape[-1])
+                futures[position] = self.batcher.submit(bot_input_ids, deadline)
+        
+        for position, session_id, state, bot_input_ids, past_key_values in prepared:
+            self._reply_path.value = None
+            try:
+                if position in futures:
+                    with metrics.stage("generate"):
+                        chat_history_ids, deadline_hit = futures[position].result()
+                    past_key_values = None
+                else:
+                    chat_history_ids, past_key_values, deadline_hit = self._generate(bot_input_ids, past_key_values,
+                                                                                     deadline=deadline)
+                response = self._finish_model_response(session_id, state, bot_input_ids.shape[-1],
+                                                       chat_history_ids, past_key_values, deadline_hit)
+                results[position] = (response, self.last_response_path())
+            except Exception as e:
+                results[position] = self._failed_response(e)
+        return results
+
+    def _failed_response(self, error: Exception) -> Tuple[str, str]:
+        logger.error(f"Error generating response: {error}")
+        self._count_response("exception")
+        return random.choice(self.supportive_responses), "exception"
     
     def reset_chat(self, session_id: str = "default") -> None:
         """Reset the chat history for a given session.
@@ -297,14 +934,53 @@ class MentalHealthChatbot:
         Args:
             session_id: The session ID to reset
         """
-        if self.model_loaded and session_id in self.sessions:
-            del self.sessions[session_id]
+        if self.model_loaded and self.sessions.pop(session_id) is not None:
             logger.info(f"Reset chat session: {session_id}")
         else:
             logger.info(f"No session to reset or model not loaded: {session_id}")
 
+def _env_admission(batch_max_size: int = 1) -> Optional[AdmissionController]:
+    # CHATBOT_MAX_IN_FLIGHT counts generate calls: a batched turn takes one of each call's
+    # batch_max_size slots, while a streamed turn runs its own call and takes them all
+    max_in_flight = env_int('CHATBOT_MAX_IN_FLIGHT', 2)
+    if max_in_flight <= 0:
+        return None
+    return AdmissionController(
+        max_in_flight=max_in_flight * max(1, batch_max_size),
+        max_queue=env_int('CHATBOT_ADMISSION_QUEUE', 16),
+        queue_timeout=env_float('CHATBOT_ADMISSION_TIMEOUT_MS', 5000) / 1000.0
+    )
+
+def _env_reply_cache() -> Optional[ReplyCache]:
+    if not env_flag('CHATBOT_REPLY_CACHE', False):
+        return None
+    ttl = env_float('CHATBOT_REPLY_CACHE_TTL', 3600)
+    return ReplyCache(
+        max_entries=env_int('CHATBOT_REPLY_CACHE_SIZE', 1024),
+        candidates=env_int('CHATBOT_REPLY_CACHE_CANDIDATES', 4),
+        ttl=ttl if ttl > 0 else None
+    )
+
 # Initialize a default chatbot instance
-default_chatbot = MentalHealthChatbot()
+_batch_max_size = env_int('CHATBOT_BATCH_MAX_SIZE', 1)
+default_chatbot = MentalHealthChatbot(
+    model_name=os.environ.get('CHATBOT_MODEL', 'microsoft/DialoGPT-small'),
+    batch_max_size=_batch_max_size,
+    batch_max_wait_ms=env_float('CHATBOT_BATCH_MAX_WAIT_MS', 5),
+    max_history_turns=env_int('CHATBOT_MAX_HISTORY_TURNS', 8),
+    max_history_tokens=env_int('CHATBOT_MAX_HISTORY_TOKENS', 512),
+    max_new_tokens=env_int('CHATBOT_MAX_NEW_TOKENS', 64),
+    load_mode=os.environ.get('CHATBOT_LOAD_MODE', 'background'),
+    backend=os.environ.get('CHATBOT_BACKEND', 'eager'),
+    generation_budget_ms=env_float('CHATBOT_GENERATION_BUDGET_MS', 10000),
+    admission=_env_admission(_batch_max_size),
+    reply_cache=_env_reply_cache(),
+    session_store=session_store_from_env(SessionStore(
+        max_entries=env_int('CHATBOT_SESSION_MAX_ENTRIES', 1000),
+        max_bytes=env_int('CHATBOT_SESSION_MAX_MB', 512) * 1024 * 1024,
+        idle_ttl=env_float('CHATBOT_SESSION_IDLE_TTL', 3600)
+    ))
+)
 
 def get_bot_response(user_input: str, session_id: str = "default") -> str:
     """Get a response from the chatbot for the given user input.
@@ -317,3 +993,15 @@ def get_bot_response(user_input: str, session_id: str = "default") -> str:
         The chatbot's response
     """
     return default_chatbot.get_response(user_input, session_id)
+
+def stream_bot_response(user_input: str, session_id: str = "default") -> Iterator[Tuple[str, str]]:
+    """Stream a response from the chatbot for the given user input.
+    
+    Args:
+        user_input: The user's message
+        session_id: Unique identifier for the conversation session
+        
+    Yields:
+        ``("token", text)`` chunks followed by ``("done", response)``
+    """
+    return default_chatbot.get_response_stream(user_input, session_id)
@@ -0,0 +1,44 @@
+import os
+import sqlite3
+import threading
+
+
+class SqliteConnections:
+    """Per-thread connections to one SQLite database, shared safely across threads and forks.
+
+    SQLite connections must not be used from several threads at once or
+    carried across a fork, so each thread gets its own, and a forked child
+    opens new ones instead of reusing its parent's. The database runs in
+    WAL mode so readers in other processes don't block on a write.
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        """Initialize the connections.
+
+        Args:
+            path: Database file (its directory is created if missing)
+            timeout: Seconds to wait for another process's write lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def connect(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def close(self) -> None:
+        """Close the calling thread's connection, if it opened one in this process."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
@@ -0,0 +1,38 @@
+import time
+from typing import List, Optional, Sequence
+
+import torch
+from transformers import StoppingCriteria
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """Stops generating for each sequence once its wall-clock deadline has passed.
+
+    Deadlines are ``time.monotonic()`` timestamps, one per row of the batch
+    (None for no deadline). Rows that already produced an EOS token have
+    finished on their own and are not counted as cut off.
+    """
+
+    def __init__(self, deadlines: Sequence[Optional[float]], prompt_length: int, eos_token_id: int):
+        """Initialize the criteria.
+
+        Args:
+            deadlines: Deadline for each row of the batch
+            prompt_length: Length of the (padded) prompt, so only generated tokens are checked for EOS
+            eos_token_id: Token that ends a reply
+        """
+        self.deadlines = list(deadlines)
+        self.prompt_length = prompt_length
+        # Not "eos_token_id": generate treats criteria with that attribute as its own EOS check
+        self.end_token_id = eos_token_id
+        self.expired: List[bool] = [False] * len(self.deadlines)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        now = time.monotonic()
+        for row, deadline in enumerate(self.deadlines):
+            if self.expired[row] or deadline is None or now < deadline:
+                continue
+            if (input_ids[row, self.prompt_length:] == self.end_token_id).any():
+                continue
+            self.expired[row] = True
+        return torch.tensor(self.expired, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,61 @@
+# Parsing for the CHATBOT_* (and GUNICORN_*) environment settings, so every
+# module reads flags and numbers the same way.
+import os
+from typing import Optional
+
+# Values that turn a flag off; anything else that is set turns it on
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def _get(name: str) -> Optional[str]:
+    """Return a variable's value, or None if it is unset or blank."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return None
+    return value.strip()
+
+
+def env_flag(name: str, default: bool) -> bool:
+    """Read an on/off setting.
+
+    Args:
+        name: Environment variable to read
+        default: Value when the variable is unset or blank
+
+    Returns:
+        False for "0", "false", "no" or "off" (in any case), True for anything else
+    """
+    value = _get(name)
+    if value is None:
+        return default
+    return value.lower() not in FALSE_VALUES
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting, or ``default`` when it is unset or blank.
+
+    Raises:
+        ValueError: If the variable is set to something that isn't an integer
+    """
+    value = _get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a numeric setting, or ``default`` when it is unset or blank.
+
+    Raises:
+        ValueError: If the variable is set to something that isn't a number
+    """
+    value = _get(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
@@ -0,0 +1,262 @@
+import base64
+import glob
+import json
+import logging
+import os
+import sqlite3
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.db import SqliteConnections
+
+logger = logging.getLogger(__name__)
+
+# A row for the index: session_id, timestamp, response path, log file, byte offset, byte length
+IndexEntry = Tuple[str, str, Optional[str], str, int, int]
+
+
+def encode_cursor(*values: Any) -> str:
+    """Pack the position after a page's last row into an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, *types: type) -> List[Any]:
+    """Unpack a cursor made by ``encode_cursor``.
+
+    Args:
+        cursor: The opaque cursor
+        *types: Expected type of each packed value, in order
+
+    Raises:
+        ValueError: If the cursor is malformed or does not hold one value of each type
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    # bool is a subclass of int, but a true/false id would only come from a forged cursor
+    if (not isinstance(values, list) or len(values) != len(types)
+            or any(isinstance(value, bool) or not isinstance(value, kind) for value, kind in zip(values, types))):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return values
+
+
+class HistoryIndex:
+    """SQLite index over the JSONL session logs.
+
+    Each logged turn gets one row with its session, timestamp, the path
+    that produced the reply, and where its line sits in the session's log
+    (file, byte offset and length). Queries walk an index to the rows
+    they need and then read only those lines, so their cost follows the
+    size of the page rather than the volume of logs. Pages are addressed
+    by keyset cursors, so deep pages cost no more than the first.
+
+    The log writer adds rows as it appends turns. ``rebuild`` indexes
+    existing logs from scratch, e.g. for logs written before the index
+    existed.
+
+    Log files are stored relative to the index's own directory, so the
+    index reads the right files whatever directory the server, a CLI or a
+    cron job runs from, and keeps working if the directory is moved whole.
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        """Initialize the index.
+
+        Args:
+            path: Database file (created if missing)
+            timeout: Seconds to wait for another process's write lock
+        """
+        self.path = os.path.abspath(path)
+        self._base = os.path.dirname(self.path)
+        self._db = SqliteConnections(self.path, timeout)
+        with self._db.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " id INTEGER PRIMARY KEY,"
+                " session_id TEXT NOT NULL,"
+                " timestamp TEXT NOT NULL,"
+                " path TEXT,"
+                " file TEXT NOT NULL,"
+                " offset INTEGER NOT NULL,"
+                " length INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id)")
+            # Covers time-range aggregates without touching the table rows
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_time ON turns (timestamp, id, path, session_id)")
+
+    def stored_path(self, file: str) -> str:
+        """Return how a log file is recorded in the index: relative to the index's directory."""
+        return os.path.relpath(os.path.abspath(file), self._base)
+
+    def resolve_path(self, file: str) -> str:
+        """Return the log file an index row's ``file`` refers to."""
+        return os.path.join(self._base, file)
+
+    def add(self, entries: Iterable[IndexEntry]) -> None:
+        """Index a batch of logged turns in one transaction.
+
+        Entries name their log file as the writer opened it (relative to the
+        current directory or absolute).
+        """
+        with self._db.connect() as conn:
+            conn.executemany(
+                "INSERT INTO turns (session_id, timestamp, path, file, offset, length) VALUES (?, ?, ?, ?, ?, ?)",
+                [(session_id, timestamp, path, self.stored_path(file), offset, length)
+                 for session_id, timestamp, path, file, offset, length in entries]
+            )
+
+    def session_turns(self, session_id: str, limit: int = 50,
+                      cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return one page of a session's turns, oldest first.
+
+        Args:
+            session_id: The session to read
+            limit: Most turns per page
+            cursor: ``next_cursor`` from the previous page (None for the first page)
+
+        Returns:
+            The turns and the cursor for the next page (None on the last page)
+        """
+        after = decode_cursor(cursor, int)[0] if cursor else 0
+        rows = self._db.connect().execute(
+            "SELECT id, session_id, timestamp, path, file, offset, length FROM turns"
+            " WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (session_id, after, limit + 1)
+        ).fetchall()
+        page, more = rows[:limit], len(rows) > limit
+        return self._read(page), encode_cursor(page[-1][0]) if more else None
+
+    def range_turns(self, start: str, end: str, limit: int = 50,
+                    cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return one page of turns from every session within a time range, oldest first.
+
+        Args:
+            start: Earliest timestamp included (``YYYY-MM-DD HH:MM:SS`` or a prefix of it)
+            end: Timestamp before which the range ends
+            limit: Most turns per page
+            cursor: ``next_cursor`` from the previous page (None for the first page)
+
+        Returns:
+            The turns and the cursor for the next page (None on the last page)
+        """
+        if cursor:
+            after_timestamp, after_id = decode_cursor(cursor, str, int)
+            where, params = "(timestamp, id) > (?, ?)", [after_timestamp, after_id]
+        else:
+            where, params = "timestamp >= ?", [start]
+        rows = self._db.connect().execute(
+            "SELECT id, session_id, timestamp, path, file, offset, length FROM turns"
+            f" WHERE {where} AND timestamp < ? ORDER BY timestamp, id LIMIT ?",
+            params + [end, limit + 1]
+        ).fetchall()
+        page, more = rows[:limit], len(rows) > limit
+        return self._read(page), encode_cursor(page[-1][2], page[-1][0]) if more else None
+
+    def path_counts(self, start: str, end: str, by_day: bool = False) -> Dict[str, Any]:
+        """Count turns by response path within a time range.
+
+        Args:
+            start: Earliest timestamp included
+            end: Timestamp before which the range ends
+            by_day: Also break the counts down per calendar day
+
+        Returns:
+            Total turns, distinct sessions, counts per path and, with
+            ``by_day``, counts per day and path
+        """
+        conn = self._db.connect()
+        totals = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT session_id) FROM turns WHERE timestamp >= ? AND timestamp < ?",
+            (start, end)
+        ).fetchone()
+        by_path = conn.execute(
+            "SELECT COALESCE(path, 'unknown'), COUNT(*) FROM turns"
+            " WHERE timestamp >= ? AND timestamp < ? GROUP BY 1 ORDER BY 1",
+            (start, end)
+        ).fetchall()
+        result: Dict[str, Any] = {"turns": totals[0], "sessions": totals[1], "paths": dict(by_path)}
+        if by_day:
+            days: Dict[str, Dict[str, int]] = defaultdict(dict)
+            for day, path, count in conn.execute(
+                "SELECT substr(timestamp, 1, 10), COALESCE(path, 'unknown'), COUNT(*) FROM turns"
+                " WHERE timestamp >= ? AND timestamp < ? GROUP BY 1, 2 ORDER BY 1, 2",
+                (start, end)
+            ):
+                days[day][path] = count
+            result["days"] = dict(days)
+        return result
+
+    def _read(self, rows: List[tuple]) -> List[Dict[str, Any]]:
+        """Read the logged lines behind a page of index rows, one open per file."""
+        records: Dict[int, Dict[str, Any]] = {}
+        by_file: Dict[str, List[tuple]] = defaultdict(list)
+        for row in rows:
+            by_file[row[4]].append(row)
+        for file, file_rows in by_file.items():
+            file = self.resolve_path(file)
+            try:
+                with open(file, "rb") as f:
+                    for row_id, session_id, timestamp, path, _, offset, length in sorted(file_rows, key=lambda r: r[5]):
+                        f.seek(offset)
+                        try:
+                            record = json.loads(f.read(length))
+                        except ValueError:
+                            logger.error(f"Index points at a corrupt line in {file} at offset {offset}")
+                            continue
+                        records[row_id] = {
+                            "session_id": session_id,
+                            "timestamp": timestamp,
+                            "user_message": record.get("user_message"),
+                            "bot_response": record.get("bot_response"),
+                            "response_path": path
+                        }
+            except OSError as e:
+                logger.error(f"Error reading indexed session log {file}: {e}")
+        return [records[row[0]] for row in rows if row[0] in records]
+
+    def reindex_file(self, file: str) -> int:
+        """Replace the index rows for one JSONL log by scanning it, e.g. after it was rewritten.
+
+        Returns:
+            Number of turns indexed
+        """
+        with self._db.connect() as conn:
+            return self._reindex(conn, file)
+
+    def rebuild(self, log_dir: str) -> int:
+        """Drop the index and rebuild it from every JSONL log in a directory.
+
+        Returns:
+            Number of turns indexed
+        """
+        total = 0
+        with self._db.connect() as conn:
+            conn.execute("DELETE FROM turns")
+            for file in sorted(glob.glob(os.path.join(log_dir, "session_*.jsonl"))):
+                total += self._reindex(conn, file)
+        return total
+
+    def _reindex(self, conn: sqlite3.Connection, file: str) -> int:
+        stored = self.stored_path(file)
+        entries: List[IndexEntry] = []
+        offset = 0
+        with open(file, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if isinstance(record, dict) and record.get("session_id") and record.get("timestamp"):
+                    entries.append((record["session_id"], record["timestamp"], record.get("response_path"),
+                                    stored, offset, len(line)))
+                offset += len(line)
+        conn.execute("DELETE FROM turns WHERE file = ?", (stored,))
+        conn.executemany(
+            "INSERT INTO turns (session_id, timestamp, path, file, offset, length) VALUES (?, ?, ?, ?, ?, ?)",
+            entries
+        )
+        return len(entries)
+
+    def close(self) -> None:
+        self._db.close()
@@ -1,8 +1,16 @@
 import logging
 import os
-from typing import Dict, Any
+from typing import Any, Dict, List, Optional
 import json
-from datetime import datetime
+import re
+import atexit
+import queue
+import threading
+import time
+from collections import defaultdict
+from app import metrics
+from app.env import env_flag, env_float, env_int
+from app.history import HistoryIndex, IndexEntry
 
 # Configure logging
 logging.basicConfig(
@@ -12,59 +20,458 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S"
 )
 
-# Create logs directory if it doesn't exist
-os.makedirs("logs", exist_ok=True)
+# Directory holding the per-session conversation logs (created by the first write)
+LOG_DIR = "logs"
 
-def log_conversation(session_id: str, timestamp: str, user_message: str, bot_response: str) -> None:
+def _env_history_index() -> Optional[HistoryIndex]:
+    if not env_flag('CHATBOT_HISTORY_INDEX', True):
+        return None
+    try:
+        return HistoryIndex(os.environ.get('CHATBOT_HISTORY_INDEX_PATH', os.path.join(LOG_DIR, "index.db")))
+    except Exception as e:
+        logging.error(f"Error opening history index: {e}")
+        return None
+
+_history_index: Optional[HistoryIndex] = None
+_history_index_opened = False
+_history_index_lock = threading.Lock()
+
+def get_history_index() -> Optional[HistoryIndex]:
+    """Return the session/timestamp index over the logs, kept up to date as turns are written.
+    
+    The index is opened (and its file created) on first use, so importing
+    this module touches nothing on disk.
+    
+    Returns:
+        The index, or None when it is disabled or could not be opened
+    """
+    global _history_index, _history_index_opened
+    if not _history_index_opened:
+        with _history_index_lock:
+            if not _history_index_opened:
+                _history_index = _env_history_index()
+                _history_index_opened = True
+    return _history_index
+
+def session_log_path(session_id: str, log_dir: str = LOG_DIR) -> str:
+    """Path of the append-only JSONL log for a session (one turn per line)."""
+    return os.path.join(log_dir, f"session_{session_id}.jsonl")
+
+def legacy_session_log_path(session_id: str, log_dir: str = LOG_DIR) -> str:
+    """Path of the older whole-file JSON log for a session."""
+    return os.path.join(log_dir, f"session_{session_id}.json")
+
+def read_session_log(path: str) -> List[Dict[str, Any]]:
+    """Read the turns recorded in a JSONL session log.
+    
+    Args:
+        path: The JSONL file to read
+        
+    Returns:
+        The logged turns in order; a torn or corrupt line is skipped
+    """
+    conversations = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logging.error(f"Skipping corrupt line in session log: {path}")
+                continue
+            conversations.append({
+                "timestamp": record.get("timestamp"),
+                "user_message": record.get("user_message"),
+                "bot_response": record.get("bot_response"),
+                "response_path": record.get("response_path")
+            })
+    return conversations
+
+def _write_records(records: List[Dict[str, Any]], fsync: bool = False) -> None:
+    """Write a batch of conversation records to the console, sessions.log and session logs.
+    
+    Lines for the same session are appended with a single open/write, and
+    with ``fsync`` each touched file is synced once for the whole batch.
+    Where each line landed is then added to the history index in one
+    transaction.
+    
+    Args:
+        records: Log entries with session_id, timestamp, user_message, bot_response
+            and optionally response_path
+        fsync: Force the session logs to disk before returning
+    """
+    with metrics.stage("log_write"):
+        _write_record_lines(records, fsync)
+
+def _write_record_lines(records: List[Dict[str, Any]], fsync: bool) -> None:
+    lines_by_session: Dict[str, List[bytes]] = defaultdict(list)
+    records_by_session: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        session_id = record["session_id"]
+        
+        # Log to console
+        print(f"[{record['timestamp']}] Session {session_id}: User: {record['user_message']} | Bot: {record['bot_response']}")
+        
+        # Append to main log file
+        logging.info(f"Session: {session_id} | User: {record['user_message']} | Bot: {record['bot_response']}")
+        
+        lines_by_session[session_id].append((json.dumps(record) + "\n").encode("utf-8"))
+        records_by_session[session_id].append(record)
+    
+    # Append to each session's log; earlier turns are never re-read or rewritten
+    os.makedirs(LOG_DIR, exist_ok=True)
+    index_entries: List[IndexEntry] = []
+    for session_id, lines in lines_by_session.items():
+        path = session_log_path(session_id)
+        data = b"".join(lines)
+        try:
+            with open(path, "ab") as f:
+                f.write(data)
+                f.flush()
+                # The file offset ends where this append landed, even if another process appended since
+                offset = f.tell() - len(data)
+                if fsync:
+                    os.fsync(f.fileno())
+        except Exception as e:
+            logging.error(f"Error writing to session log: {e}")
+            continue
+        for record, line in zip(records_by_session[session_id], lines):
+            index_entries.append((session_id, record["timestamp"], record.get("response_path"),
+                                  path, offset, len(line)))
+            offset += len(line)
+    
+    history_index = get_history_index() if index_entries else None
+    if history_index is not None:
+        try:
+            history_index.add(index_entries)
+        except Exception as e:
+            logging.error(f"Error updating history index: {e}")
+
+def log_conversation(session_id: str, timestamp: str, user_message: str, bot_response: str,
+                     response_path: Optional[str] = None) -> None:
     """Log a conversation between user and bot.
     
+    Writes synchronously; request handlers should use ``enqueue_conversation``.
+    
     Args:
         session_id: Unique session identifier
         timestamp: Time of the message
         user_message: Message from the user
         bot_response: Response from the chatbot
+        response_path: Which branch produced the reply (see ``metrics.RESPONSE_PATHS``)
     """
-    # Log to console
-    print(f"[{timestamp}] Session {session_id}: User: {user_message} | Bot: {bot_response}")
-    
-    # Log to file
     log_entry = {
         "session_id": session_id,
         "timestamp": timestamp,
         "user_message": user_message,
-        "bot_response": bot_response
+        "bot_response": bot_response,
+        "response_path": response_path
     }
+    _write_records([log_entry])
+
+# Spill files are named after the process that wrote them: spill-<pid>.jsonl, plus
+# the .draining file being replayed and the .claim file of one being adopted
+_SPILL_FILE = re.compile(r"spill-(\d+)\.jsonl(?:\.draining|\.claim)?")
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. the pid belongs to another user's process
+        return True
+    return True
+
+class AsyncLogWriter:
+    """Background writer that takes log records off the request path.
     
-    # Append to main log file
-    logging.info(f"Session: {session_id} | User: {user_message} | Bot: {bot_response}")
+    Records go into a bounded queue and a worker thread writes them in
+    batches, flushing when ``batch_size`` records are pending or
+    ``flush_interval`` seconds have passed, with one fsync per touched file
+    per batch. When the queue is full, ``overflow`` decides what happens:
     
-    # Save session-specific logs
-    session_file = f"logs/session_{session_id}.json"
+    - ``"block"``: wait for room in the queue
+    - ``"drop"``: discard the record and count it in ``dropped``
+    - ``"spill"``: append the record to a spill file that the worker
+      replays once the queue has drained (spilled turns may land after
+      later turns of the same session; their timestamps are preserved)
     
-    try:
-        # Load existing log if it exists
-        if os.path.exists(session_file):
-            with open(session_file, "r") as f:
+    Whatever the policy, the worker starts by replaying spill files in
+    ``spill_dir`` left behind by processes that are no longer running, so a
+    crashed or recycled worker's overflow still reaches the session logs.
+    """
+    
+    OVERFLOW_POLICIES = ("block", "drop", "spill")
+    
+    def __init__(self, max_queue: int = 10000, batch_size: int = 100, flush_interval: float = 0.5,
+                 overflow: str = "block", spill_dir: str = LOG_DIR):
+        """Initialize the writer.
+        
+        Args:
+            max_queue: Most records waiting to be written
+            batch_size: Records that trigger an immediate flush
+            flush_interval: Longest a record waits before being flushed, in seconds
+            overflow: What to do when the queue is full ("block", "drop" or "spill")
+            spill_dir: Where the spill file lives for the "spill" policy
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.max_queue = max_queue
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+        
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.spilled = 0
+    
+    @property
+    def spill_path(self) -> str:
+        # One spill file per process so forked workers never share one
+        return os.path.join(self.spill_dir, f"spill-{os.getpid()}.jsonl")
+    
+    def _ensure_started(self) -> None:
+        """Start the worker thread on first use (and again after a fork)."""
+        with self._lock:
+            if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Threads don't survive fork; records queued in the parent belong to the parent
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._worker.start()
+    
+    def submit(self, record: Dict[str, Any]) -> bool:
+        """Queue a record for writing.
+        
+        Args:
+            record: Log entry with session_id, timestamp, user_message and bot_response
+            
+        Returns:
+            False if the record was dropped, True otherwise
+        """
+        if self._closed:
+            _write_records([record])
+            return True
+        self._ensure_started()
+        if self.overflow == "block":
+            self._queue.put(record)
+            return True
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            if self.overflow == "drop":
+                self.dropped += 1
+                return False
+            self._spill(record)
+            return True
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every record queued so far has been written.
+        
+        Returns:
+            True if the queue drained before the timeout
+        """
+        if self._worker is None or self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+    
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """Drain the queue and any spill file, then stop the worker.
+        
+        If the worker is still writing when ``timeout`` runs out, it is left
+        to finish and replay the spill file itself.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._worker is None or self._pid != os.getpid():
+            self._replay_spill()
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if self._worker.is_alive():
+            logging.warning("Log writer still busy at close; leaving it to write the remaining records")
+    
+    def stats(self) -> Dict[str, int]:
+        """Return counters describing the writer's throughput and losses."""
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "spilled": self.spilled
+        }
+    
+    def _spill(self, record: Dict[str, Any]) -> None:
+        with self._spill_lock:
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self.spill_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+                self.spilled += 1
+            except Exception as e:
+                logging.error(f"Error spilling log record: {e}")
+                self.dropped += 1
+    
+    def _append_to_draining(self, path: str) -> None:
+        """Move a spill file's records onto the end of this process's draining file."""
+        with open(path, "rb") as f:
+            data = f.read()
+        if data and not data.endswith(b"\n"):
+            # Keep a torn last line from running into the next file's first record
+            data += b"\n"
+        with open(f"{self.spill_path}.draining", "ab") as f:
+            f.write(data)
+        os.remove(path)
+    
+    def _adopt_orphaned_spills(self) -> None:
+        """Take over spill and draining files left by processes that have exited."""
+        try:
+            names = sorted(os.listdir(self.spill_dir))
+        except OSError:
+            return
+        claim = f"{self.spill_path}.claim"
+        with self._spill_lock:
+            if os.path.exists(claim):
+                # Left by an earlier process with this pid
+                self._append_to_draining(claim)
+            for name in names:
+                match = _SPILL_FILE.fullmatch(name)
+                if match is None:
+                    continue
+                pid = int(match.group(1))
+                if pid == os.getpid() or _process_alive(pid):
+                    continue
                 try:
-                    session_logs = json.load(f)
+                    # Renaming claims the file, so two starting workers never replay it twice
+                    os.replace(os.path.join(self.spill_dir, name), claim)
+                except FileNotFoundError:
+                    continue
+                self._append_to_draining(claim)
+                logging.info(f"Replaying log records spilled by exited process {pid}")
+    
+    def _replay_spill(self) -> None:
+        """Write out records that overflowed to the spill file."""
+        draining = f"{self.spill_path}.draining"
+        with self._spill_lock:
+            if os.path.exists(self.spill_path):
+                # Appending keeps whatever an earlier, failed replay left in the draining file
+                self._append_to_draining(self.spill_path)
+            if not os.path.exists(draining):
+                return
+        records = []
+        with open(draining, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
                 except json.JSONDecodeError:
-                    session_logs = {"session_id": session_id, "conversations": []}
-        else:
-            session_logs = {"session_id": session_id, "conversations": []}
+                    continue
+        self._write_batch(records)
+        os.remove(draining)
+    
+    def _write_batch(self, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        try:
+            _write_records(records, fsync=True)
+        except Exception as e:
+            logging.error(f"Error writing log batch: {e}")
+        self.written += len(records)
+        self.batches += 1
+    
+    def _run(self) -> None:
+        try:
+            self._adopt_orphaned_spills()
+            self._replay_spill()
+        except Exception as e:
+            logging.error(f"Error replaying spilled log records: {e}")
         
-        # Add new entry
-        session_logs["conversations"].append({
+        batch: List[Dict[str, Any]] = []
+        batch_started = 0.0
+        stopping = False
+        while not stopping:
+            timeout = self.flush_interval if not batch else max(0.0, batch_started + self.flush_interval - time.monotonic())
+            try:
+                record = self._queue.get(timeout=timeout)
+                if record is None:
+                    stopping = True
+                    self._queue.task_done()
+                else:
+                    if not batch:
+                        batch_started = time.monotonic()
+                    batch.append(record)
+                    if len(batch) < self.batch_size:
+                        continue
+            except queue.Empty:
+                pass
+            
+            self._write_batch(batch)
+            for _ in batch:
+                self._queue.task_done()
+            batch = []
+            
+            if stopping or (self.overflow == "spill" and self._queue.empty()):
+                self._replay_spill()
+
+def _env_log_writer() -> AsyncLogWriter:
+    writer = AsyncLogWriter(
+        max_queue=env_int('CHATBOT_LOG_QUEUE_SIZE', 10000),
+        batch_size=env_int('CHATBOT_LOG_BATCH_SIZE', 100),
+        flush_interval=env_float('CHATBOT_LOG_FLUSH_INTERVAL_MS', 500) / 1000.0,
+        overflow=os.environ.get('CHATBOT_LOG_OVERFLOW', 'block')
+    )
+    atexit.register(writer.close)
+    return writer
+
+# Shared background writer used by the request handlers
+default_log_writer = _env_log_writer()
+
+def enqueue_conversation(session_id: str, timestamp: str, user_message: str, bot_response: str,
+                         response_path: Optional[str] = None) -> bool:
+    """Queue a conversation turn for the background writer.
+    
+    Args:
+        session_id: Unique session identifier
+        timestamp: Time of the message
+        user_message: Message from the user
+        bot_response: Response from the chatbot
+        response_path: Which branch produced the reply (see ``metrics.RESPONSE_PATHS``)
+        
+    Returns:
+        False if the record was dropped because the queue was full
+    """
+    with metrics.stage("log_enqueue"):
+        return default_log_writer.submit({
+            "session_id": session_id,
             "timestamp": timestamp,
             "user_message": user_message,
-            "bot_response": bot_response
+            "bot_response": bot_response,
+            "response_path": response_path
         })
-        
-        # Write back to file
-        with open(session_file, "w") as f:
-            json.dump(session_logs, f, indent=2)
-    
-    except Exception as e:
-        logging.error(f"Error writing to session log: {e}")
 
 def get_session_history(session_id: str) -> Dict[str, Any]:
     """Retrieve conversation history for a specific session.
@@ -75,14 +482,20 @@ def get_session_history(session_id: str) -> Dict[str, Any]:
     Returns:
         Dictionary containing the session conversation history
     """
-    session_file = f"logs/session_{session_id}.json"
+    history = {"session_id": session_id, "conversations": []}
     
-    if os.path.exists(session_file):
-        try:
-            with open(session_file, "r") as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"Error reading session log: {e}")
-            return {"session_id": session_id, "conversations": []}
-    else:
+    try:
+        # Sessions logged before the JSONL format may still have an unmigrated JSON file
+        legacy_file = legacy_session_log_path(session_id)
+        if os.path.exists(legacy_file):
+            with open(legacy_file, "r") as f:
+                history["conversations"].extend(json.load(f).get("conversations", []))
+        
+        session_file = session_log_path(session_id)
+        if os.path.exists(session_file):
+            history["conversations"].extend(read_session_log(session_file))
+    except Exception as e:
+        logging.error(f"Error reading session log: {e}")
         return {"session_id": session_id, "conversations": []}
+    
+    return history
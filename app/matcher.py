@@ -0,0 +1,144 @@
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# Joins messages for batch classification
+_SEPARATOR = "\x00"
+
+
+class MessageClassification(NamedTuple):
+    """Safety and topic hits for a single message."""
+    offensive: bool
+    crisis: bool
+    topic: Optional[str]
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Build a regex matching any of ``words``, factored into a prefix trie.
+
+    At each position the regex engine branches on the next character instead
+    of trying every keyword in turn, so matching cost follows message length
+    rather than the number of keywords. Longer keywords win over their prefixes.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        is_end = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if is_end:
+            body = f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+
+class SafetyMatcher:
+    """Classifies messages into offensive, crisis and topic hits with precompiled regexes.
+
+    Every crisis and topic keyword is compiled into one regex factored as a
+    prefix trie, and the offensive patterns into one alternation, so a message
+    is lowercased once and scanned inside the regex engine rather than once
+    per keyword. Results are resolved with the chatbot's priority order:
+    offensive, then crisis, then topics in the order they were given.
+    """
+
+    def __init__(self, offensive_patterns: Sequence[str], crisis_keywords: Sequence[str],
+                 topic_keywords: Dict[str, Sequence[str]]):
+        """Compile the matcher.
+
+        Args:
+            offensive_patterns: Regexes for offensive language
+            crisis_keywords: Substrings that indicate a crisis
+            topic_keywords: Topic name mapped to the substrings that indicate it,
+                in priority order
+        """
+        self.topics = list(topic_keywords)
+
+        # Crisis ranks above every topic; topics rank in the order given
+        self._ranks = {"crisis": -1}
+        self._ranks.update({topic: rank for rank, topic in enumerate(self.topics)})
+
+        categories: Dict[str, List[str]] = {}
+        for keyword in crisis_keywords:
+            categories.setdefault(keyword.lower(), []).append("crisis")
+        for topic, keywords in topic_keywords.items():
+            for keyword in keywords:
+                categories.setdefault(keyword.lower(), []).append(topic)
+
+        # Each match is the longest keyword starting at its position, and every shorter
+        # keyword it starts with matched there too, so a match counts for all of their
+        # categories: its crisis hit and its highest-ranked topic
+        self._hits: Dict[str, Tuple[bool, Optional[str]]] = {}
+        for keyword in categories:
+            found = [category for length in range(1, len(keyword) + 1)
+                     for category in categories.get(keyword[:length], ())]
+            topics = [category for category in found if category != "crisis"]
+            self._hits[keyword] = ("crisis" in found, min(topics, key=self._ranks.__getitem__) if topics else None)
+
+        # Offensive patterns are word-boundary regexes; they get their own compiled
+        # alternation because mixing them into the keyword trie would stop the regex
+        # engine from skipping ahead to characters that can start a keyword
+        self._offensive = re.compile("|".join(f"(?:{p})" for p in offensive_patterns)) if offensive_patterns else None
+        self._keywords = re.compile(_trie_pattern(self._hits)) if self._hits else None
+
+    def _scan(self, text: str, start: int = 0, end: Optional[int] = None) -> Tuple[bool, bool, Optional[str]]:
+        """Find the offensive, crisis and topic hits in ``text[start:end]``."""
+        end = len(text) if end is None else end
+        offensive = self._offensive is not None and self._offensive.search(text, start, end) is not None
+        crisis = False
+        topic = None
+        if self._keywords is None:
+            return offensive, crisis, topic
+
+        # Resume one character after each hit so keywords starting inside another are still found
+        search = self._keywords.search
+        match = search(text, start, end)
+        while match is not None:
+            crisis_hit, topic_hit = self._hits[match.group()]
+            crisis = crisis or crisis_hit
+            if topic_hit is not None and (topic is None or self._ranks[topic_hit] < self._ranks[topic]):
+                topic = topic_hit
+            match = search(text, match.start() + 1, end)
+        return offensive, crisis, topic
+
+    def classify(self, text: str) -> MessageClassification:
+        """Classify a single message.
+
+        Args:
+            text: The user's message
+
+        Returns:
+            Whether it is offensive, whether it signals a crisis, and its topic
+        """
+        return MessageClassification(*self._scan(text.lower()))
+
+    def classify_many(self, texts: Sequence[str]) -> List[MessageClassification]:
+        """Classify many messages, lowercasing and searching them as one string.
+
+        Args:
+            texts: The messages to classify
+
+        Returns:
+            One classification per message, in order
+        """
+        joined = _SEPARATOR.join(texts).lower()
+        results = []
+        start = 0
+        for text in texts:
+            # Lowercasing can change a string's length, so find each boundary in the joined text
+            end = joined.find(_SEPARATOR, start) if _SEPARATOR not in text else -1
+            if end < 0:
+                # Fall back for messages that contain the separator themselves
+                results.append(self.classify(text))
+                start += len(text.lower()) + len(_SEPARATOR)
+                continue
+            results.append(MessageClassification(*self._scan(joined, start, end)))
+            start = end + len(_SEPARATOR)
+        return results
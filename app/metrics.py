@@ -0,0 +1,313 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.env import env_flag
+
+# Latency buckets in seconds, from a regex check up to a long generation
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Instrumentation switch; when off, every recording call returns straight away
+enabled = env_flag('CHATBOT_METRICS', True)
+
+
+def set_enabled(value: bool) -> None:
+    """Turn instrumentation on or off at runtime."""
+    global enabled
+    enabled = value
+
+
+class _NullTimer:
+    """Stand-in for a timer while instrumentation is off."""
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child: "_HistogramChild"):
+        self._child = child
+
+    def __enter__(self) -> "_Timer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._child.observe(time.perf_counter() - self._started)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A named metric family with optional labels."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Return the series for one combination of label values (created on first use)."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            # labels() may add a series while we render
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        if not enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def set_total(self, value: float) -> None:
+        """Mirror a running total kept elsewhere (e.g. the session store's own counters)."""
+        self.value = value
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. responses served."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, e.g. sessions in memory."""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        if not enabled:
+            return
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager that observes the duration of its block in seconds."""
+        if not enabled:
+            return _NULL_TIMER
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, e.g. stage latency."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _render_child(self, values: Tuple[str, ...], child: _HistogramChild) -> List[str]:
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, ("le", _format_value(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The set of metrics exposed on ``/metrics``.
+
+    Metrics live in the process that records them. Under gunicorn every
+    worker has its own registry, so scrape each worker on its own port
+    (``CHATBOT_METRICS_WORKER_PORT``) rather than the shared one.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Time spent per stage of a turn: safety, admission_wait, tokenize, generate, decode, log_enqueue, log_write
+stage_seconds = REGISTRY.register(Histogram(
+    "chatbot_stage_seconds", "Time spent in each stage of handling a message.", ["stage"]))
+request_seconds = REGISTRY.register(Histogram(
+    "chatbot_request_seconds", "Time to handle a chat request end to end.", ["endpoint"]))
+
+# Which branch produced each reply
+RESPONSE_PATHS = ("crisis", "offensive", "empathetic", "grounding", "rule_fallback",
+                  "model", "cached", "short_fallback", "deadline_partial", "deadline_fallback", "shed", "exception")
+responses = REGISTRY.register(Counter(
+    "chatbot_responses_total", "Replies served, by the path that produced them.", ["path"]))
+for _path in RESPONSE_PATHS:
+    # Export every path from the start so rates don't begin with a gap
+    responses.labels(_path)
+
+deadline_hits = REGISTRY.register(Counter(
+    "chatbot_deadline_hits_total", "Model replies cut off because their latency budget ran out."))
+
+tokens_in = REGISTRY.register(Counter(
+    "chatbot_tokens_in_total", "Prompt tokens (history plus new message) passed to the model."))
+tokens_out = REGISTRY.register(Counter(
+    "chatbot_tokens_out_total", "Tokens generated by the model."))
+
+# Refreshed from the session store and log writer on each scrape
+sessions = REGISTRY.register(Gauge(
+    "chatbot_sessions", "Conversations held in the session store."))
+session_bytes = REGISTRY.register(Gauge(
+    "chatbot_session_bytes", "Approximate memory held by session history and KV caches."))
+session_events = REGISTRY.register(Counter(
+    "chatbot_session_events_total",
+    "Session store hits, misses, evictions, expirations, cache drops and persistent loads, saves, reloads and errors.",
+    ["event"]))
+admission_in_flight = REGISTRY.register(Gauge(
+    "chatbot_admission_in_flight", "Model generations currently running."))
+admission_queue_depth = REGISTRY.register(Gauge(
+    "chatbot_admission_queue_depth", "Model-bound requests waiting for a generation slot."))
+admission_events = REGISTRY.register(Counter(
+    "chatbot_admission_total", "Model-bound requests admitted or shed (queue full or wait timed out).", ["outcome"]))
+reply_cache_entries = REGISTRY.register(Gauge(
+    "chatbot_reply_cache_entries", "Turns with cached model replies."))
+reply_cache_events = REGISTRY.register(Counter(
+    "chatbot_reply_cache_total", "Reply cache hits, misses, stored replies, evictions and expirations.", ["event"]))
+log_queue_depth = REGISTRY.register(Gauge(
+    "chatbot_log_queue_depth", "Conversation log records waiting for the background writer."))
+log_records = REGISTRY.register(Counter(
+    "chatbot_log_records_total", "Conversation log records written, dropped or spilled.", ["outcome"]))
+
+
+def stage(name: str):
+    """Time a block as one stage of handling a message.
+
+    Args:
+        name: Stage label, e.g. "safety", "tokenize", "generate" or "decode"
+
+    Returns:
+        A context manager (a shared no-op while instrumentation is off)
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return stage_seconds.labels(name).time()
+
+
+def count_response(path: str) -> None:
+    """Count a reply served by one of ``RESPONSE_PATHS``."""
+    if enabled:
+        responses.labels(path).inc()
+
+
+def render() -> str:
+    """Return the registry in the Prometheus text exposition format."""
+    return REGISTRY.render()
@@ -0,0 +1,145 @@
+# One-shot migration of logs/session_<id>.json files to the append-only JSONL format.
+#
+# Stop the server first: each session's JSONL log is rewritten through a
+# temporary file, and a turn the server appends while that happens would
+# be lost. A session whose log grows mid-rewrite is left unmigrated.
+#
+# The history index updated is the one for --log-dir: the server's
+# (CHATBOT_HISTORY_INDEX_PATH) for its own log directory, otherwise
+# <log-dir>/index.db, unless --index names another file.
+#
+# Usage:
+#     python -m app.migrate_logs [--log-dir logs] [--delete] [--rebuild-index] [--index FILE]
+import argparse
+import glob
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+from app.env import env_flag
+from app.history import HistoryIndex
+from app.logger import LOG_DIR, legacy_session_log_path, session_log_path
+
+def history_index_for(log_dir: str, path: Optional[str] = None) -> Optional[HistoryIndex]:
+    """Open the history index that covers a log directory.
+
+    Args:
+        log_dir: Directory holding the session logs
+        path: Index file to use instead of the default for ``log_dir``
+
+    Returns:
+        The index, or None when indexing is disabled and no ``path`` was given
+    """
+    if path is None:
+        if not env_flag('CHATBOT_HISTORY_INDEX', True):
+            return None
+        if os.path.abspath(log_dir) == os.path.abspath(LOG_DIR):
+            path = os.environ.get('CHATBOT_HISTORY_INDEX_PATH', os.path.join(LOG_DIR, "index.db"))
+        else:
+            path = os.path.join(log_dir, "index.db")
+    return HistoryIndex(path)
+
+def migrate_session_log(legacy_file: str, log_dir: str = LOG_DIR, delete: bool = False,
+                        index: Optional[HistoryIndex] = None) -> int:
+    """Convert one whole-file JSON session log to JSONL.
+
+    Turns already appended to the session's JSONL log (e.g. logged after a
+    deploy but before migrating) are kept after the migrated ones. The
+    server must not be writing to ``log_dir`` meanwhile.
+
+    Args:
+        legacy_file: Path of the ``session_<id>.json`` file
+        log_dir: Directory holding the session logs
+        delete: Remove the JSON file afterwards instead of renaming it to ``.json.migrated``
+        index: History index to update for the rewritten log (None to skip)
+
+    Returns:
+        Number of turns migrated
+
+    Raises:
+        RuntimeError: If the JSONL log grew while it was being rewritten
+    """
+    with open(legacy_file, "r") as f:
+        session_logs = json.load(f)
+
+    name = os.path.basename(legacy_file)
+    session_id = session_logs.get("session_id") or name[len("session_"):-len(".json")]
+    target = session_log_path(session_id, log_dir)
+    tmp_file = f"{target}.tmp"
+
+    with open(tmp_file, "w") as out:
+        for entry in session_logs.get("conversations", []):
+            out.write(json.dumps({
+                "session_id": session_id,
+                "timestamp": entry.get("timestamp"),
+                "user_message": entry.get("user_message"),
+                "bot_response": entry.get("bot_response")
+            }) + "\n")
+        copied = 0
+        if os.path.exists(target):
+            with open(target, "rb") as existing:
+                data = existing.read()
+            out.write(data.decode("utf-8"))
+            copied = len(data)
+        out.flush()
+        os.fsync(out.fileno())
+    if os.path.exists(target) and os.path.getsize(target) != copied:
+        # Something appended to the log after it was copied; replacing it would lose those turns
+        os.remove(tmp_file)
+        raise RuntimeError(f"{target} changed while it was being migrated; stop the server and retry")
+    os.replace(tmp_file, target)
+    if index is not None:
+        # The rewrite moved any turns already indexed for this session
+        index.reindex_file(target)
+
+    if delete:
+        os.remove(legacy_file)
+    else:
+        os.replace(legacy_file, f"{legacy_file}.migrated")
+    return len(session_logs.get("conversations", []))
+
+def migrate_logs(log_dir: str = LOG_DIR, delete: bool = False,
+                 index: Optional[HistoryIndex] = None) -> Dict[str, int]:
+    """Migrate every legacy JSON session log in a directory.
+
+    Args:
+        log_dir: Directory holding the session logs
+        delete: Remove the JSON files afterwards instead of renaming them
+        index: History index to update for the rewritten logs (None to skip)
+
+    Returns:
+        Counts of migrated sessions, migrated turns and files that failed
+    """
+    summary = {"sessions": 0, "turns": 0, "failed": 0}
+    for legacy_file in sorted(glob.glob(legacy_session_log_path("*", log_dir))):
+        try:
+            summary["turns"] += migrate_session_log(legacy_file, log_dir, delete, index)
+            summary["sessions"] += 1
+        except Exception as e:
+            logging.error(f"Error migrating session log {legacy_file}: {e}")
+            summary["failed"] += 1
+    return summary
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate JSON session logs to append-only JSONL.")
+    parser.add_argument("--log-dir", default=LOG_DIR, help="Directory holding session_*.json files")
+    parser.add_argument("--delete", action="store_true", help="Delete JSON files instead of renaming them")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="Rebuild the history index from every JSONL log afterwards")
+    parser.add_argument("--index", default=None,
+                        help="History index file (defaults to the one for --log-dir)")
+    args = parser.parse_args()
+
+    index = history_index_for(args.log_dir, args.index)
+    summary = migrate_logs(args.log_dir, args.delete, index)
+    print(f"Migrated {summary['turns']} turns from {summary['sessions']} sessions "
+          f"({summary['failed']} failed)")
+    if args.rebuild_index:
+        if index is None:
+            print("History index is disabled (CHATBOT_HISTORY_INDEX=0)")
+        else:
+            print(f"Indexed {index.rebuild(args.log_dir)} turns into {index.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Optional, Tuple
+
+from app.db import SqliteConnections
+from app.env import env_float
+from app.sessions import SessionState, SessionStore
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
+# Blob layout: magic, bytes per token id (2 or 4), padding, then the ids little-endian
+_MAGIC = b"MHS1"
+_HEADER = struct.Struct("<4sB3x")
+
+
+def encode_token_ids(token_ids: "torch.Tensor") -> bytes:
+    """Pack a session's token history into a compact binary blob.
+
+    Ids are stored as unsigned 16-bit integers when they all fit (GPT-2's
+    50257-token vocabulary does), otherwise as signed 32-bit integers.
+
+    Args:
+        token_ids: History token ids, shape ``(1, seq_len)``
+
+    Returns:
+        The header followed by the packed ids
+    """
+    ids = token_ids.reshape(-1).tolist()
+    width = 2 if all(0 <= token < 2 ** 16 for token in ids) else 4
+    packed = array("H" if width == 2 else "i", ids)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return _HEADER.pack(_MAGIC, width) + packed.tobytes()
+
+
+def decode_token_ids(blob: bytes) -> "torch.Tensor":
+    """Unpack a blob written by ``encode_token_ids``.
+
+    Args:
+        blob: The stored bytes
+
+    Returns:
+        The token ids as a long tensor of shape ``(1, seq_len)``
+    """
+    import torch
+
+    magic, width = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or width not in (2, 4):
+        raise ValueError("Not a session token blob")
+    ids = array("H" if width == 2 else "i")
+    ids.frombytes(blob[_HEADER.size:])
+    if sys.byteorder != "little":
+        ids.byteswap()
+    return torch.tensor(ids, dtype=torch.long).unsqueeze(0)
+
+
+class DirectoryKVStore:
+    """Key-value store keeping one file per key in a directory.
+
+    Writes go to a temporary file that is renamed over the old one, so
+    readers in other processes see either the previous value or the new
+    one, never a torn write. A value's version is its file's identity
+    (inode, modification time and size), which changes on every write.
+    """
+
+    def __init__(self, path: str):
+        """Initialize the store.
+
+        Args:
+            path: Directory holding the values (created if missing)
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        # Session ids come from clients; hash them into safe, fixed-length file names
+        return os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".bin")
+
+    @staticmethod
+    def _version(stat: os.stat_result) -> Hashable:
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Hashable]]:
+        """Return a key's value and version, or None if it is not stored."""
+        try:
+            with open(self._file(key), "rb") as f:
+                return f.read(), self._version(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None
+
+    def version(self, key: str) -> Optional[Hashable]:
+        """Return a key's current version without reading its value."""
+        try:
+            return self._version(os.stat(self._file(key)))
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes) -> Hashable:
+        """Store a value, replacing any previous one, and return its new version."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+                # Flush before taking the version so it records the final size, and sync so the rename is durable
+                f.flush()
+                os.fsync(f.fileno())
+                version = self._version(os.fstat(f.fileno()))
+            os.replace(tmp_path, self._file(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return version
+
+    def delete(self, key: str) -> None:
+        """Remove a key if it is stored."""
+        try:
+            os.unlink(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, older_than: float) -> int:
+        """Remove values last written before a wall-clock time; returns how many."""
+        removed = 0
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.endswith(".bin") and entry.stat().st_mtime < older_than:
+                        os.unlink(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+    def close(self) -> None:
+        return None
+
+
+class SqliteKVStore:
+    """Key-value store in a single SQLite table, shared by every process that opens the file.
+
+    Each write stamps the row with a fresh random version. Connections
+    come from ``SqliteConnections`` (per thread, WAL mode).
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        """Initialize the store.
+
+        Args:
+            path: Database file (created if missing)
+            timeout: Seconds to wait for another process's write lock
+        """
+        self.path = path
+        self._db = SqliteConnections(path, timeout)
+        with self._db.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " version INTEGER NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_updated ON kv (updated)")
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Hashable]]:
+        """Return a key's value and version, or None if it is not stored."""
+        row = self._db.connect().execute("SELECT value, version FROM kv WHERE key = ?", (key,)).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def version(self, key: str) -> Optional[Hashable]:
+        """Return a key's current version without reading its value."""
+        row = self._db.connect().execute("SELECT version FROM kv WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: bytes) -> Hashable:
+        """Store a value, replacing any previous one, and return its new version."""
+        version = random.getrandbits(62)
+        with self._db.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, version, updated) VALUES (?, ?, ?, ?)",
+                         (key, sqlite3.Binary(value), version, time.time()))
+        return version
+
+    def delete(self, key: str) -> None:
+        """Remove a key if it is stored."""
+        with self._db.connect() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def prune(self, older_than: float) -> int:
+        """Remove values last written before a wall-clock time; returns how many."""
+        with self._db.connect() as conn:
+            return conn.execute("DELETE FROM kv WHERE updated < ?", (older_than,)).rowcount
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class PersistentSessionStore:
+    """Session store that writes each session's token history through to a key-value store.
+
+    Sessions are served from an in-memory ``SessionStore`` (which keeps
+    their KV caches). Every ``put`` also saves the history as a compact
+    token blob, and a session missing from memory — after a restart, an
+    eviction, or when another worker served it — is loaded from the
+    key-value store the first time it is asked for. Nothing is read at
+    startup.
+
+    With ``validate`` on, a session found in memory is checked against the
+    stored version first, so when several workers share one store a turn
+    handled elsewhere is picked up instead of being overwritten.
+    Restored sessions have no KV cache; their next turn prefills the
+    history once and caches it as usual.
+    """
+
+    def __init__(self, backend: Any, cache: Optional[SessionStore] = None, validate: bool = True,
+                 max_age: Optional[float] = None, prune_interval: float = 600.0):
+        """Initialize the store.
+
+        Args:
+            backend: A key-value store such as ``DirectoryKVStore`` or ``SqliteKVStore``
+            cache: In-memory store for live sessions (defaults to a bounded ``SessionStore``)
+            validate: Check cached sessions against the stored version before use
+            max_age: Seconds after its last write that a stored session is deleted (None to keep forever)
+            prune_interval: Seconds between sweeps for sessions older than ``max_age``
+        """
+        self.backend = backend
+        self.cache = cache if cache is not None else SessionStore()
+        self.validate = validate
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+
+        # Stored version each cached state was loaded or saved at; entries go when the cache drops the state
+        self._versions: "weakref.WeakKeyDictionary[SessionState, Hashable]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._next_prune = time.monotonic() + prune_interval
+
+        self.loads = 0
+        self.saves = 0
+        self.reloads = 0
+        self.errors = 0
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def __contains__(self, session_id: str) -> bool:
+        if session_id in self.cache:
+            return True
+        try:
+            return self.backend.version(session_id) is not None
+        except Exception as e:
+            self._backend_error("check", session_id, e)
+            return False
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        """Look up a session in memory, falling back to the key-value store.
+
+        Args:
+            session_id: The session to look up
+
+        Returns:
+            The session state, or None if it has never been saved
+        """
+        state = self.cache.get(session_id)
+        if state is not None:
+            if not self.validate:
+                return state
+            with self._lock:
+                known = self._versions.get(state)
+            try:
+                current = self.backend.version(session_id)
+            except Exception as e:
+                self._backend_error("check", session_id, e)
+                return state
+            if current == known:
+                return state
+            # Another worker wrote (or reset) this session since we last saw it
+            self.cache.pop(session_id)
+            if current is None:
+                return None
+            self.reloads += 1
+        return self._load(session_id)
+
+    def _load(self, session_id: str) -> Optional[SessionState]:
+        try:
+            stored = self.backend.get(session_id)
+            if stored is None:
+                return None
+            blob, version = stored
+            state = SessionState(decode_token_ids(blob))
+        except Exception as e:
+            self._backend_error("load", session_id, e)
+            return None
+        self.cache.put(session_id, state)
+        with self._lock:
+            self._versions[state] = version
+        self.loads += 1
+        logger.info(f"Restored chat session {session_id} ({len(state)} tokens)")
+        return state
+
+    def put(self, session_id: str, state: SessionState) -> None:
+        """Store a session in memory and save its token history.
+
+        Args:
+            session_id: The session to store
+            state: Its current state
+        """
+        self.cache.put(session_id, state)
+        try:
+            version = self.backend.set(session_id, encode_token_ids(state.token_ids))
+        except Exception as e:
+            # The conversation carries on from memory; only durability is lost
+            self._backend_error("save", session_id, e)
+            return
+        with self._lock:
+            self._versions[state] = version
+        self.saves += 1
+        self._maybe_prune()
+
+    def pop(self, session_id: str) -> Optional[SessionState]:
+        """Remove a session from memory and storage, returning its state if known."""
+        state = self.cache.pop(session_id)
+        try:
+            if state is None:
+                stored = self.backend.get(session_id)
+                if stored is not None:
+                    state = SessionState(decode_token_ids(stored[0]))
+            self.backend.delete(session_id)
+        except Exception as e:
+            self._backend_error("delete", session_id, e)
+        return state
+
+    def clear(self) -> None:
+        """Forget every session held in memory; stored sessions are kept."""
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the in-memory store's counters plus load/save activity."""
+        stats = self.cache.stats()
+        stats.update({
+            "loads": self.loads,
+            "saves": self.saves,
+            "reloads": self.reloads,
+            "errors": self.errors
+        })
+        return stats
+
+    def close(self) -> None:
+        self.backend.close()
+
+    def _maybe_prune(self) -> None:
+        if self.max_age is None or time.monotonic() < self._next_prune:
+            return
+        with self._lock:
+            if time.monotonic() < self._next_prune:
+                return
+            self._next_prune = time.monotonic() + self.prune_interval
+        try:
+            removed = self.backend.prune(time.time() - self.max_age)
+        except Exception as e:
+            self._backend_error("prune", "*", e)
+            return
+        if removed:
+            logger.info(f"Pruned {removed} stored chat sessions older than {self.max_age:.0f}s")
+
+    def _backend_error(self, action: str, session_id: str, error: Exception) -> None:
+        self.errors += 1
+        logger.error(f"Could not {action} stored chat session {session_id}: {error}")
+
+
+def session_store_from_env(cache: SessionStore) -> Any:
+    """Wrap an in-memory session store in the persistent backend named by the environment.
+
+    ``CHATBOT_SESSION_BACKEND`` is ``memory`` (the default, nothing is saved),
+    ``directory`` or ``sqlite``; ``CHATBOT_SESSION_PATH`` says where sessions
+    are kept and ``CHATBOT_SESSION_MAX_AGE`` how long, in seconds, they
+    outlive their last turn.
+
+    Args:
+        cache: The in-memory store to serve live sessions from
+
+    Returns:
+        ``cache`` itself, or a ``PersistentSessionStore`` around it
+    """
+    kind = os.environ.get('CHATBOT_SESSION_BACKEND', 'memory').lower()
+    if kind == 'memory':
+        return cache
+    if kind == 'directory':
+        backend = DirectoryKVStore(os.environ.get('CHATBOT_SESSION_PATH', 'sessions'))
+    elif kind == 'sqlite':
+        backend = SqliteKVStore(os.environ.get('CHATBOT_SESSION_PATH', 'sessions.db'))
+    else:
+        raise ValueError(f"Unknown CHATBOT_SESSION_BACKEND {kind!r}; expected memory, directory or sqlite")
+    max_age = env_float('CHATBOT_SESSION_MAX_AGE', 604800)
+    return PersistentSessionStore(backend, cache=cache, max_age=max_age if max_age > 0 else None)
@@ -0,0 +1,161 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+# Cache key: normalized message plus a digest of the history it was answered after
+ReplyKey = Tuple[str, str]
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " .,!?;:'\"…"
+
+
+def normalize_message(text: str) -> str:
+    """Fold a message to the form used in cache keys.
+
+    Case, runs of whitespace and punctuation at either end are ignored, so
+    "I am depressed." and "i am  depressed" share an entry.
+    """
+    return _WHITESPACE.sub(" ", text.lower()).strip(_EDGE_PUNCTUATION)
+
+
+def history_digest(token_ids: Optional["torch.Tensor"]) -> str:
+    """Digest of a session's history tokens ("" for a fresh session)."""
+    if token_ids is None or token_ids.shape[-1] == 0:
+        return ""
+    return hashlib.blake2b(token_ids.reshape(-1).numpy().tobytes(), digest_size=16).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("candidates", "created")
+
+    def __init__(self, created: float):
+        self.candidates: List["torch.Tensor"] = []
+        self.created = created
+
+
+class ReplyCache:
+    """Bounded cache of sampled model replies for repeated turns.
+
+    Each key (a normalized message and the digest of the history before
+    it) collects up to ``candidates`` distinct generated replies. A
+    lookup only hits once the entry is full, then returns one of them at
+    random, so a popular opening line still gets varied answers. Entries
+    expire ``ttl`` seconds after they were created, and the least recently
+    used go first when there are more than ``max_entries``.
+
+    The cache stores reply token ids, not text, so the caller still
+    decodes and decorates the reply and records it in the session history.
+    """
+
+    def __init__(self, max_entries: int = 1024, candidates: int = 4, ttl: Optional[float] = 3600.0,
+                 max_input_chars: int = 200):
+        """Initialize the cache.
+
+        Args:
+            max_entries: Most keys kept (least recently used are evicted)
+            candidates: Replies collected per key before lookups start to hit
+            ttl: Seconds an entry lives after it is created (None to never expire)
+            max_input_chars: Longer messages are never cached; they rarely repeat
+        """
+        self.max_entries = max(1, max_entries)
+        self.candidates = max(1, candidates)
+        self.ttl = ttl
+        self.max_input_chars = max_input_chars
+
+        self._entries: "OrderedDict[ReplyKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, user_input: str, history_ids: Optional["torch.Tensor"]) -> Optional[ReplyKey]:
+        """Build the cache key for a turn, or None if the turn is not cacheable.
+
+        Args:
+            user_input: The user's message
+            history_ids: The session's (trimmed) history before this message
+        """
+        if len(user_input) > self.max_input_chars:
+            return None
+        normalized = normalize_message(user_input)
+        if not normalized:
+            return None
+        return normalized, history_digest(history_ids)
+
+    def get(self, key: ReplyKey) -> Optional["torch.Tensor"]:
+        """Return one of the cached replies for a key, once it has a full set.
+
+        Returns:
+            Reply token ids (1-D), or None on a miss
+        """
+        with self._lock:
+            entry = self._live_entry(key, time.monotonic())
+            if entry is None or len(entry.candidates) < self.candidates:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry.candidates)
+
+    def add(self, key: ReplyKey, reply_ids: "torch.Tensor") -> None:
+        """Add a freshly generated reply to a key's candidates.
+
+        Args:
+            key: The turn's cache key
+            reply_ids: The generated reply token ids (1-D), without the prompt
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._live_entry(key, now)
+            if entry is None:
+                entry = self._entries[key] = _Entry(now)
+            self._entries.move_to_end(key)
+            if len(entry.candidates) >= self.candidates:
+                return
+            if any(candidate.equal(reply_ids) for candidate in entry.candidates):
+                return
+            entry.candidates.append(reply_ids.clone())
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the cache size, hit rate and eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _live_entry(self, key: ReplyKey, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and now - entry.created > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        return entry
@@ -1,14 +1,25 @@
-from flask import Flask, request, jsonify, render_template, session
+from flask import Flask, Response, request, jsonify, render_template, session, stream_with_context
+import hmac
 import uuid
+import json
 from datetime import datetime
 import os
-from app.chatbot import get_bot_response, default_chatbot
-from app.logger import log_conversation
+import threading
+import time
+from typing import Optional
+from app import metrics
+from app.chatbot import get_bot_response, stream_bot_response, default_chatbot
+from app.env import env_flag
+from app.logger import default_log_writer, enqueue_conversation, get_history_index
 
 # Initialize app
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev_secret_key')
 
+# Streamed turns run their own generate call outside the micro-batcher, so the
+# web UI only uses /api/chat/stream when asked to
+UI_STREAM_REPLIES = env_flag('CHATBOT_UI_STREAM', False)
+
 @app.route('/')
 def home():
     """Render the home page."""
@@ -16,11 +27,12 @@ def home():
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
     
-    return render_template('index.html')
+    return render_template('index.html', stream_replies=UI_STREAM_REPLIES)
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """API endpoint to get a response from the chatbot."""
+    started = time.perf_counter()
     data = request.json
     user_message = data.get('message', '')
     
@@ -32,15 +44,53 @@ def chat():
     # Get response from chatbot
     bot_response = get_bot_response(user_message, session_id)
     
-    # Log the conversation
+    # Log the conversation (written by the background log writer)
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_conversation(session_id, timestamp, user_message, bot_response)
+    enqueue_conversation(session_id, timestamp, user_message, bot_response,
+                         response_path=default_chatbot.last_response_path())
     
+    metrics.request_seconds.labels('chat').observe(time.perf_counter() - started)
     return jsonify({
         'response': bot_response,
         'session_id': session_id
     })
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """API endpoint that streams the chatbot's reply as Server-Sent Events.
+    
+    Emits ``token`` events with text chunks as the model produces them and a
+    final ``done`` event carrying the complete reply; rule-based replies are
+    sent as a single ``done`` event.
+    """
+    data = request.json
+    user_message = data.get('message', '')
+    
+    # Get or create session ID
+    session_id = session.get('session_id', str(uuid.uuid4()))
+    if 'session_id' not in session:
+        session['session_id'] = session_id
+    
+    def generate():
+        started = time.perf_counter()
+        for event, text in stream_bot_response(user_message, session_id):
+            if event == 'done':
+                # Log the full reply once the stream has finished
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                enqueue_conversation(session_id, timestamp, user_message, text,
+                                     response_path=default_chatbot.last_response_path())
+                payload = {'response': text, 'session_id': session_id}
+                metrics.request_seconds.labels('chat_stream').observe(time.perf_counter() - started)
+            else:
+                payload = {'text': text}
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/reset', methods=['POST'])
 def reset_chat():
     """API endpoint to reset the chat session."""
@@ -57,6 +107,145 @@ def reset_chat():
         'session_id': session['session_id']
     })
 
+# Largest page /api/history returns
+HISTORY_MAX_LIMIT = 200
+
+def _history_authorized() -> bool:
+    """Whether the request carries the token for cross-session history queries."""
+    token = os.environ.get('CHATBOT_HISTORY_TOKEN')
+    if not token:
+        return False
+    supplied = request.headers.get('Authorization', '')
+    return hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+@app.route('/api/history')
+def history():
+    """API endpoint that pages through logged conversation turns.
+    
+    By default returns the caller's own session, oldest turn first. With
+    ``scope=range`` it returns turns from every session between ``start``
+    and ``end``, and with ``scope=stats`` it counts turns by response path
+    in that range (``by_day=1`` adds a per-day breakdown); both require
+    ``Authorization: Bearer $CHATBOT_HISTORY_TOKEN``. Pages hold up to
+    ``limit`` turns; pass ``next_cursor`` back as ``cursor`` for the next one.
+    """
+    index = get_history_index()
+    if index is None:
+        return jsonify({'error': 'History index is disabled'}), 404
+    
+    scope = request.args.get('scope', 'session')
+    cursor = request.args.get('cursor') or None
+    start = request.args.get('start', '')
+    end = request.args.get('end', '9999')
+    try:
+        limit = min(max(1, int(request.args.get('limit', '50'))), HISTORY_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    if scope not in ('session', 'range', 'stats'):
+        return jsonify({'error': f'Unknown scope: {scope}'}), 400
+    if scope != 'session' and not _history_authorized():
+        return jsonify({'error': 'Not authorized for cross-session history'}), 403
+    
+    try:
+        if scope == 'stats':
+            by_day = request.args.get('by_day', '0').lower() in ('1', 'true', 'yes')
+            return jsonify(index.path_counts(start, end, by_day=by_day))
+        if scope == 'range':
+            turns, next_cursor = index.range_turns(start, end, limit=limit, cursor=cursor)
+            return jsonify({'turns': turns, 'next_cursor': next_cursor})
+        
+        session_id = session.get('session_id')
+        if not session_id:
+            return jsonify({'session_id': None, 'turns': [], 'next_cursor': None})
+        turns, next_cursor = index.session_turns(session_id, limit=limit, cursor=cursor)
+        return jsonify({'session_id': session_id, 'turns': turns, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/ready')
+def ready():
+    """Readiness endpoint reporting whether the model has finished loading.
+    
+    Returns 503 while the model is still loading (rule-based replies are
+    served meanwhile) and 200 once it is ready, or once loading has failed
+    and the bot is running on rule-based replies only.
+    """
+    state = default_chatbot.load_state
+    status_code = 200 if state in ('ready', 'failed') else 503
+    return jsonify({
+        'status': state,
+        'model_loaded': default_chatbot.model_loaded
+    }), status_code
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint (404 when CHATBOT_METRICS is off)."""
+    if not metrics.enabled:
+        return Response('Metrics are disabled\n', status=404, mimetype='text/plain')
+    
+    # Session store and log writer keep their own counters; copy them in at scrape time
+    session_stats = default_chatbot.sessions.stats()
+    metrics.sessions.set(session_stats['entries'])
+    metrics.session_bytes.set(session_stats['resident_bytes'])
+    for event in ('hits', 'misses', 'evictions', 'expirations', 'cache_drops', 'loads', 'saves', 'reloads', 'errors'):
+        metrics.session_events.labels(event).set_total(session_stats.get(event, 0))
+    if default_chatbot.admission is not None:
+        admission_stats = default_chatbot.admission.stats()
+        metrics.admission_in_flight.set(admission_stats['in_flight'])
+        metrics.admission_queue_depth.set(admission_stats['queued'])
+        for outcome in ('admitted', 'rejected_queue_full', 'rejected_timeout'):
+            metrics.admission_events.labels(outcome).set_total(admission_stats[outcome])
+    if default_chatbot.reply_cache is not None:
+        cache_stats = default_chatbot.reply_cache.stats()
+        metrics.reply_cache_entries.set(cache_stats['entries'])
+        for event in ('hits', 'misses', 'stores', 'evictions', 'expirations'):
+            metrics.reply_cache_events.labels(event).set_total(cache_stats[event])
+    log_stats = default_log_writer.stats()
+    metrics.log_queue_depth.set(log_stats['queued'])
+    for outcome in ('written', 'dropped', 'spilled'):
+        metrics.log_records.labels(outcome).set_total(log_stats[outcome])
+    
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def serve_worker_metrics(base_port: int, slots: int, host: str = '0.0.0.0') -> Optional[int]:
+    """Serve this process's ``/metrics`` on a port of its own.
+    
+    Each gunicorn worker keeps its own metrics, and a scrape of the shared
+    port reaches whichever worker accepts it. gunicorn.conf.py calls this
+    in every worker so each can be scraped as a separate target. The first
+    free port from ``base_port`` to ``base_port + slots - 1`` is used, so a
+    restarted worker takes over the port its predecessor released.
+    
+    Args:
+        base_port: First port of the range
+        slots: Ports in the range (the number of workers)
+        host: Interface to listen on
+        
+    Returns:
+        The port bound, or None if every port in the range is taken
+    """
+    from wsgiref.simple_server import WSGIRequestHandler, make_server
+    
+    def metrics_only(environ, start_response):
+        if environ.get('PATH_INFO') != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not found\n']
+        return app(environ, start_response)
+    
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+    
+    for port in range(base_port, base_port + slots):
+        try:
+            server = make_server(host, port, metrics_only, handler_class=QuietHandler)
+        except OSError:
+            continue
+        threading.Thread(target=server.serve_forever, name='worker-metrics', daemon=True).start()
+        return port
+    return None
+
 @app.route('/about')
 def about():
     """Render the about page."""
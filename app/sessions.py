@@ -0,0 +1,309 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
+# Model key/value cache as returned by ``generate``: one (key, value) pair per layer
+PastKeyValues = Tuple[Tuple["torch.Tensor", ...], ...]
+
+
+class SessionState:
+    """Conversation state for one session: token history plus the model's KV cache.
+
+    ``past_key_values`` always covers a prefix of ``token_ids``, so a new turn
+    only has to prefill the tokens after that prefix instead of re-encoding
+    the whole conversation.
+    """
+
+    def __init__(self, token_ids: "torch.Tensor", past_key_values: Optional[PastKeyValues] = None):
+        """Initialize the session state.
+
+        Args:
+            token_ids: Full chat history token ids, shape ``(1, seq_len)``
+            past_key_values: Cached attention keys/values for a prefix of ``token_ids``
+        """
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+
+    def __len__(self) -> int:
+        return self.token_ids.shape[-1]
+
+    @property
+    def cached_length(self) -> int:
+        """Number of history tokens already covered by the KV cache."""
+        if not self.past_key_values:
+            return 0
+        return self.past_key_values[0][0].shape[-2]
+
+    def update(self, token_ids: "torch.Tensor", past_key_values: Optional[PastKeyValues] = None) -> None:
+        """Record the history after a model turn, keeping the cache it produced.
+
+        Args:
+            token_ids: The new full history (prompt plus generated reply)
+            past_key_values: The cache returned alongside ``token_ids``, if any
+        """
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+
+    def truncate(self, keep_tokens: int) -> None:
+        """Keep only the most recent ``keep_tokens`` tokens of history.
+
+        Cached keys/values encode absolute positions, so the cache is dropped
+        and will be rebuilt by the next turn's prefill.
+
+        Args:
+            keep_tokens: How many trailing tokens to keep
+        """
+        if keep_tokens >= len(self):
+            return
+        self.token_ids = self.token_ids[:, len(self) - keep_tokens:]
+        self.drop_cache()
+
+    def drop_cache(self) -> None:
+        """Forget the KV cache; the next turn re-encodes the whole history."""
+        self.past_key_values = None
+
+    def prompt_with(self, new_input_ids: "torch.Tensor") -> "torch.Tensor":
+        """Return the history followed by a new user turn."""
+        import torch
+        return torch.cat([self.token_ids, new_input_ids], dim=-1)
+
+    def nbytes(self) -> int:
+        """Approximate resident memory of the history and KV cache tensors."""
+        total = self.token_ids.element_size() * self.token_ids.nelement()
+        for layer in self.past_key_values or ():
+            for tensor in layer:
+                total += tensor.element_size() * tensor.nelement()
+        return total
+
+
+class HistoryWindow:
+    """Sliding window over a session's history, trimmed at EOS turn boundaries.
+
+    Keeps at most ``max_turns`` previous exchanges (a user message and the
+    bot's reply) and at most ``max_tokens`` tokens for history plus the
+    incoming message, dropping the oldest utterances first.
+
+    Every trim drops the session's KV cache, so once a limit is crossed the
+    history is cut back to ``low_water`` of the limits rather than just under
+    them. The cache then survives the next few turns instead of being rebuilt
+    on every turn of a long conversation.
+    """
+
+    def __init__(self, eos_token_id: int, max_turns: Optional[int] = 8, max_tokens: Optional[int] = 512,
+                 low_water: float = 0.75):
+        """Initialize the history window.
+
+        Args:
+            eos_token_id: Token that ends each utterance in the history
+            max_turns: Most previous exchanges to keep (None for no limit)
+            max_tokens: Token budget for history plus the new message (None for no limit)
+            low_water: Fraction of the limits to trim back to once one is crossed
+                (1.0 trims only as far as needed)
+        """
+        if not 0.0 < low_water <= 1.0:
+            raise ValueError(f"low_water must be in (0, 1], got {low_water}")
+        self.eos_token_id = eos_token_id
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.low_water = low_water
+
+    def fit_input(self, new_input_ids: "torch.Tensor") -> "torch.Tensor":
+        """Clip a single oversized message to the most recent ``max_tokens`` tokens."""
+        if self.max_tokens is not None and new_input_ids.shape[-1] > self.max_tokens:
+            return new_input_ids[:, -self.max_tokens:]
+        return new_input_ids
+
+    def utterance_starts(self, token_ids: "torch.Tensor") -> List[int]:
+        """Return the offset where each utterance in the history begins."""
+        eos_positions = (token_ids[0] == self.eos_token_id).nonzero().flatten().tolist()
+        return [0] + [position + 1 for position in eos_positions if position + 1 < token_ids.shape[-1]]
+
+    def trim(self, state: SessionState, incoming_tokens: int = 0) -> bool:
+        """Trim a session's history in place so the next prompt fits the window.
+
+        Args:
+            state: The session to trim (its KV cache is dropped if anything is cut)
+            incoming_tokens: Length of the message about to be appended
+
+        Returns:
+            True if the history was trimmed
+        """
+        history_length = len(state)
+        if history_length == 0:
+            return False
+        starts = self.utterance_starts(state.token_ids)
+
+        # Each exchange is two utterances: the user's message and the bot's reply
+        cut = 0
+        if self.max_turns is not None and len(starts) > 2 * self.max_turns:
+            keep_turns = math.ceil(self.max_turns * self.low_water)
+            cut = starts[len(starts) - 2 * keep_turns] if keep_turns > 0 else history_length
+
+        if self.max_tokens is not None and history_length - cut > self.max_tokens - incoming_tokens:
+            budget = max(0, int(self.max_tokens * self.low_water) - incoming_tokens)
+            if history_length - cut > budget:
+                # Drop whole utterances from the front until the rest fits
+                cut = next((start for start in starts if start >= cut and history_length - start <= budget),
+                           history_length)
+
+        if cut == 0:
+            return False
+        state.truncate(history_length - cut)
+        return True
+
+
+class SessionStore:
+    """In-memory session store with LRU and idle-TTL eviction.
+
+    Entries are kept in least-recently-used order. Sessions idle for longer
+    than ``idle_ttl`` seconds are expired, and when the store exceeds
+    ``max_entries`` or ``max_bytes`` the least recently used sessions go
+    first. Over the byte cap, KV caches are dropped before whole sessions are
+    evicted, since a cache is many times larger than the token history it can
+    be rebuilt from.
+
+    Any object with the same ``get``/``put``/``pop``/``stats`` interface can be
+    passed to ``MentalHealthChatbot`` in its place.
+    """
+
+    def __init__(self, max_entries: Optional[int] = 1000, max_bytes: Optional[int] = 512 * 1024 * 1024,
+                 idle_ttl: Optional[float] = 3600.0):
+        """Initialize the session store.
+
+        Args:
+            max_entries: Most sessions kept in memory (None for no limit)
+            max_bytes: Cap on resident bytes across all sessions (None for no limit)
+            idle_ttl: Seconds a session may go unused before it is expired (None to never expire)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+
+        self._entries: "OrderedDict[str, Tuple[SessionState, float, int]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.cache_drops = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            return session_id in self._entries
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        """Look up a session and mark it as recently used.
+
+        Args:
+            session_id: The session to look up
+
+        Returns:
+            The session state, or None if it is unknown or has been evicted
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            state, _, size = entry
+            self._entries[session_id] = (state, now, size)
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return state
+
+    def put(self, session_id: str, state: SessionState) -> None:
+        """Store (or re-account) a session after it has changed.
+
+        Args:
+            session_id: The session to store
+            state: Its current state
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._remove(session_id)
+            size = state.nbytes()
+            self._entries[session_id] = (state, now, size)
+            self.resident_bytes += size
+            self._expire(now)
+            self._enforce_limits()
+
+    def pop(self, session_id: str) -> Optional[SessionState]:
+        """Remove a session and return its state, if present."""
+        with self._lock:
+            return self._remove(session_id)
+
+    def clear(self) -> None:
+        """Remove every session."""
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters describing the store's size and eviction activity."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self.resident_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "cache_drops": self.cache_drops
+            }
+
+    def _remove(self, session_id: str) -> Optional[SessionState]:
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return None
+        self.resident_bytes -= entry[2]
+        return entry[0]
+
+    def _expire(self, now: float) -> None:
+        """Drop sessions idle for longer than the TTL (oldest are at the front)."""
+        if self.idle_ttl is None:
+            return
+        while self._entries:
+            session_id, (_, last_used, _) = next(iter(self._entries.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            self._remove(session_id)
+            self.expirations += 1
+
+    def _enforce_limits(self) -> None:
+        if self.max_bytes is not None and self.resident_bytes > self.max_bytes:
+            # Dropping caches first keeps conversations alive at a fraction of the memory
+            for session_id, (state, last_used, size) in list(self._entries.items()):
+                if self.resident_bytes <= self.max_bytes:
+                    break
+                if state.past_key_values is None:
+                    continue
+                state.drop_cache()
+                new_size = state.nbytes()
+                self._entries[session_id] = (state, last_used, new_size)
+                self.resident_bytes -= size - new_size
+                self.cache_drops += 1
+
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.resident_bytes > self.max_bytes)
+        ):
+            session_id = next(iter(self._entries))
+            self._remove(session_id)
+            self.evictions += 1
+            logger.info(f"Evicted chat session: {session_id}")
@@ -0,0 +1,153 @@
+# Side-by-side latency, memory and output report for the inference backends.
+#
+# Each backend runs in its own process (so memory numbers don't mix) with the
+# chatbot's own generation settings: it loads the model through
+# MentalHealthChatbot, generates a reply to a fixed set of prompts with the
+# same seed before every prompt, and reports load time, resident memory,
+# per-reply latency and how many generated tokens agree with the eager backend.
+# int8 rounds weights, so its tokens can diverge from eager; eager and jit
+# should agree exactly.
+#
+# Usage:
+#     python benchmarks/backends.py [--model microsoft/DialoGPT-small] [--backends eager,int8,jit]
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROMPTS = [
+    "Hi, how are you doing today?",
+    "I have a big exam next week and I can't focus.",
+    "My sister is visiting this weekend.",
+    "I didn't sleep well last night.",
+    "What do you like to do when it rains?",
+    "Work has been busy but I'm managing.",
+    "I started going for walks in the morning.",
+    "Can you recommend something to read?"
+]
+
+def current_rss() -> int:
+    """Resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS, but close enough once the model is loaded
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_backend(model: str, backend: str, repeats: int, seed: int, max_new_tokens: int) -> Dict[str, Any]:
+    """Load one backend in this process and time it on the prompt set."""
+    import torch
+    from app.chatbot import MentalHealthChatbot
+
+    baseline_rss = current_rss()
+    started = time.perf_counter()
+    bot = MentalHealthChatbot(model_name=model, load_mode="eager", backend=backend,
+                              max_new_tokens=max_new_tokens)
+    load_seconds = time.perf_counter() - started
+    if not bot.model_loaded:
+        raise RuntimeError(f"Model failed to load: {model}")
+
+    prompts = [bot.tokenizer.encode(text + bot.tokenizer.eos_token, return_tensors="pt") for text in PROMPTS]
+    outputs: List[List[int]] = []
+    latencies: List[float] = []
+    generated_tokens = 0
+    with torch.no_grad():
+        # Warm-up: the first calls pay for allocator growth and graph optimization
+        for input_ids in prompts[:2]:
+            bot._generate(input_ids)
+        for repeat in range(repeats):
+            for input_ids in prompts:
+                torch.manual_seed(seed)
+                started = time.perf_counter()
+                sequences = bot._generate(input_ids)[0]
+                latencies.append(time.perf_counter() - started)
+                new_tokens = sequences[0, input_ids.shape[-1]:].tolist()
+                generated_tokens += len(new_tokens)
+                if repeat == 0:
+                    outputs.append(new_tokens)
+
+    return {
+        "backend": bot.backend,
+        "requested_backend": backend,
+        "load_seconds": load_seconds,
+        "rss_bytes": current_rss(),
+        "model_rss_bytes": current_rss() - baseline_rss,
+        "replies": len(latencies),
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p50_ms": 1000 * percentile(latencies, 0.5),
+        "p95_ms": 1000 * percentile(latencies, 0.95),
+        "tokens_per_second": generated_tokens / sum(latencies),
+        "outputs": outputs
+    }
+
+def agreement(outputs: List[List[int]], reference: List[List[int]]) -> Dict[str, float]:
+    """Share of replies, and of token positions, identical to the reference."""
+    identical = sum(1 for ours, theirs in zip(outputs, reference) if ours == theirs)
+    positions = matching = 0
+    for ours, theirs in zip(outputs, reference):
+        positions += max(len(ours), len(theirs))
+        matching += sum(1 for a, b in zip(ours, theirs) if a == b)
+    return {
+        "identical_replies": identical / max(1, len(reference)),
+        "matching_tokens": matching / max(1, positions)
+    }
+
+def measure(model: str, backend: str, repeats: int, seed: int, max_new_tokens: int, threads: int) -> Dict[str, Any]:
+    """Run one backend in a fresh interpreter and return its results."""
+    env = dict(os.environ, CHATBOT_LOAD_MODE="lazy", OMP_NUM_THREADS=str(threads))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    # Run from a scratch directory so the logs the app creates on import stay out of the repo
+    with tempfile.TemporaryDirectory() as workdir:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--model", model, "--single", backend,
+             "--repeats", str(repeats), "--seed", str(seed), "--max-new-tokens", str(max_new_tokens)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(completed.stdout)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare inference backends side by side.")
+    parser.add_argument("--model", default=os.environ.get("CHATBOT_MODEL", "microsoft/DialoGPT-small"))
+    parser.add_argument("--backends", default="eager,int8,jit", help="Comma-separated backends to compare")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the prompt set")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="torch threads per backend")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_backend(args.model, args.single, args.repeats, args.seed, args.max_new_tokens)))
+        return
+
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    results = [measure(args.model, backend, args.repeats, args.seed, args.max_new_tokens, args.threads)
+               for backend in backends]
+    reference = next((r["outputs"] for r in results if r["requested_backend"] == "eager"), results[0]["outputs"])
+
+    print(f"{'backend':>8} {'load s':>7} {'model MiB':>10} {'RSS MiB':>8} {'mean ms':>8} {'p95 ms':>8} "
+          f"{'tok/s':>7} {'same replies':>13} {'same tokens':>12}", file=sys.stderr)
+    for result in results:
+        result["agreement_with_eager"] = agreement(result.pop("outputs"), reference)
+        print(f"{result['backend']:>8} {result['load_seconds']:7.2f} {result['model_rss_bytes'] / 2**20:10.1f} "
+              f"{result['rss_bytes'] / 2**20:8.1f} {result['mean_ms']:8.1f} {result['p95_ms']:8.1f} "
+              f"{result['tokens_per_second']:7.1f} "
+              f"{result['agreement_with_eager']['identical_replies']:13.0%} "
+              f"{result['agreement_with_eager']['matching_tokens']:12.0%}", file=sys.stderr)
+    print(json.dumps({"model": args.model, "seed": args.seed, "max_new_tokens": args.max_new_tokens,
+                      "threads": args.threads, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
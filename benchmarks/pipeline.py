@@ -0,0 +1,368 @@
+# Benchmark and load-test suite for the chat pipeline.
+#
+# Runs offline against a tiny, randomly initialized GPT-2 with a word-level
+# tokenizer built in memory, so it measures the pipeline around the model
+# (safety checks, history handling, logging, Flask) rather than the model.
+# Benchmarks:
+#
+#   matcher           detect_mental_health_topic / is_offensive / classify throughput
+#   get_response      reply latency on the rule-based path and on the model path
+#   history_growth    latency of turn N of one conversation as its history grows
+#   log_conversation  cost of logging a turn against the session's length so far
+#   api_chat          /api/chat requests per second under concurrency (Flask test client)
+#
+# With --seed the random branches (empathetic replies, emotional expressions,
+# sampling) follow the same sequence on every run; api_chat with concurrency
+# above 1 still interleaves threads nondeterministically. Results are written
+# as JSON (stdout or --output); --compare prints the change against an
+# earlier results file.
+#
+# Usage:
+#     python benchmarks/pipeline.py [--seed 0] [--only matcher,api_chat] [--output results.json]
+#     python benchmarks/pipeline.py --seed 0 --compare baseline.json
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = ["matcher", "get_response", "history_growth", "log_conversation", "api_chat"]
+
+NEUTRAL_MESSAGES = [
+    "I went for a walk in the park today",
+    "What do you think about learning to cook",
+    "My friend told me a funny story at lunch",
+    "I am thinking about reading more books this year",
+    "The weather was nice so I sat outside for a while",
+    "Can you tell me something interesting",
+    "I started a new project at work this week",
+    "How do you usually spend your weekend"
+]
+TOPIC_MESSAGES = [
+    "I feel anxious about my exams",
+    "I have been so sad and hopeless lately",
+    "Work pressure is giving me burnout",
+    "I feel lonely and isolated at home",
+    "My grandmother passed away last month"
+]
+CRISIS_MESSAGES = [
+    "Sometimes I want to die",
+    "I feel like there is no reason to live"
+]
+OFFENSIVE_MESSAGES = [
+    "this is shit",
+    "you are an asshole"
+]
+
+def tiny_model(seed: int = 0) -> Any:
+    """Build a small randomly initialized GPT-2 and a word-level tokenizer, offline.
+
+    The weights depend only on ``seed``, so every run benchmarks the same model.
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    words = sorted({word.lower() for message in NEUTRAL_MESSAGES + TOPIC_MESSAGES + CRISIS_MESSAGES
+                    for word in message.split()})
+    vocab = {word: i for i, word in enumerate(["<|endoftext|>", "[UNK]"] + words)}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    backend.decoder = decoders.WordPiece()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="<|endoftext|>", unk_token="[UNK]")
+
+    torch.manual_seed(seed)
+    config = GPT2Config(vocab_size=len(vocab), n_positions=1024, n_embd=64, n_layer=2, n_head=2,
+                        bos_token_id=0, eos_token_id=0)
+    return tokenizer, GPT2LMHeadModel(config).eval()
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """Latency statistics in milliseconds."""
+    ordered = sorted(seconds)
+    def pick(fraction: float) -> float:
+        return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean_ms": 1000 * sum(ordered) / len(ordered),
+        "p50_ms": pick(0.5),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": 1000 * ordered[-1]
+    }
+
+def reseed(seed: Optional[int]) -> None:
+    """Reset the random and torch generators when running seeded."""
+    if seed is None:
+        return
+    import torch
+    random.seed(seed)
+    torch.manual_seed(seed)
+
+def message_corpus(size: int) -> List[str]:
+    """A fixed mix of everyday, topic, crisis and offensive messages (same on every run)."""
+    rng = random.Random(1234)
+    pools = [NEUTRAL_MESSAGES] * 6 + [TOPIC_MESSAGES] * 3 + [CRISIS_MESSAGES, OFFENSIVE_MESSAGES]
+    return [rng.choice(rng.choice(pools)) for _ in range(size)]
+
+def make_bot(args: argparse.Namespace, **kwargs: Any) -> Any:
+    from app.chatbot import MentalHealthChatbot
+
+    bot = MentalHealthChatbot(load_mode="lazy", max_new_tokens=args.max_new_tokens, **kwargs)
+    bot.attach_model(*tiny_model())
+    return bot
+
+def bench_matcher(args: argparse.Namespace) -> Dict[str, Any]:
+    from app.chatbot import MentalHealthChatbot
+
+    bot = MentalHealthChatbot(load_mode="lazy")
+    corpus = message_corpus(args.messages)
+    cases: Dict[str, Callable[[], Any]] = {
+        "detect_mental_health_topic": lambda: [bot.detect_mental_health_topic(m) for m in corpus],
+        "is_offensive": lambda: [bot.is_offensive(m) for m in corpus],
+        "classify": lambda: [bot.classify(m) for m in corpus],
+        "classify_many": lambda: bot.matcher.classify_many(corpus)
+    }
+    results = {}
+    for name, run in cases.items():
+        # Best of several passes: the least disturbed measurement of a CPU-bound loop
+        best = min(timed(run) for _ in range(args.repeats))
+        results[name] = {"messages_per_second": len(corpus) / best, "us_per_message": 1e6 * best / len(corpus)}
+    return results
+
+def timed(run: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+def bench_get_response(args: argparse.Namespace) -> Dict[str, Any]:
+    bot = make_bot(args)
+    # Crisis and offensive messages always take the rule-based path; everyday
+    # messages match no topic, so with the model loaded they always reach it
+    paths = {
+        "rule_based": CRISIS_MESSAGES + OFFENSIVE_MESSAGES,
+        "model": NEUTRAL_MESSAGES
+    }
+    results = {}
+    for path, messages in paths.items():
+        reseed(args.seed)
+        latencies = []
+        for i in range(args.requests):
+            message = messages[i % len(messages)]
+            # A fresh session each time so history length doesn't skew the path comparison
+            latencies.append(timed(lambda: bot.get_response(message, f"{path}-{i}")))
+        results[path] = summarize(latencies)
+    return results
+
+def bench_history_growth(args: argparse.Namespace) -> Dict[str, Any]:
+    bot = make_bot(args)
+    reseed(args.seed)
+    by_turn: List[List[float]] = [[] for _ in range(args.turns)]
+    history_tokens: List[List[int]] = [[] for _ in range(args.turns)]
+    for conversation in range(args.repeats):
+        session_id = f"growth-{conversation}"
+        for turn in range(args.turns):
+            message = NEUTRAL_MESSAGES[turn % len(NEUTRAL_MESSAGES)]
+            by_turn[turn].append(timed(lambda: bot.get_response(message, session_id)))
+            state = bot.sessions.get(session_id)
+            history_tokens[turn].append(len(state) if state is not None else 0)
+    return {
+        "max_history_tokens": bot.max_history_tokens,
+        "max_history_turns": bot.max_history_turns,
+        "turns": [
+            {"turn": turn + 1,
+             "history_tokens": sorted(history_tokens[turn])[len(history_tokens[turn]) // 2],
+             **summarize(by_turn[turn])}
+            for turn in range(args.turns)
+        ]
+    }
+
+def bench_log_conversation(args: argparse.Namespace) -> Dict[str, Any]:
+    from app.logger import enqueue_conversation, default_log_writer, log_conversation
+
+    results: Dict[str, Any] = {"log_conversation": [], "enqueue_conversation": []}
+    # Every logged turn is also printed to the console; keep that out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        for length in args.log_lengths:
+            session_id = f"log-{length}"
+            for i in range(length):
+                log_conversation(session_id, "2024-01-01 00:00:00", NEUTRAL_MESSAGES[i % 8], "A reply of ordinary length.")
+            latencies = [timed(lambda: log_conversation(session_id, "2024-01-01 00:00:00",
+                                                        "How do you usually spend your weekend",
+                                                        "A reply of ordinary length."))
+                         for _ in range(args.requests)]
+            results["log_conversation"].append({"existing_turns": length, **summarize(latencies)})
+
+            latencies = [timed(lambda: enqueue_conversation(session_id, "2024-01-01 00:00:00",
+                                                            "How do you usually spend your weekend",
+                                                            "A reply of ordinary length."))
+                         for _ in range(args.requests)]
+            results["enqueue_conversation"].append({"existing_turns": length, **summarize(latencies)})
+            default_log_writer.flush()
+    return results
+
+def bench_api_chat(args: argparse.Namespace) -> Dict[str, Any]:
+    import app.chatbot
+    from app.logger import default_log_writer
+    from app.routes import app as flask_app
+
+    # The routes use the module-level bot; give it the tiny model instead of loading one
+    bot = app.chatbot.default_chatbot
+    bot.generation_kwargs["max_new_tokens"] = args.max_new_tokens
+    if not bot.model_loaded:
+        bot.attach_model(*tiny_model())
+    corpus = message_corpus(args.requests)
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for concurrency in args.concurrency:
+            reseed(args.seed)
+            per_worker = [corpus[i::concurrency] for i in range(concurrency)]
+
+            def client_loop(messages: List[str]) -> List[Any]:
+                # One client per worker, so each keeps its own session cookie like a browser
+                client = flask_app.test_client()
+                samples = []
+                for message in messages:
+                    started = time.perf_counter()
+                    response = client.post("/api/chat", json={"message": message})
+                    samples.append((time.perf_counter() - started, response.status_code))
+                return samples
+
+            started = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+                samples = [s for batch in pool.map(client_loop, per_worker) for s in batch]
+            elapsed = time.perf_counter() - started
+            default_log_writer.flush()
+            results[f"concurrency_{concurrency}"] = {
+                "concurrency": concurrency,
+                "requests_per_second": len(samples) / elapsed,
+                "errors": sum(1 for _, status in samples if status != 200),
+                **summarize([latency for latency, _ in samples])
+            }
+    return results
+
+# Result fields that describe the run rather than measure it
+SETTINGS = {"count", "turn", "existing_turns", "concurrency", "max_history_tokens", "max_history_turns"}
+
+def flatten(results: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a results tree, keyed by their dotted path."""
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        items = ((str(item.get("turn", item.get("existing_turns", i))) if isinstance(item, dict) else str(i), item)
+                 for i, item in enumerate(results))
+    else:
+        return {prefix: results} if isinstance(results, (int, float)) and not isinstance(results, bool) else {}
+    flat = {}
+    for key, value in items:
+        flat.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+    return flat
+
+def compare(current: Dict[str, Any], baseline_file: str) -> None:
+    """Print each metric next to the baseline run's value."""
+    with open(baseline_file) as f:
+        baseline = flatten(json.load(f)["results"])
+    for key, value in flatten(current).items():
+        if key not in baseline or key.rsplit(".", 1)[-1] in SETTINGS:
+            continue
+        old = baseline[key]
+        change = f"{(value - old) / old:+8.1%}" if old else "     n/a"
+        print(f"{key:<70} {old:12.3f} -> {value:12.3f} {change}", file=sys.stderr)
+
+def metadata(args: argparse.Namespace) -> Dict[str, Any]:
+    import torch
+    import transformers
+
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "seed": args.seed,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    }
+
+def parse_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the chat pipeline with a tiny offline model.")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="Comma-separated benchmarks to run")
+    parser.add_argument("--seed", type=int, default=None, help="Seed the random branches and sampling")
+    parser.add_argument("--messages", type=int, default=5000, help="Messages per matcher pass")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per measured case")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes (matcher) or conversations (history_growth)")
+    parser.add_argument("--turns", type=int, default=24, help="Turns per conversation for history_growth")
+    parser.add_argument("--log-lengths", type=parse_list, default=[0, 10, 100, 1000],
+                        help="Existing session lengths for log_conversation")
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 4, 16], help="Client threads for api_chat")
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads")
+    parser.add_argument("--output", help="Write results here instead of stdout")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    # The app writes logs relative to the working directory; keep them out of the repo
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name)
+    logging.basicConfig(filename="sessions.log", level=logging.INFO,
+                        format="%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    os.environ["CHATBOT_LOAD_MODE"] = "lazy"
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    sys.path.insert(0, REPO_ROOT)
+
+    import torch
+    import transformers
+    torch.set_num_threads(args.threads)
+    # generate warns about padding on every call when the prompt ends in EOS (the pad token)
+    transformers.logging.set_verbosity_error()
+
+    runners = {
+        "matcher": bench_matcher,
+        "get_response": bench_get_response,
+        "history_growth": bench_history_growth,
+        "log_conversation": bench_log_conversation,
+        "api_chat": bench_api_chat
+    }
+    results = {}
+    for name in selected:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = runners[name](args)
+
+    report = {"meta": metadata(args), "results": results}
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if baseline:
+        compare(results, baseline)
+    workdir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Measure memory per gunicorn worker with and without pre-fork model sharing.
+#
+# Starts gunicorn with gunicorn.conf.py, waits for the workers to load, sends a
+# few chat requests, and reads RSS/PSS/USS for the master and every worker from
+# /proc/<pid>/smaps_rollup (Linux only). PSS splits shared pages between the
+# processes sharing them, so the sum of PSS is the real memory footprint.
+#
+# Usage:
+#     python benchmarks/worker_memory.py [--workers 4] [--mode both|preload|no-preload]
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def process_memory(pid: int) -> Dict[str, int]:
+    """Return RSS, PSS and USS in bytes for a process."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    }
+
+def child_pids(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_serving(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/ready", timeout=5)
+            return
+        except OSError:
+            # Refused while starting, or timed out while a worker is still loading
+            time.sleep(0.5)
+    raise TimeoutError("gunicorn did not become ready in time")
+
+def send_chats(port: int, count: int) -> None:
+    for i in range(count):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{port}/api/chat",
+            data=json.dumps({"message": f"Tell me about your day {i}"}).encode(),
+            headers={"Content-Type": "application/json"}
+        )
+        urllib.request.urlopen(request, timeout=120).read()
+
+def measure(workers: int, preload: bool, requests: int, settle: float, timeout: float) -> Dict[str, object]:
+    port = free_port()
+    env = dict(os.environ,
+               GUNICORN_WORKERS=str(workers),
+               GUNICORN_PRELOAD="1" if preload else "0",
+               GUNICORN_BIND=f"127.0.0.1:{port}")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    # Run from a scratch directory so the conversation logs it writes stay out of the repo
+    workdir = tempfile.TemporaryDirectory()
+    master = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_ROOT, "gunicorn.conf.py")],
+                              cwd=workdir.name, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_serving(port, timeout)
+        # Without preload each worker loads its own model; wait for all of them
+        deadline = time.monotonic() + timeout
+        while len(child_pids(master.pid)) < workers and time.monotonic() < deadline:
+            time.sleep(0.5)
+        time.sleep(settle)
+        send_chats(port, requests)
+
+        worker_memory = {pid: process_memory(pid) for pid in child_pids(master.pid)}
+        master_memory = process_memory(master.pid)
+        total_pss = master_memory["pss"] + sum(m["pss"] for m in worker_memory.values())
+        return {
+            "preload": preload,
+            "workers": workers,
+            "master": master_memory,
+            "workers_memory": list(worker_memory.values()),
+            "total_pss": total_pss,
+            "pss_per_worker": total_pss / max(1, len(worker_memory)),
+            "mean_worker_uss": sum(m["uss"] for m in worker_memory.values()) / max(1, len(worker_memory))
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=60)
+        workdir.cleanup()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure memory per gunicorn worker.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--mode", choices=["both", "preload", "no-preload"], default="both")
+    parser.add_argument("--requests", type=int, default=8, help="Chat requests sent before measuring")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to wait after workers start")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    modes = {"both": [True, False], "preload": [True], "no-preload": [False]}[args.mode]
+    results = [measure(args.workers, preload, args.requests, args.settle, args.timeout) for preload in modes]
+    for result in results:
+        label = "preload" if result["preload"] else "no-preload"
+        print(f"{label:>10}: total PSS {result['total_pss'] / 2**20:8.1f} MiB, "
+              f"PSS/worker {result['pss_per_worker'] / 2**20:7.1f} MiB, "
+              f"USS/worker {result['mean_worker_uss'] / 2**20:7.1f} MiB", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
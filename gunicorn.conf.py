@@ -0,0 +1,59 @@
+# gunicorn configuration for multi-worker deployments.
+#
+# The app (and with it the DialoGPT weights) is loaded once in the master
+# before forking, so every worker shares the same weight pages copy-on-write
+# instead of holding its own copy. Start with:
+#
+#     gunicorn -c gunicorn.conf.py
+import gc
+import multiprocessing
+import os
+
+from app.env import env_flag, env_int
+
+# The model must be fully loaded before fork; a background loader thread would not survive it
+os.environ.setdefault("CHATBOT_LOAD_MODE", "eager")
+
+wsgi_app = "app.routes:app"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = env_int("GUNICORN_WORKERS", 2)
+worker_class = "gthread"
+threads = env_int("GUNICORN_THREADS", 4)
+preload_app = env_flag("GUNICORN_PRELOAD", True)
+timeout = env_int("GUNICORN_TIMEOUT", 120)
+
+def torch_threads_per_worker() -> int:
+    """Split the machine's cores between workers so they don't oversubscribe them."""
+    configured = env_int("CHATBOT_TORCH_THREADS", 0)
+    if configured > 0:
+        return configured
+    return max(1, multiprocessing.cpu_count() // max(1, workers))
+
+def pre_fork(server, worker):
+    # Move everything allocated so far (the loaded app and model objects) into the
+    # permanent generation, so the cyclic GC never writes to those pages after fork
+    gc.freeze()
+
+def post_fork(server, worker):
+    # Metrics are per worker; give each its own scrape port when asked to
+    metrics_port = env_int("CHATBOT_METRICS_WORKER_PORT", 0)
+    if metrics_port:
+        from app.routes import serve_worker_metrics
+        port = serve_worker_metrics(metrics_port, workers)
+        if port is None:
+            server.log.warning(f"Worker {worker.pid} found no free metrics port from {metrics_port}")
+        else:
+            server.log.info(f"Worker {worker.pid} serving /metrics on port {port}")
+
+    try:
+        import torch
+    except ImportError:
+        return
+    num_threads = torch_threads_per_worker()
+    torch.set_num_threads(num_threads)
+    server.log.info(f"Worker {worker.pid} using {num_threads} torch threads")
+
+def worker_exit(server, worker):
+    # Drain queued conversation logs before the worker goes away
+    from app.logger import default_log_writer
+    default_log_writer.close()
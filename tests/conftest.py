@@ -0,0 +1,62 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+# Set before any test imports app.logger or app.chatbot: keep the default bot from loading (or downloading)
+# the model, and keep the history index out of the working tree
+os.environ.setdefault("CHATBOT_LOAD_MODE", "lazy")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("CHATBOT_HISTORY_INDEX_PATH", os.path.join(tempfile.mkdtemp(prefix="chatbot-tests-"), "index.db"))
+
+
+@pytest.fixture
+def tiny_model():
+    """The benchmarks' small randomly initialized GPT-2 and word-level tokenizer, built offline."""
+    from benchmarks.pipeline import tiny_model
+
+    return tiny_model()
+
+
+@pytest.fixture
+def pretrained(monkeypatch, tiny_model):
+    """Have from_pretrained return the tiny model instead of fetching DialoGPT."""
+    import transformers
+
+    tokenizer, model = tiny_model
+    monkeypatch.setattr(transformers.AutoTokenizer, "from_pretrained", lambda *args, **kwargs: tokenizer)
+    monkeypatch.setattr(transformers.AutoModelForCausalLM, "from_pretrained", lambda *args, **kwargs: model)
+    return tiny_model
+
+
+class HeldLoader:
+    """Stands in for from_pretrained, holding the load until released and then serving the tiny model."""
+
+    def __init__(self, tiny_model):
+        self.tiny_model = tiny_model
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.error = None
+
+    def tokenizer(self, *args, **kwargs):
+        self.entered.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.tiny_model[0]
+
+    def model(self, *args, **kwargs):
+        return self.tiny_model[1]
+
+
+@pytest.fixture
+def held_loader(monkeypatch, tiny_model):
+    import transformers
+
+    loader = HeldLoader(tiny_model)
+    monkeypatch.setattr(transformers.AutoTokenizer, "from_pretrained", loader.tokenizer)
+    monkeypatch.setattr(transformers.AutoModelForCausalLM, "from_pretrained", loader.model)
+    yield loader
+    # Never leave a loader thread parked on the event
+    loader.release.set()
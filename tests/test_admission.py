@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from app.admission import AdmissionController
+
+
+def test_weighted_turns_share_the_slots():
+    admission = AdmissionController(max_in_flight=4, max_queue=0)
+    assert admission.acquire(weight=4)
+    assert not admission.acquire()
+    admission.release(4)
+    assert admission.acquire()
+    assert not admission.acquire(weight=4)
+    assert admission.acquire(weight=3)
+    assert admission.stats()["in_flight"] == 4
+
+
+def test_weight_is_capped_at_capacity():
+    admission = AdmissionController(max_in_flight=2, max_queue=0)
+    assert admission.acquire(weight=8)
+    assert admission.stats()["in_flight"] == 2
+    admission.release(8)
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_heavy_waiter_is_admitted_once_enough_slots_free():
+    admission = AdmissionController(max_in_flight=4, max_queue=1, queue_timeout=5.0)
+    for _ in range(4):
+        assert admission.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(admission.acquire(weight=4)))
+    waiter.start()
+    time.sleep(0.05)
+    for _ in range(3):
+        admission.release()
+    time.sleep(0.05)
+    assert not admitted
+    admission.release()
+    waiter.join(5)
+    assert admitted == [True]
+
+
+def test_sheds_when_the_queue_is_full():
+    admission = AdmissionController(max_in_flight=1, max_queue=0)
+    assert admission.acquire()
+    assert not admission.acquire()
+    assert admission.stats() == {"in_flight": 1, "queued": 0, "admitted": 1,
+                                 "rejected_queue_full": 1, "rejected_timeout": 0}
+
+
+def test_queued_caller_times_out():
+    admission = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.05)
+    assert admission.acquire()
+    started = time.monotonic()
+    assert not admission.acquire()
+    assert 0.04 <= time.monotonic() - started < 1.0
+    stats = admission.stats()
+    assert stats["rejected_timeout"] == 1
+    assert stats["queued"] == 0
+
+
+def test_caller_deadline_shortens_the_queue_timeout():
+    admission = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=10.0)
+    assert admission.acquire()
+    started = time.monotonic()
+    assert not admission.acquire(timeout=0.05)
+    assert time.monotonic() - started < 1.0
+
+
+def test_queued_callers_are_admitted_as_slots_free_up():
+    admission = AdmissionController(max_in_flight=1, max_queue=2, queue_timeout=5.0)
+    assert admission.acquire()
+    admitted = []
+    proceed = [threading.Event(), threading.Event()]
+
+    def wait_for_slot(number):
+        assert admission.acquire()
+        admitted.append(number)
+        # Hold the slot until the test lets this caller finish
+        assert proceed[number].wait(5)
+        admission.release()
+
+    waiters = []
+    for number in range(2):
+        waiters.append(threading.Thread(target=wait_for_slot, args=(number,)))
+        waiters[-1].start()
+        deadline = time.monotonic() + 5
+        while admission.stats()["queued"] < number + 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    # The queue is full, so a third caller is shed straight away
+    assert not admission.acquire()
+
+    # Each freed slot admits exactly one waiter
+    admission.release()
+    deadline = time.monotonic() + 5
+    while not admitted and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert len(admitted) == 1
+    stats = admission.stats()
+    assert stats["in_flight"] == 1
+    assert stats["queued"] == 1
+
+    proceed[admitted[0]].set()
+    deadline = time.monotonic() + 5
+    while len(admitted) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(admitted) == [0, 1]
+    assert admission.stats()["in_flight"] == 1
+
+    proceed[admitted[1]].set()
+    for waiter in waiters:
+        waiter.join(5)
+    stats = admission.stats()
+    assert stats["in_flight"] == 0
+    assert stats["admitted"] == 3
+    assert stats["rejected_queue_full"] == 1
+
+
+def test_releasing_more_than_is_held_raises():
+    admission = AdmissionController(max_in_flight=2, max_queue=0)
+    assert admission.acquire()
+    with pytest.raises(ValueError):
+        admission.release(2)
+    admission.release()
+    with pytest.raises(ValueError):
+        admission.release()
+    assert admission.stats()["in_flight"] == 0
@@ -0,0 +1,40 @@
+import copy
+
+import pytest
+import torch
+
+from app.backends import BACKENDS, prepare_model
+
+
+def generate(model, input_ids, attention_mask=None):
+    torch.manual_seed(0)
+    with torch.no_grad():
+        return model.generate(input_ids, attention_mask=attention_mask, max_new_tokens=8, min_new_tokens=8,
+                              do_sample=False, pad_token_id=0)
+
+
+@pytest.mark.parametrize("backend", list(BACKENDS))
+def test_each_backend_generates(tiny_model, backend):
+    _, model = tiny_model
+    model = prepare_model(model, backend)
+    input_ids = torch.tensor([[3, 4, 5, 0]])
+    output = generate(model, input_ids)
+    assert output.shape == (1, 12)
+    assert torch.equal(output[:, :4], input_ids)
+
+
+def test_jit_matches_eager_tokens(tiny_model):
+    _, model = tiny_model
+    eager = prepare_model(copy.deepcopy(model), "eager")
+    jit = prepare_model(model, "jit")
+    input_ids = torch.tensor([[3, 4, 5, 0]])
+    assert torch.equal(generate(jit, input_ids), generate(eager, input_ids))
+    # Left-padded batches, as the micro-batcher builds them
+    input_ids = torch.tensor([[0, 0, 6, 0], [3, 4, 5, 0]])
+    attention_mask = torch.tensor([[0, 0, 1, 1], [1, 1, 1, 1]])
+    assert torch.equal(generate(jit, input_ids, attention_mask), generate(eager, input_ids, attention_mask))
+
+
+def test_unknown_backend(tiny_model):
+    with pytest.raises(ValueError, match="Unknown inference backend"):
+        prepare_model(tiny_model[1], "tensorrt")
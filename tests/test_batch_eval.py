@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from app import batch_eval
+from app.chatbot import MentalHealthChatbot
+from app.sessions import SessionStore
+from benchmarks.pipeline import NEUTRAL_MESSAGES, tiny_model
+
+
+@pytest.fixture
+def bot():
+    bot = MentalHealthChatbot(load_mode="lazy", max_new_tokens=4, batch_max_size=4, batch_max_wait_ms=1,
+                              session_store=SessionStore(max_entries=None, idle_ttl=None))
+    bot.attach_model(*tiny_model())
+    yield bot
+    bot.batcher.close()
+
+
+@pytest.fixture
+def turns_file(tmp_path):
+    path = tmp_path / "turns.jsonl"
+    with open(path, "w") as f:
+        for session in range(5):
+            for turn in range(2):
+                f.write(json.dumps({"session_id": f"s{session}", "user_message": NEUTRAL_MESSAGES[turn]}) + "\n")
+    return str(path)
+
+
+def test_iter_conversations_shards_cover_every_session(turns_file):
+    sessions = [conversation.session_id for shard in range(3)
+                for conversation in batch_eval.iter_conversations([turns_file], shard, 3)]
+    assert sorted(sessions) == [f"s{session}" for session in range(5)]
+
+
+def test_resume_after_torn_checkpoint_line_writes_each_conversation_once(bot, turns_file, tmp_path):
+    output = str(tmp_path / "eval.jsonl")
+    batch_eval.evaluate_shard(bot, [turns_file], output, batch_size=2)
+
+    # Interrupted while writing the last checkpoint entry
+    checkpoint = f"{output}.checkpoint"
+    with open(checkpoint, "rb") as f:
+        lines = f.readlines()
+    with open(checkpoint, "wb") as f:
+        f.writelines(lines[:-1])
+        f.write(lines[-1][:10])
+
+    for _ in range(2):
+        summary = batch_eval.evaluate_shard(bot, [turns_file], output, batch_size=2, resume=True)
+    assert summary["skipped"] == 5
+    assert summary["conversations"] == 0
+
+    with open(checkpoint) as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == len({entry["key"] for entry in entries}) == 5
+    with open(output) as f:
+        records = [json.loads(line) for line in f]
+    assert sorted((record["session_id"], record["turn"]) for record in records) == \
+        [(f"s{session}", turn) for session in range(5) for turn in range(2)]
+
+
+def test_shard_worker_refuses_to_run_without_a_model(turns_file, tmp_path):
+    options = {"shard": 0, "shards": 1, "seed": 0, "torch_threads": None, "model": str(tmp_path / "no-such-model"),
+               "batch_size": 2, "max_new_tokens": 4, "backend": "eager", "budget_ms": None,
+               "paths": [turns_file], "output": str(tmp_path / "eval.jsonl"), "resume": False}
+    with pytest.raises(RuntimeError, match="Model failed to load"):
+        batch_eval._run_shard(options)
+    assert not os.path.exists(str(tmp_path / "eval.jsonl.part0of1"))
+
+
+def test_unmigrated_session_logs_replay_as_one_conversation(tmp_path):
+    with open(tmp_path / "session_abc.json", "w") as f:
+        json.dump({"session_id": "abc", "conversations": [{"user_message": "first"}, {"user_message": "second"}]}, f)
+    with open(tmp_path / "session_abc.jsonl", "w") as f:
+        f.write(json.dumps({"session_id": "abc", "user_message": "third"}) + "\n")
+    with open(tmp_path / "session_abd.jsonl", "w") as f:
+        f.write(json.dumps({"session_id": "abd", "user_message": "other"}) + "\n")
+
+    conversations = list(batch_eval.iter_conversations([str(tmp_path)]))
+    assert [(c.session_id, [t["user_message"] for t in c.turns]) for c in conversations] == \
+        [("abc", ["first", "second", "third"]), ("abd", ["other"])]
+    assert conversations[0].key == f"{tmp_path / 'session_abc.json'}:1"
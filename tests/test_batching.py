@@ -0,0 +1,84 @@
+import pytest
+import torch
+
+from app.batching import GenerationBatcher
+
+EOS = 0
+
+
+class ScriptedModel:
+    """Stands in for the model: row ``i`` of a batch replies with ``i + 1`` tokens and EOS."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, input_ids, attention_mask=None, pad_token_id=None, **kwargs):
+        self.calls.append((input_ids.clone(), attention_mask.clone()))
+        rows = input_ids.shape[0]
+        replies = torch.full((rows, rows + 1), pad_token_id, dtype=input_ids.dtype)
+        for row in range(rows):
+            replies[row, :row + 1] = 10 + row
+        return torch.cat([input_ids, replies], dim=-1)
+
+
+def prompt(*token_ids):
+    return torch.tensor([token_ids])
+
+
+def test_concurrent_prompts_run_as_one_left_padded_batch():
+    model = ScriptedModel()
+    batcher = GenerationBatcher(model, pad_token_id=EOS, max_batch_size=3, max_wait_ms=1000)
+    prompts = [prompt(1), prompt(2, 3, 4), prompt(5, 6)]
+    try:
+        futures = [batcher.submit(p) for p in prompts]
+        outputs = [future.result(timeout=5) for future in futures]
+    finally:
+        batcher.close()
+
+    assert len(model.calls) == 1
+    input_ids, attention_mask = model.calls[0]
+    assert input_ids.tolist() == [[EOS, EOS, 1], [2, 3, 4], [EOS, 5, 6]]
+    assert attention_mask.tolist() == [[0, 0, 1], [1, 1, 1], [0, 1, 1]]
+    # Each caller gets its own prompt back, unpadded, followed by its reply up to the first EOS
+    assert [deadline_hit for _, deadline_hit in outputs] == [False, False, False]
+    assert [output.tolist() for output, _ in outputs] == [
+        [[1, 10, EOS]],
+        [[2, 3, 4, 11, 11, EOS]],
+        [[5, 6, 12, 12, 12, EOS]],
+    ]
+    assert (batcher.batches_run, batcher.requests_served) == (1, 3)
+
+
+def test_batches_are_capped_at_max_batch_size():
+    model = ScriptedModel()
+    batcher = GenerationBatcher(model, pad_token_id=EOS, max_batch_size=2, max_wait_ms=50)
+    try:
+        futures = [batcher.submit(prompt(i)) for i in range(1, 4)]
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        batcher.close()
+    assert [call[0].shape[0] for call in model.calls] == [2, 1]
+
+
+def test_generate_failure_reaches_every_caller_in_the_batch():
+    class BrokenModel:
+        def generate(self, *args, **kwargs):
+            raise RuntimeError("out of memory")
+
+    batcher = GenerationBatcher(BrokenModel(), pad_token_id=EOS, max_batch_size=2, max_wait_ms=1000)
+    try:
+        futures = [batcher.submit(prompt(1)), batcher.submit(prompt(2))]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="out of memory"):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+
+
+def test_submit_after_close_is_refused():
+    batcher = GenerationBatcher(ScriptedModel(), pad_token_id=EOS)
+    batcher.generate(prompt(1), timeout=5)
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(prompt(1))
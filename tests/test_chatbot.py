@@ -0,0 +1,194 @@
+import pytest
+
+from app.admission import AdmissionController
+from app.chatbot import MentalHealthChatbot
+from app.reply_cache import ReplyCache
+from benchmarks.pipeline import NEUTRAL_MESSAGES
+
+
+@pytest.fixture(params=[1, 2], ids=["single", "batched"])
+def bot(request, tiny_model):
+    bot = MentalHealthChatbot(load_mode="lazy", max_new_tokens=8, max_history_turns=2,
+                              batch_max_size=request.param, batch_max_wait_ms=1)
+    bot.attach_model(*tiny_model)
+    yield bot
+    if bot.batcher is not None:
+        bot.batcher.close()
+
+
+def test_replies_cut_off_by_max_new_tokens_keep_turn_boundaries(bot):
+    eos = bot.tokenizer.eos_token_id
+    for message in NEUTRAL_MESSAGES[:4]:
+        bot.get_response(message, "s")
+        token_ids = bot.sessions.get("s").token_ids
+        # Every utterance (user message or reply) ends in EOS, including a reply that hit max_new_tokens
+        assert token_ids[0, -1].item() == eos
+        assert (token_ids[0] == eos).sum().item() == len(bot.history.utterance_starts(token_ids))
+    # The window kept two earlier exchanges, plus the latest one
+    assert len(bot.history.utterance_starts(bot.sessions.get("s").token_ids)) <= 6
+
+
+def test_get_responses_closes_every_reply(bot):
+    eos = bot.tokenizer.eos_token_id
+    turns = [(message, f"s{i}") for i, message in enumerate(NEUTRAL_MESSAGES[:3])]
+    bot.get_responses(turns)
+    for _, session_id in turns:
+        assert bot.sessions.get(session_id).token_ids[0, -1].item() == eos
+
+
+def test_streamed_turns_take_a_whole_batch_of_admission_slots(tiny_model):
+    admission = AdmissionController(max_in_flight=8, max_queue=0)
+    bot = MentalHealthChatbot(load_mode="lazy", max_new_tokens=4, batch_max_size=4, admission=admission)
+    bot.attach_model(*tiny_model)
+    try:
+        assert bot._admission_weight() == 1
+        assert bot._admission_weight(streamed=True) == 4
+        # With two streamed turns' worth of slots held, another streamed turn is shed
+        assert admission.acquire(weight=8)
+        list(bot.get_response_stream(NEUTRAL_MESSAGES[0], "s"))
+        assert bot.last_response_path() == "shed"
+        admission.release(8)
+        events = list(bot.get_response_stream(NEUTRAL_MESSAGES[0], "s"))
+        assert events[-1][0] == "done"
+        assert admission.stats()["in_flight"] == 0
+    finally:
+        bot.batcher.close()
+
+
+@pytest.mark.parametrize("streamed", [False, True], ids=["get_response", "get_response_stream"])
+def test_model_turn_classifies_once_and_fills_the_reply_cache(streamed, tiny_model):
+    bot = MentalHealthChatbot(load_mode="lazy", max_new_tokens=4,
+                              reply_cache=ReplyCache(candidates=1), admission=AdmissionController(max_in_flight=1))
+    bot.attach_model(*tiny_model)
+    calls = []
+    classify = bot.matcher.classify
+    bot.matcher.classify = lambda text: calls.append(text) or classify(text)
+
+    def reply(session_id):
+        if streamed:
+            return list(bot.get_response_stream(NEUTRAL_MESSAGES[0], session_id))[-1][1]
+        return bot.get_response(NEUTRAL_MESSAGES[0], session_id)
+
+    reply("first")
+    assert len(calls) == 1
+    assert bot.reply_cache.stats()["stores"] == 1
+    reply("second")
+    assert bot.reply_cache.stats()["hits"] == 1
+    assert bot.admission.stats()["admitted"] == 1
+
+
+@pytest.fixture
+def model_bot(pretrained):
+    bot = MentalHealthChatbot()
+    assert bot.model_loaded
+    bot.generation_kwargs = {"max_new_tokens": 6, "do_sample": False}
+    return bot
+
+
+def prefill_lengths(bot):
+    """Record the number of input_ids each forward pass of the model receives."""
+    lengths = []
+    bot.model.register_forward_pre_hook(
+        lambda module, args, kwargs: lengths.append(kwargs["input_ids"].shape[-1]), with_kwargs=True)
+    return lengths
+
+
+def test_second_turn_only_prefills_the_new_message(model_bot):
+    model_bot.get_response(NEUTRAL_MESSAGES[0], "s")
+    state = model_bot.sessions.get("s")
+    # The cache covers everything but the last generated token, which was never fed back in
+    assert state.cached_length == len(state) - 1
+
+    lengths = prefill_lengths(model_bot)
+    new_tokens = len(model_bot.tokenizer.encode(NEUTRAL_MESSAGES[1] + model_bot.tokenizer.eos_token))
+    model_bot.get_response(NEUTRAL_MESSAGES[1], "s")
+    assert lengths[0] == new_tokens + 1
+    assert state.cached_length == len(state) - 1
+
+
+def test_truncating_the_history_drops_the_cache(model_bot):
+    model_bot.get_response(NEUTRAL_MESSAGES[0], "s")
+    model_bot.get_response(NEUTRAL_MESSAGES[1], "s")
+    state = model_bot.sessions.get("s")
+    assert state.cached_length > 0
+    state.truncate(len(state) - 1)
+    assert state.cached_length == 0
+
+    lengths = prefill_lengths(model_bot)
+    new_input_ids = model_bot.tokenizer.encode(NEUTRAL_MESSAGES[2] + model_bot.tokenizer.eos_token,
+                                               return_tensors="pt")
+    prompt_length = state.prompt_with(new_input_ids).shape[-1]
+    model_bot.get_response(NEUTRAL_MESSAGES[2], "s")
+    # With no cache the whole kept history is re-encoded
+    assert lengths[0] == prompt_length
+    assert state.cached_length == len(state) - 1
+
+
+def is_supportive(bot, reply):
+    """Whether ``reply`` came from the rule-based fallback used while no model is loaded."""
+    return any(reply.startswith(response) for response in bot.supportive_responses)
+
+
+def test_lazy_load_starts_on_the_first_request_and_answers_without_the_model_meanwhile(held_loader):
+    bot = MentalHealthChatbot(load_mode="lazy", max_new_tokens=4)
+    assert bot.load_state == "not_loaded"
+    assert is_supportive(bot, bot.get_response(NEUTRAL_MESSAGES[0], "s"))
+    assert held_loader.entered.wait(5)
+    assert bot.load_state == "loading"
+    assert is_supportive(bot, bot.get_response(NEUTRAL_MESSAGES[1], "s"))
+    assert bot.sessions.get("s") is None
+
+    held_loader.release.set()
+    assert bot.wait_until_loaded(5)
+    assert bot.load_state == "ready"
+    bot.get_response(NEUTRAL_MESSAGES[2], "s")
+    assert bot.sessions.get("s") is not None
+
+
+def test_background_load_starts_at_construction(held_loader):
+    bot = MentalHealthChatbot(load_mode="background")
+    assert held_loader.entered.wait(5)
+    assert bot.load_state == "loading" and not bot.model_loaded
+    held_loader.release.set()
+    assert bot.wait_until_loaded(5)
+    assert bot.load_state == "ready"
+
+
+def test_failed_load_falls_back_to_rule_based_replies(held_loader):
+    held_loader.error = OSError("no network")
+    held_loader.release.set()
+    bot = MentalHealthChatbot(load_mode="background")
+    assert not bot.wait_until_loaded(5)
+    assert bot.load_state == "failed"
+    assert is_supportive(bot, bot.get_response(NEUTRAL_MESSAGES[0], "s"))
+
+
+def test_unknown_load_mode():
+    with pytest.raises(ValueError):
+        MentalHealthChatbot(load_mode="sometime")
+
+
+@pytest.fixture
+def rushed_bot(tiny_model):
+    """A bot whose every reply runs out of its latency budget after the first generated token."""
+    bot = MentalHealthChatbot(load_mode="lazy", max_new_tokens=16, generation_budget_ms=1e-6)
+    bot.attach_model(*tiny_model)
+    # Keep EOS out of the reply so the deadline, not the model, ends it
+    bot.generation_kwargs.update(min_new_tokens=16)
+    return bot
+
+
+def test_cut_off_reply_is_trimmed_to_its_last_sentence(rushed_bot, monkeypatch):
+    monkeypatch.setattr(rushed_bot.tokenizer, "decode", lambda *args, **kwargs: "That sounds really hard. It must be")
+    assert rushed_bot.get_response(NEUTRAL_MESSAGES[0], "s") == "That sounds really hard."
+    assert rushed_bot.deadline_hits == 1
+    # The saved history still ends the cut-off reply with EOS
+    assert rushed_bot.sessions.get("s").token_ids[0, -1].item() == rushed_bot.tokenizer.eos_token_id
+
+
+def test_cut_off_reply_with_too_few_words_falls_back(rushed_bot):
+    assert is_supportive(rushed_bot, rushed_bot.get_response(NEUTRAL_MESSAGES[0], "s"))
+    assert rushed_bot.deadline_hits == 1
+    # Without a budget the same bot generates the whole reply
+    rushed_bot.get_response(NEUTRAL_MESSAGES[1], "s", budget_ms=0)
+    assert rushed_bot.deadline_hits == 1
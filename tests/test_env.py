@@ -0,0 +1,31 @@
+import pytest
+
+from app.env import env_flag, env_float, env_int
+
+
+@pytest.mark.parametrize("value, expected", [("0", False), ("False", False), ("no", False), (" OFF ", False),
+                                             ("1", True), ("true", True), ("yes", True)])
+def test_env_flag_values(monkeypatch, value, expected):
+    monkeypatch.setenv("CHATBOT_TEST_FLAG", value)
+    assert env_flag("CHATBOT_TEST_FLAG", not expected) is expected
+
+
+@pytest.mark.parametrize("value", [None, "", "  "])
+def test_unset_or_blank_uses_the_default(monkeypatch, value):
+    if value is None:
+        monkeypatch.delenv("CHATBOT_TEST_SETTING", raising=False)
+    else:
+        monkeypatch.setenv("CHATBOT_TEST_SETTING", value)
+    assert env_flag("CHATBOT_TEST_SETTING", True) is True
+    assert env_int("CHATBOT_TEST_SETTING", 7) == 7
+    assert env_float("CHATBOT_TEST_SETTING", 0.5) == 0.5
+
+
+def test_numbers_are_parsed_and_bad_values_name_the_variable(monkeypatch):
+    monkeypatch.setenv("CHATBOT_TEST_SETTING", "12")
+    assert env_int("CHATBOT_TEST_SETTING", 0) == 12
+    assert env_float("CHATBOT_TEST_SETTING", 0) == 12.0
+    monkeypatch.setenv("CHATBOT_TEST_SETTING", "1.5")
+    assert env_float("CHATBOT_TEST_SETTING", 0) == 1.5
+    with pytest.raises(ValueError, match="CHATBOT_TEST_SETTING"):
+        env_int("CHATBOT_TEST_SETTING", 0)
@@ -0,0 +1,96 @@
+import base64
+import json
+import os
+
+import pytest
+
+from app.history import HistoryIndex, decode_cursor, encode_cursor
+
+
+def raw_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+@pytest.fixture
+def index(tmp_path):
+    log = tmp_path / "session_abc.jsonl"
+    lines = [
+        json.dumps({"session_id": "abc", "timestamp": f"2024-01-01 00:00:0{i}",
+                    "user_message": f"hi {i}", "bot_response": f"hello {i}", "response_path": "model"}) + "\n"
+        for i in range(3)
+    ]
+    log.write_text("".join(lines))
+    index = HistoryIndex(str(tmp_path / "index.db"))
+    index.rebuild(str(tmp_path))
+    yield index
+    index.close()
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("2024-01-01 00:00:00", 7), str, int) == ["2024-01-01 00:00:00", 7]
+
+
+@pytest.mark.parametrize("values", [[], [None], ["7"], [7.5], [True], [1, 2], {"id": 1}])
+def test_session_cursor_rejects_wrong_shape(index, values):
+    with pytest.raises(ValueError):
+        index.session_turns("abc", cursor=raw_cursor(values))
+
+
+@pytest.mark.parametrize("values", [[], [None], [None, None], ["2024-01-01", None], [1, 2],
+                                    ["2024-01-01", "2"], ["2024-01-01"], ["2024-01-01", 1, 2]])
+def test_range_cursor_rejects_wrong_shape(index, values):
+    with pytest.raises(ValueError):
+        index.range_turns("", "9999", cursor=raw_cursor(values))
+
+
+def test_cursor_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor!", int)
+
+
+def test_pages_follow_cursors(index):
+    first, cursor = index.session_turns("abc", limit=2)
+    rest, end = index.session_turns("abc", limit=2, cursor=cursor)
+    assert [t["user_message"] for t in first + rest] == ["hi 0", "hi 1", "hi 2"]
+    assert end is None
+
+    first, cursor = index.range_turns("", "9999", limit=1)
+    rest, end = index.range_turns("", "9999", limit=5, cursor=cursor)
+    assert [t["user_message"] for t in first + rest] == ["hi 0", "hi 1", "hi 2"]
+    assert end is None
+
+
+@pytest.mark.parametrize("cursor", ["W10=", raw_cursor([None]), raw_cursor(["1"])])
+def test_history_route_rejects_bad_cursor(index, monkeypatch, cursor):
+    from app import routes
+    monkeypatch.setattr(routes, "get_history_index", lambda: index)
+    client = routes.app.test_client()
+    with client.session_transaction() as session:
+        session["session_id"] = "abc"
+    response = client.get("/api/history", query_string={"cursor": cursor})
+    assert response.status_code == 400
+    assert "Invalid cursor" in response.get_json()["error"]
+
+
+def test_indexed_files_resolve_from_any_working_directory(tmp_path, monkeypatch):
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    line = json.dumps({"session_id": "abc", "timestamp": "2024-01-01 00:00:00", "user_message": "hi"}) + "\n"
+    (log_dir / "session_abc.jsonl").write_text(line)
+
+    # The writer names the file relative to its own working directory
+    monkeypatch.chdir(tmp_path)
+    index = HistoryIndex(os.path.join("logs", "index.db"))
+    index.add([("abc", "2024-01-01 00:00:00", None, os.path.join("logs", "session_abc.jsonl"), 0, len(line))])
+
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)
+    turns, _ = index.session_turns("abc")
+    assert [t["user_message"] for t in turns] == ["hi"]
+
+    # Reindexing replaces the same rows rather than adding ones under another spelling of the path
+    assert index.reindex_file(str(log_dir / "session_abc.jsonl")) == 1
+    turns, _ = index.session_turns("abc")
+    assert [t["user_message"] for t in turns] == ["hi"]
+    index.close()
@@ -0,0 +1,201 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app import logger
+from app.logger import AsyncLogWriter, get_session_history, read_session_log
+
+
+def turn(i):
+    return {"timestamp": f"2024-01-01 00:00:{i:02d}", "user_message": f"hi {i}", "bot_response": "hello"}
+
+
+def test_reader_skips_a_torn_final_line(tmp_path):
+    path = tmp_path / "session_s.jsonl"
+    # A crash mid-append leaves the last line cut off, with no newline
+    path.write_text("".join(json.dumps(turn(i)) + "\n" for i in range(2)) + json.dumps(turn(2))[:20])
+    assert [t["user_message"] for t in read_session_log(str(path))] == ["hi 0", "hi 1"]
+
+
+def test_history_reads_the_legacy_json_before_the_jsonl_log(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    (tmp_path / "logs" / "session_s.json").write_text(
+        json.dumps({"session_id": "s", "conversations": [turn(0), turn(1)]}))
+    (tmp_path / "logs" / "session_s.jsonl").write_text("".join(json.dumps(turn(i)) + "\n" for i in (2, 3)))
+    history = get_session_history("s")
+    assert [t["user_message"] for t in history["conversations"]] == ["hi 0", "hi 1", "hi 2", "hi 3"]
+
+
+class StalledWrites:
+    """Stands in for ``_write_records``, holding the worker in its first write until released."""
+
+    def __init__(self):
+        self.records = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, records, fsync=False):
+        self.entered.set()
+        assert self.release.wait(5)
+        self.records.extend(records)
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    writes = StalledWrites()
+    monkeypatch.setattr(logger, "_write_records", writes)
+    return writes
+
+
+def record(i):
+    return {"session_id": "s", "timestamp": f"2024-01-01 00:00:{i:02d}", "user_message": f"hi {i}",
+            "bot_response": "hello"}
+
+
+def messages(records):
+    return sorted(r["user_message"] for r in records)
+
+
+def fill_queue(writer, writes):
+    """Park the worker in a write of the first record and fill the one-slot queue with a second."""
+    assert writer.submit(record(0))
+    assert writes.entered.wait(5)
+    assert writer.submit(record(1))
+
+
+def test_flush_waits_for_queued_records(writes, tmp_path):
+    writes.release.set()
+    writer = AsyncLogWriter(batch_size=100, flush_interval=0.02, spill_dir=str(tmp_path))
+    for i in range(5):
+        writer.submit(record(i))
+    assert writer.flush(timeout=5)
+    assert len(writes.records) == 5
+    assert writer.stats()["batches"] == 1
+    writer.close()
+
+
+def test_close_drains_without_waiting_for_the_flush_interval(writes, tmp_path):
+    writes.release.set()
+    writer = AsyncLogWriter(batch_size=100, flush_interval=60, spill_dir=str(tmp_path))
+    for i in range(3):
+        writer.submit(record(i))
+    writer.close(timeout=5)
+    assert len(writes.records) == 3
+    # Once closed, records are written straight away
+    writer.submit(record(3))
+    assert len(writes.records) == 4
+
+
+def test_block_policy_waits_for_room(writes, tmp_path):
+    writer = AsyncLogWriter(max_queue=1, batch_size=1, flush_interval=0.01, overflow="block",
+                            spill_dir=str(tmp_path))
+    fill_queue(writer, writes)
+    blocked = threading.Thread(target=writer.submit, args=(record(2),))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+
+    writes.release.set()
+    blocked.join(5)
+    writer.close(timeout=5)
+    assert messages(writes.records) == ["hi 0", "hi 1", "hi 2"]
+    assert writer.stats()["dropped"] == 0
+
+
+def test_drop_policy_counts_lost_records(writes, tmp_path):
+    writer = AsyncLogWriter(max_queue=1, batch_size=1, flush_interval=0.01, overflow="drop",
+                            spill_dir=str(tmp_path))
+    fill_queue(writer, writes)
+    assert not writer.submit(record(2))
+    assert writer.stats()["dropped"] == 1
+
+    writes.release.set()
+    writer.close(timeout=5)
+    assert messages(writes.records) == ["hi 0", "hi 1"]
+
+
+def test_spill_policy_replays_overflow_once_drained(writes, tmp_path):
+    writer = AsyncLogWriter(max_queue=1, batch_size=1, flush_interval=0.01, overflow="spill",
+                            spill_dir=str(tmp_path))
+    fill_queue(writer, writes)
+    assert writer.submit(record(2))
+    assert writer.submit(record(3))
+    assert writer.stats()["spilled"] == 2
+    with open(writer.spill_path) as f:
+        assert len(f.readlines()) == 2
+
+    writes.release.set()
+    assert writer.flush(timeout=5)
+    writer.close(timeout=5)
+    assert messages(writes.records) == ["hi 0", "hi 1", "hi 2", "hi 3"]
+    assert writer.stats()["dropped"] == 0
+    assert not os.path.exists(writer.spill_path)
+    assert not os.path.exists(f"{writer.spill_path}.draining")
+
+
+def write_spill(path, *records):
+    with open(path, "w") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+
+
+def test_worker_start_replays_spills_left_by_exited_processes(writes, tmp_path, monkeypatch):
+    monkeypatch.setattr(logger, "_process_alive", lambda pid: pid == 200)
+    write_spill(tmp_path / "spill-100.jsonl", record(0))
+    write_spill(tmp_path / "spill-101.jsonl.draining", record(1))
+    # A running process's spill file is still being written to
+    write_spill(tmp_path / "spill-200.jsonl", record(2))
+
+    writes.release.set()
+    writer = AsyncLogWriter(batch_size=1, flush_interval=0.01, overflow="drop", spill_dir=str(tmp_path))
+    writer.submit(record(3))
+    writer.close(timeout=5)
+    assert messages(writes.records) == ["hi 0", "hi 1", "hi 3"]
+    assert sorted(os.listdir(tmp_path)) == ["spill-200.jsonl"]
+
+
+def test_replay_appends_to_a_leftover_draining_file(writes, tmp_path):
+    writes.release.set()
+    writer = AsyncLogWriter(overflow="spill", spill_dir=str(tmp_path))
+    write_spill(f"{writer.spill_path}.draining", record(0))
+    write_spill(writer.spill_path, record(1))
+    writer._replay_spill()
+    assert messages(writes.records) == ["hi 0", "hi 1"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_close_leaves_the_spill_to_a_worker_that_is_still_writing(writes, tmp_path):
+    writer = AsyncLogWriter(max_queue=1, batch_size=1, flush_interval=0.01, overflow="spill",
+                            spill_dir=str(tmp_path))
+    fill_queue(writer, writes)
+    assert writer.submit(record(2))
+    writer.close(timeout=0.05)
+    assert os.path.exists(writer.spill_path)
+    assert writes.records == []
+
+    writes.release.set()
+    deadline = time.monotonic() + 5
+    while len(writes.records) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert messages(writes.records) == ["hi 0", "hi 1", "hi 2"]
+    writer._queue.put(None)
+    writer._worker.join(5)
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        AsyncLogWriter(overflow="ignore")
+
+
+def test_import_creates_no_log_dir_or_index(tmp_path):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env.pop("CHATBOT_HISTORY_INDEX_PATH", None)
+    subprocess.run([sys.executable, "-c", "import app.logger, app.migrate_logs"], cwd=str(tmp_path), env=env,
+                   check=True)
+    assert not os.path.exists(tmp_path / "logs")
@@ -0,0 +1,100 @@
+import random
+import re
+
+import pytest
+
+from app.chatbot import MentalHealthChatbot
+from app.matcher import SafetyMatcher
+
+
+@pytest.fixture(scope="module")
+def bot():
+    return MentalHealthChatbot(load_mode="lazy")
+
+
+def reference(bot, text):
+    """The checks as they were written before the matcher: one scan per pattern and keyword."""
+    lowered = text.lower()
+    offensive = any(re.search(pattern, lowered) for pattern in bot.offensive_patterns)
+    crisis = any(keyword in lowered for keyword in bot.crisis_keywords)
+    topic = next((topic for topic, keywords in bot.topic_keywords.items()
+                  if any(word in lowered for word in keywords)), None)
+    return offensive, crisis, topic
+
+
+class PrefixedKeywords:
+    """Keyword lists where one category's keyword starts another category's."""
+    offensive_patterns = []
+    crisis_keywords = ["die", "overdose"]
+    topic_keywords = {
+        "first": ["over", "lone"],
+        "second": ["died", "lonely", "overwhelm"],
+        "third": ["die"],
+    }
+
+
+def fuzz_messages(bot, count, seed=0):
+    rng = random.Random(seed)
+    keywords = list(bot.crisis_keywords) + [word for words in bot.topic_keywords.values() for word in words]
+    offensive = ["fuck", "fuuuck", "shiiit", "bitch", "dick", "asshole", "cunt", "faggot", "shitty", "dickens"]
+    fragments = [k[:rng.randint(1, len(k))] for k in keywords] + [k[rng.randint(0, len(k) - 1):] for k in keywords]
+    filler = ["i", "feel", "so", "today", "really", "the", "and", "my", "work", "friend", "", " ", ".", "!",
+              "İ", "ẞ", "\x00", "\n", "NO ONE", "Sad", "PaSsEd AwAy"]
+    pools = [keywords, offensive, fragments, filler, filler]
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(rng.choice(pools)) for _ in range(rng.randint(0, 8))]
+        joiner = rng.choice([" ", "", "-", " "])
+        messages.append(joiner.join(words))
+    return messages
+
+
+def test_classify_matches_the_original_checks(bot):
+    for message in fuzz_messages(bot, 20000):
+        assert tuple(bot.matcher.classify(message)) == reference(bot, message), message
+
+
+def test_classify_many_matches_classify(bot):
+    messages = fuzz_messages(bot, 5000, seed=1)
+    for start in range(0, len(messages), 37):
+        chunk = messages[start:start + 37]
+        assert bot.matcher.classify_many(chunk) == [bot.matcher.classify(message) for message in chunk]
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("I want to die", (False, True, None)),
+    ("I feel so anxious and sad", (False, False, "anxiety")),
+    ("so stressed and lonely", (False, False, "stress")),
+    ("no one gets my grief", (False, False, "loneliness")),
+    ("this is shiiit", (True, False, None)),
+    ("Dickens wrote about loss", (False, False, "grief")),
+    ("", (False, False, None)),
+])
+def test_known_messages(bot, message, expected):
+    assert tuple(bot.matcher.classify(message)) == expected
+    assert bot.is_offensive(message) == expected[0]
+    assert bot.detect_mental_health_topic(message) == expected[2]
+
+
+@pytest.mark.parametrize("message, expected", [
+    # "died" is the longest match, but "die" inside it is a crisis keyword
+    ("he died last year", (False, True, "second")),
+    # "over" outranks the "overwhelm" it starts
+    ("so overwhelmed", (False, False, "first")),
+    ("lonely", (False, False, "first")),
+    ("an overdose", (False, True, "first")),
+    # A keyword listed under two categories counts for both
+    ("i could die", (False, True, "third")),
+])
+def test_keyword_prefixes_of_other_categories_are_reported(message, expected):
+    keywords = PrefixedKeywords()
+    matcher = SafetyMatcher(keywords.offensive_patterns, keywords.crisis_keywords, keywords.topic_keywords)
+    assert tuple(matcher.classify(message)) == expected
+    assert tuple(matcher.classify(message)) == reference(keywords, message)
+
+
+def test_prefixed_keywords_match_the_original_checks():
+    keywords = PrefixedKeywords()
+    matcher = SafetyMatcher(keywords.offensive_patterns, keywords.crisis_keywords, keywords.topic_keywords)
+    for message in fuzz_messages(keywords, 5000, seed=2):
+        assert tuple(matcher.classify(message)) == reference(keywords, message), message
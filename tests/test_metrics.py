@@ -0,0 +1,55 @@
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from app import metrics
+
+
+def test_render_formats_counters_and_histograms():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter("test_events_total", "Events.", ["kind"]))
+    histogram = registry.register(metrics.Histogram("test_seconds", "Latency.", buckets=(0.1, 1.0)))
+    counter.labels('a"b').inc(2)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+
+    text = registry.render()
+    assert 'test_events_total{kind="a\\"b"} 2' in text
+    assert 'test_seconds_bucket{le="0.1"} 0' in text
+    assert 'test_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_seconds_bucket{le="+Inf"} 2' in text
+    assert "test_seconds_count 2" in text
+
+
+def test_render_while_series_are_added():
+    counter = metrics.Counter("test_racing_total", "Series added during rendering.", ["n"])
+    adder = threading.Thread(target=lambda: [counter.labels(str(n)).inc() for n in range(5000)])
+    adder.start()
+    for _ in range(50):
+        counter.render()
+    adder.join()
+    assert len(counter.render()) == 5000 + 2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_worker_metrics_port_serves_only_metrics():
+    from app.routes import serve_worker_metrics
+
+    base = free_port()
+    port = serve_worker_metrics(base, 1, host="127.0.0.1")
+    assert port == base
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert b"chatbot_responses_total" in response.read()
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f"http://127.0.0.1:{port}/api/history")
+    assert error.value.code == 404
+    # The only port in the range is taken now
+    assert serve_worker_metrics(base, 1, host="127.0.0.1") is None
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from app import logger, migrate_logs
+
+
+def write_legacy_log(log_dir, session_id, turns):
+    conversations = [{"timestamp": f"2024-01-01 00:00:0{i}", "user_message": f"hi {i}", "bot_response": f"hello {i}"}
+                     for i in range(turns)]
+    with open(os.path.join(log_dir, f"session_{session_id}.json"), "w") as f:
+        json.dump({"session_id": session_id, "conversations": conversations}, f)
+
+
+def test_migration_indexes_into_the_log_dirs_own_index(tmp_path):
+    write_legacy_log(str(tmp_path), "abc", 3)
+    index = migrate_logs.history_index_for(str(tmp_path))
+    assert index.path == os.path.join(str(tmp_path), "index.db")
+
+    summary = migrate_logs.migrate_logs(str(tmp_path), index=index)
+    assert summary == {"sessions": 1, "turns": 3, "failed": 0}
+    assert index.rebuild(str(tmp_path)) == 3
+    turns, _ = index.session_turns("abc")
+    assert [t["user_message"] for t in turns] == ["hi 0", "hi 1", "hi 2"]
+    assert os.path.exists(os.path.join(str(tmp_path), "session_abc.json.migrated"))
+
+    # The server's index was neither cleared nor filled from this directory
+    server_index = logger.get_history_index()
+    if server_index is not None:
+        assert server_index.session_turns("abc") == ([], None)
+    index.close()
+
+
+def test_existing_jsonl_turns_are_kept_after_migrated_ones(tmp_path):
+    write_legacy_log(str(tmp_path), "abc", 2)
+    with open(os.path.join(str(tmp_path), "session_abc.jsonl"), "w") as f:
+        f.write(json.dumps({"session_id": "abc", "timestamp": "2024-01-02 00:00:00", "user_message": "later"}) + "\n")
+    migrate_logs.migrate_logs(str(tmp_path))
+    records = logger.read_session_log(os.path.join(str(tmp_path), "session_abc.jsonl"))
+    assert [r["user_message"] for r in records] == ["hi 0", "hi 1", "later"]
+
+
+def test_log_appended_during_migration_is_not_overwritten(tmp_path, monkeypatch):
+    write_legacy_log(str(tmp_path), "abc", 2)
+    target = os.path.join(str(tmp_path), "session_abc.jsonl")
+    real_fsync = os.fsync
+
+    def append_then_fsync(fd):
+        # A server appending between the copy and the rename
+        with open(target, "a") as f:
+            f.write(json.dumps({"session_id": "abc", "user_message": "concurrent"}) + "\n")
+        real_fsync(fd)
+
+    monkeypatch.setattr(migrate_logs.os, "fsync", append_then_fsync)
+    with pytest.raises(RuntimeError):
+        migrate_logs.migrate_session_log(os.path.join(str(tmp_path), "session_abc.json"), str(tmp_path))
+    monkeypatch.undo()
+    assert [r["user_message"] for r in logger.read_session_log(target)] == ["concurrent"]
+    assert os.path.exists(os.path.join(str(tmp_path), "session_abc.json"))
+    assert not os.path.exists(f"{target}.tmp")
@@ -0,0 +1,102 @@
+import pytest
+import torch
+
+from app.persistence import (DirectoryKVStore, PersistentSessionStore, SqliteKVStore, decode_token_ids,
+                             encode_token_ids, session_store_from_env)
+from app.sessions import SessionState, SessionStore
+
+
+@pytest.fixture(params=["directory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "directory":
+        store = DirectoryKVStore(str(tmp_path / "sessions"))
+    else:
+        store = SqliteKVStore(str(tmp_path / "sessions.db"))
+    yield store
+    store.close()
+
+
+def test_token_blob_round_trip():
+    small = torch.tensor([[0, 50256, 1234]])
+    large = torch.tensor([[70000, 5]])
+    assert decode_token_ids(encode_token_ids(small)).equal(small)
+    assert decode_token_ids(encode_token_ids(large)).equal(large)
+    assert len(encode_token_ids(small)) < len(encode_token_ids(large))
+
+
+def test_set_returns_the_stored_version(backend):
+    version = backend.set("k", b"x" * 100)
+    assert version == backend.version("k")
+    assert backend.get("k") == (b"x" * 100, version)
+
+    replaced = backend.set("k", b"y" * 100)
+    assert replaced != version
+    assert replaced == backend.version("k")
+
+
+def test_delete_and_missing_keys(backend):
+    assert backend.get("missing") is None
+    assert backend.version("missing") is None
+    backend.set("k", b"x")
+    backend.delete("k")
+    assert backend.get("k") is None
+
+
+def test_own_writes_do_not_trigger_reloads(backend):
+    store = PersistentSessionStore(backend, cache=SessionStore())
+    for turn in range(4):
+        state = store.get("s") or SessionState(torch.zeros((1, 0), dtype=torch.long))
+        state.update(torch.arange(turn + 1).unsqueeze(0), past_key_values=((torch.zeros(1),),))
+        store.put("s", state)
+    assert store.stats()["reloads"] == 0
+    assert store.get("s").past_key_values is not None
+
+
+def test_write_from_another_worker_is_picked_up(backend):
+    ours = PersistentSessionStore(backend, cache=SessionStore())
+    theirs = PersistentSessionStore(backend, cache=SessionStore())
+    ours.put("s", SessionState(torch.tensor([[1, 2]])))
+    theirs.put("s", SessionState(torch.tensor([[1, 2, 3]])))
+
+    state = ours.get("s")
+    assert state.token_ids.tolist() == [[1, 2, 3]]
+    assert ours.stats()["reloads"] == 1
+
+
+def test_restart_restores_history_without_cache(backend):
+    PersistentSessionStore(backend, cache=SessionStore()).put("s", SessionState(torch.tensor([[4, 5]])))
+    restarted = PersistentSessionStore(backend, cache=SessionStore())
+    state = restarted.get("s")
+    assert state.token_ids.tolist() == [[4, 5]]
+    assert state.past_key_values is None
+    assert restarted.stats()["loads"] == 1
+
+
+@pytest.mark.parametrize("kind, backend_type", [("directory", DirectoryKVStore), ("sqlite", SqliteKVStore)])
+def test_store_from_env_wraps_the_cache_in_the_named_backend(kind, backend_type, tmp_path, monkeypatch):
+    monkeypatch.setenv("CHATBOT_SESSION_BACKEND", kind.upper())
+    monkeypatch.setenv("CHATBOT_SESSION_PATH", str(tmp_path / "sessions"))
+    monkeypatch.setenv("CHATBOT_SESSION_MAX_AGE", "60")
+    cache = SessionStore()
+    store = session_store_from_env(cache)
+    try:
+        assert isinstance(store, PersistentSessionStore)
+        assert isinstance(store.backend, backend_type)
+        assert store.cache is cache
+        assert store.max_age == 60
+    finally:
+        store.close()
+
+
+def test_store_from_env_defaults_to_memory(monkeypatch):
+    monkeypatch.delenv("CHATBOT_SESSION_BACKEND", raising=False)
+    cache = SessionStore()
+    assert session_store_from_env(cache) is cache
+    monkeypatch.setenv("CHATBOT_SESSION_BACKEND", "memory")
+    assert session_store_from_env(cache) is cache
+
+
+def test_store_from_env_rejects_unknown_backends(monkeypatch):
+    monkeypatch.setenv("CHATBOT_SESSION_BACKEND", "redis")
+    with pytest.raises(ValueError, match="redis"):
+        session_store_from_env(SessionStore())
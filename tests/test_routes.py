@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+pytest.importorskip("flask")
+
+from app import routes
+from app.chatbot import MentalHealthChatbot
+
+
+@pytest.fixture
+def bot(pretrained):
+    bot = MentalHealthChatbot()
+    bot.generation_kwargs = {"max_new_tokens": 8, "min_new_tokens": 8, "do_sample": False}
+    return bot
+
+
+@pytest.fixture
+def logged(monkeypatch, bot):
+    """Serve the routes from the tiny-model bot and record the turns they log."""
+    logged = []
+    monkeypatch.setattr(routes, "default_chatbot", bot)
+    monkeypatch.setattr(routes, "stream_bot_response", bot.get_response_stream)
+    monkeypatch.setattr(routes, "enqueue_conversation",
+                        lambda session_id, timestamp, user_message, bot_response, **kwargs: logged.append(bot_response))
+    return logged
+
+
+def stream(message, logged):
+    """POST to /api/chat/stream and return each SSE event with the turns logged before it arrived."""
+    client = routes.app.test_client()
+    response = client.post("/api/chat/stream", json={"message": message}, buffered=False)
+    assert response.mimetype == "text/event-stream"
+    events = []
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        event, data = chunk.strip().split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):]), list(logged)))
+    response.close()
+    return events
+
+
+def test_model_reply_streams_tokens_then_one_done_event(logged):
+    events = stream("I went for a walk in the park today", logged)
+    names = [event for event, _, _ in events]
+    assert names[-1] == "done" and names.count("done") == 1
+    assert set(names[:-1]) == {"token"}
+    # No turn is logged while tokens are still streaming
+    assert all(not logged_before for event, _, logged_before in events[:-1])
+    reply = events[-1][1]["response"]
+    assert reply and logged == [reply]
+
+
+def test_rule_based_reply_is_a_single_done_event(logged, bot):
+    events = stream("Sometimes I want to die", logged)
+    assert [(event, payload["response"]) for event, payload, _ in events] == [("done", bot.crisis_response)]
+    assert logged == [bot.crisis_response]
+
+
+def ready_status():
+    response = routes.app.test_client().get("/api/ready")
+    return response.status_code, response.get_json()["status"]
+
+
+@pytest.mark.parametrize("error", [None, OSError("no network")], ids=["loaded", "failed"])
+def test_ready_answers_503_until_loading_finishes(monkeypatch, held_loader, error):
+    held_loader.error = error
+    bot = MentalHealthChatbot(load_mode="background")
+    monkeypatch.setattr(routes, "default_chatbot", bot)
+    assert held_loader.entered.wait(5)
+    assert ready_status() == (503, "loading")
+    held_loader.release.set()
+    bot.wait_until_loaded(5)
+    # A failed load still leaves the bot serving rule-based replies, so it is ready either way
+    assert ready_status() == (200, "ready" if error is None else "failed")
@@ -0,0 +1,166 @@
+import torch
+
+from app import sessions
+from app.sessions import HistoryWindow, SessionState, SessionStore
+
+EOS = 0
+
+
+def history(*utterance_lengths):
+    """Token ids for utterances of the given lengths, each closed with EOS."""
+    ids = []
+    for number, length in enumerate(utterance_lengths, 1):
+        ids.extend([number] * (length - 1) + [EOS])
+    return torch.tensor([ids])
+
+
+def test_utterance_starts():
+    window = HistoryWindow(EOS)
+    assert window.utterance_starts(history(2, 3, 1)) == [0, 2, 5]
+
+
+def test_trim_keeps_the_most_recent_exchanges():
+    window = HistoryWindow(EOS, max_turns=2, max_tokens=None, low_water=1.0)
+    full = history(2, 2, 3, 3, 4, 4)
+    state = SessionState(full, past_key_values=((torch.zeros(1),),))
+    assert window.trim(state)
+    # The first exchange (two utterances of two tokens) is dropped
+    assert state.token_ids.tolist() == full[:, 4:].tolist()
+    assert state.past_key_values is None
+
+
+def test_trim_within_limits_keeps_history_and_cache():
+    window = HistoryWindow(EOS, max_turns=2, max_tokens=100)
+    cache = ((torch.zeros(1),),)
+    state = SessionState(history(2, 2, 3, 3), past_key_values=cache)
+    assert not window.trim(state, incoming_tokens=10)
+    assert len(state) == 10
+    assert state.past_key_values is cache
+
+
+def test_trim_drops_whole_utterances_to_fit_the_token_budget():
+    window = HistoryWindow(EOS, max_turns=None, max_tokens=10, low_water=1.0)
+    state = SessionState(history(4, 4, 3, 2))
+    # 13 tokens of history and 3 incoming leave room for 7: the first two utterances have to go
+    assert window.trim(state, incoming_tokens=3)
+    assert state.token_ids.tolist() == [[3, 3, EOS, 4, EOS]]
+
+
+def test_trim_drops_everything_when_nothing_fits():
+    window = HistoryWindow(EOS, max_turns=None, max_tokens=4)
+    state = SessionState(history(3, 3))
+    assert window.trim(state, incoming_tokens=4)
+    assert len(state) == 0
+
+
+def test_zero_turns_keeps_no_history():
+    window = HistoryWindow(EOS, max_turns=0, max_tokens=None)
+    state = SessionState(history(2, 2))
+    assert window.trim(state)
+    assert len(state) == 0
+
+
+def test_trim_cuts_back_to_the_low_water_mark():
+    window = HistoryWindow(EOS, max_turns=4, max_tokens=None, low_water=0.5)
+    full = history(*[2] * 10)
+    state = SessionState(full)
+    # Five exchanges against a limit of four: cut back to two, not to four
+    assert window.trim(state)
+    assert state.token_ids.tolist() == full[:, 12:].tolist()
+
+    window = HistoryWindow(EOS, max_turns=None, max_tokens=20, low_water=0.5)
+    state = SessionState(history(*[3] * 7))
+    assert window.trim(state, incoming_tokens=2)
+    assert len(state) == 6
+
+
+def test_cache_survives_the_turns_between_trims():
+    window = HistoryWindow(EOS)
+    state = SessionState(torch.zeros((1, 0), dtype=torch.long))
+    trims = 0
+    for turn in range(40):
+        trimmed = window.trim(state, incoming_tokens=8)
+        if trimmed:
+            trims += 1
+        elif turn > 0:
+            assert state.cached_length > 0
+        # A generate call leaves a cache over the prompt plus the reply
+        token_ids = torch.cat([state.token_ids, history(8, 12)], dim=-1)
+        state.update(token_ids, ((torch.zeros(1, 1, len(token_ids[0]), 1),),))
+    # Without hysteresis every turn after the window fills would be trimmed
+    assert 0 < trims <= 40 // 3
+
+
+def test_fit_input_clips_an_oversized_message():
+    window = HistoryWindow(EOS, max_tokens=3)
+    assert window.fit_input(torch.tensor([[5, 6, 7, 8, EOS]])).tolist() == [[7, 8, EOS]]
+
+
+def session(tokens, cache_elements=0):
+    """A session with ``tokens`` history ids (8 bytes each) and a float32 cache of ``cache_elements``."""
+    cache = ((torch.zeros(cache_elements),),) if cache_elements else None
+    return SessionState(torch.ones((1, tokens), dtype=torch.long), past_key_values=cache)
+
+
+def test_store_evicts_least_recently_used_over_max_entries():
+    store = SessionStore(max_entries=2, max_bytes=None, idle_ttl=None)
+    store.put("a", session(1))
+    store.put("b", session(1))
+    assert store.get("a") is not None
+    store.put("c", session(1))
+    assert "b" not in store
+    assert "a" in store and "c" in store
+    assert store.stats()["evictions"] == 1
+
+
+def test_store_expires_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "monotonic", lambda: now[0])
+    store = SessionStore(max_entries=None, max_bytes=None, idle_ttl=60)
+    store.put("a", session(1))
+    store.put("b", session(1))
+    now[0] += 30
+    assert store.get("b") is not None
+    now[0] += 31
+    assert store.get("a") is None
+    assert store.get("b") is not None
+    assert store.stats()["expirations"] == 1
+
+
+def test_store_drops_caches_before_evicting_over_max_bytes():
+    # Each session: 10 tokens (80 bytes) plus a 100-float cache (400 bytes)
+    store = SessionStore(max_entries=None, max_bytes=1000, idle_ttl=None)
+    store.put("a", session(10, 100))
+    store.put("b", session(10, 100))
+    store.put("c", session(10, 100))
+    stats = store.stats()
+    assert stats["entries"] == 3
+    # 1440 bytes: the two oldest caches go before anything is evicted
+    assert stats["cache_drops"] == 2
+    assert stats["evictions"] == 0
+    assert stats["resident_bytes"] == 80 + 80 + 480
+    assert store.get("a").past_key_values is None
+    assert store.get("b").past_key_values is None
+    assert store.get("c").past_key_values is not None
+
+
+def test_store_evicts_once_histories_alone_exceed_max_bytes():
+    store = SessionStore(max_entries=None, max_bytes=200, idle_ttl=None)
+    for key in "abc":
+        store.put(key, session(10))
+    assert len(store) == 2
+    assert "a" not in store
+    assert store.stats()["resident_bytes"] == 160
+
+
+def test_store_keeps_byte_accounting_on_put_and_pop():
+    store = SessionStore(max_entries=None, max_bytes=None, idle_ttl=None)
+    state = session(10, 100)
+    store.put("a", state)
+    state.update(torch.ones((1, 20), dtype=torch.long))
+    store.put("a", state)
+    assert store.stats()["resident_bytes"] == 160
+    assert store.pop("a") is state
+    assert store.pop("a") is None
+    assert store.stats()["resident_bytes"] == 0
+    assert store.stats()["misses"] == 0